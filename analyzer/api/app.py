@@ -1,16 +1,30 @@
 import logging
 
 from aiohttp import web, PAYLOAD_REGISTRY
+from aiohttp.payload import Order
 from aiohttp_apispec import setup_aiohttp_apispec, validation_middleware
 from configargparse import Namespace
 from types import AsyncGeneratorType, MappingProxyType
 from typing import AsyncIterable, Mapping
 
 from analyzer.api.routes import ROUTES
-from analyzer.api.middleware import error_middleware, handle_validation_error
+from analyzer.api.middleware import (
+    cache_middleware,
+    compression_middleware,
+    error_middleware,
+    etag_middleware,
+    handle_validation_error,
+)
 from analyzer.api.payload import AsyncGenJsonListPayload, JsonPayload
 from analyzer.config import Config
-from analyzer.utils.pg import setup_pg
+from analyzer.utils.cache import setup_cache
+from analyzer.utils.codec import set_json_codec
+from analyzer.utils.export import setup_export
+from analyzer.utils.ingest import setup_ingest
+from analyzer.utils.jobs import setup_jobs
+from analyzer.utils.metrics import Metrics
+from analyzer.utils.pg import setup_pg, setup_sync_pg
+from analyzer.utils.pool import setup_pool
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +35,13 @@ def init_app(args: Namespace, cfg: Config) -> web.Application:
     """
 
     # in debug mode we want to report errors
-    middlewares = [validation_middleware, error_middleware]
+    middlewares = [
+        compression_middleware,
+        etag_middleware,
+        cache_middleware,
+        validation_middleware,
+        error_middleware,
+    ]
     if cfg.DEBUG:
         middlewares.pop()
 
@@ -30,7 +50,19 @@ def init_app(args: Namespace, cfg: Config) -> web.Application:
         middlewares=middlewares,
     )
     app["config"] = cfg
+    app["citizens_json_renderer"] = args.citizens_json_renderer
+    app["citizens_stream_chunk_size"] = args.citizens_stream_chunk_size
+    app["compression_min_size"] = args.compression_min_size
+    app["compression_level"] = args.compression_level
+    set_json_codec(args.json_codec)
+    app["metrics"] = Metrics()
+    app.cleanup_ctx.append(lambda _: setup_pool(app, args=args))
     app.cleanup_ctx.append(lambda _: setup_pg(app, args=args))
+    app.cleanup_ctx.append(lambda _: setup_sync_pg(app, args=args))
+    app.cleanup_ctx.append(lambda _: setup_ingest(app, args=args))
+    app.cleanup_ctx.append(lambda _: setup_export(app, args=args))
+    app.cleanup_ctx.append(lambda _: setup_jobs(app, args=args))
+    app.cleanup_ctx.append(lambda _: setup_cache(app, args=args))
 
     # app.add_routes(routes)
     for route in ROUTES:
@@ -44,10 +76,12 @@ def init_app(args: Namespace, cfg: Config) -> web.Application:
         error_callback=handle_validation_error,
     )
 
-    # Can't figure out why this doesn't register the AsyncIterable
+    # aiohttp has its own payload for AsyncIterable (of bytes),
+    # which is tried before payloads registered in normal order
     PAYLOAD_REGISTRY.register(
         AsyncGenJsonListPayload,
         (AsyncGeneratorType, AsyncIterable),
+        order=Order.try_first,
     )
     PAYLOAD_REGISTRY.register(JsonPayload, (Mapping, MappingProxyType))
 
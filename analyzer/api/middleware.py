@@ -1,5 +1,7 @@
+import hashlib
 import logging
 
+from aiohttp import hdrs
 from aiohttp.web_exceptions import (
     HTTPException,
     HTTPBadRequest,
@@ -7,12 +9,19 @@ from aiohttp.web_exceptions import (
 )
 from aiohttp.web_middlewares import middleware
 from aiohttp.web_request import Request
+from aiohttp.web_response import Response
 from aiohttp.web_urldispatcher import Handler
+from functools import partial
 from http import HTTPStatus
-from typing import Optional, Mapping
+from typing import Optional, Mapping, Tuple
 from marshmallow import ValidationError
+from sqlalchemy import select
 
-from analyzer.api.payload import JsonPayload
+from analyzer.api.payload import AsyncGenPayload, EncodedPayload, JsonPayload
+from analyzer.db.schema import import_table
+from analyzer.utils.cache import BodyRecorder, ResponseCache
+from analyzer.utils.compression import CODINGS, negotiate
+from analyzer.utils.formats import negotiate_content_type
 
 logger = logging.getLogger(__name__)
 
@@ -57,3 +66,141 @@ async def error_middleware(request: Request, handler: Handler):
         logger.exception("Unhandled exception")
 
         raise format_http_error(HTTPInternalServerError)
+
+
+@middleware
+async def compression_middleware(request: Request, handler: Handler):
+    """
+    Compress JSON and record responses with the coding the client prefers.
+    Streamed ones are compressed by chunks as they are written
+    """
+
+    response = await handler(request)
+
+    payload = response.body if isinstance(response, Response) else None
+    if not isinstance(payload, (EncodedPayload, AsyncGenPayload)):
+        return response
+
+    if hdrs.VARY not in response.headers:
+        response.headers[hdrs.VARY] = hdrs.ACCEPT_ENCODING
+
+    coding = negotiate(request.headers.get(hdrs.ACCEPT_ENCODING, ""))
+    if coding is None:
+        return response
+
+    app = request.app
+    compressor = CODINGS[coding](
+        app["compression_level"], app["config"].COMPRESSION_EXECUTOR_SIZE
+    )
+    if isinstance(payload, AsyncGenPayload):
+        payload.compressor = compressor
+    elif payload.size >= app["compression_min_size"]:
+        response.body = await payload.compress(compressor)
+    else:
+        return response
+
+    response.headers[hdrs.CONTENT_ENCODING] = coding
+    return response
+
+
+def is_import_read(request: Request) -> bool:
+    """
+    Whether request is a GET to a view with `CACHEABLE` set, whose response
+    depends on the import `import_id` of the path only
+    """
+
+    view = request.match_info.handler
+    return request.method == hdrs.METH_GET and getattr(view, "CACHEABLE", False)
+
+
+def get_variant(request: Request) -> Tuple:
+    """
+    Parameters of the response besides the import: requests with the same
+    ones get the same body as encoded by the view
+    """
+
+    # Clients accepting the same content type get the same body
+    content_type = negotiate_content_type(request.headers.get(hdrs.ACCEPT, ""))
+    query = tuple(sorted(request.query.items()))
+    return request.match_info.handler.__name__, query, content_type
+
+
+@middleware
+async def etag_middleware(request: Request, handler: Handler):
+    """
+    Set strong `ETag` of responses of views with `CACHEABLE` set and answer
+    `If-None-Match` requests with 304 once the import version is looked up
+    """
+
+    if not is_import_read(request):
+        return await handler(request)
+
+    import_id = int(request.match_info["import_id"])
+    async with request.app["pg"].acquire() as conn:
+        version = await conn.scalar(
+            select([import_table.c.version]).where(
+                import_table.c.import_id == import_id
+            )
+        )
+    if version is None:
+        return await handler(request)
+
+    # Compressed bodies differ from uncompressed ones
+    coding = negotiate(request.headers.get(hdrs.ACCEPT_ENCODING, ""))
+    variant = repr((get_variant(request), coding)).encode()
+    digest = hashlib.blake2b(variant, digest_size=8).hexdigest()
+    etag = f"{import_id}-{version}-{digest}"
+
+    if_none_match = request.if_none_match or ()
+    if any(tag.value in (etag, "*") for tag in if_none_match):
+        request.app["metrics"].inc("etag.not_modified")
+        response = Response(status=HTTPStatus.NOT_MODIFIED)
+        response.etag = etag
+        return response
+
+    response = await handler(request)
+    # Body might be computed after a change committed since the version
+    # was looked up, its ETag just won't match the next time
+    if response.status == HTTPStatus.OK:
+        response.etag = etag
+
+    return response
+
+
+@middleware
+async def cache_middleware(request: Request, handler: Handler):
+    """
+    Serve GET requests to views with `CACHEABLE` set from `app["cache"]`.
+    Bodies are cached as encoded by the views, before compression
+    """
+
+    cache: ResponseCache = request.app["cache"]
+    if not is_import_read(request) or not cache.enabled:
+        return await handler(request)
+
+    import_id = int(request.match_info["import_id"])
+    key = (import_id, *get_variant(request))
+
+    entry = await cache.get(key)
+    if entry is not None:
+        payload = EncodedPayload(entry.body, content_type=entry.content_type)
+        return Response(body=payload)
+
+    generation = await cache.generation(import_id)
+    response = await handler(request)
+
+    payload = response.body if isinstance(response, Response) else None
+    if response.status != HTTPStatus.OK or payload is None:
+        return response
+
+    store = partial(cache.set, key, import_id, generation)
+    if isinstance(payload, EncodedPayload):
+        await store(payload._value, payload.content_type)
+    elif isinstance(payload, AsyncGenPayload):
+        # Streamed body is stored once it has been written
+        payload.recorder = BodyRecorder(
+            cache.max_entry_size,
+            partial(store, content_type=payload.content_type),
+        )
+
+    return response
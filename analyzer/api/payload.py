@@ -1,42 +1,125 @@
-import json
-
-from aiohttp import Payload
+from aiohttp import BytesPayload, Payload, web
 from aiohttp.payload import JsonPayload as BaseJsonPayload
-from aiohttp.typedefs import JSONEncoder
-from datetime import date
-from functools import singledispatch, partial
-from typing import Any
+from contextlib import aclosing
+from http import HTTPStatus
+from typing import Any, AsyncIterator, Optional
 
 from analyzer.config import Config
+from analyzer.utils.cache import BodyRecorder
+from analyzer.utils.codec import dumps
+from analyzer.utils.compression import Compressor
+from analyzer.utils.formats import RecordFormat
 
 
-@singledispatch
-def convert(value: Any) -> Any:
-    raise TypeError(f"Unserializable value: {value!r}")
-
-
-@convert.register(date)
-def convert_date(value: date) -> str:
-    return value.strftime(Config.BIRTH_DATE_FORMAT)
+class EncodedPayload(BytesPayload):
+    """
+    Payload of a body encoded beforehand, it is compressed as a whole
+    """
 
+    async def compress(self, compressor: Compressor) -> bytes:
+        return await compressor.compress(self._value) + compressor.flush()
 
-dumps = partial(json.dumps, default=convert, ensure_ascii=False)
 
+class JsonPayload(BaseJsonPayload, EncodedPayload):
+    """
+    JSON payload encoded with the codec of the process
+    """
 
-class JsonPayload(BaseJsonPayload):
     def __init__(
         self,
         value: Any,
         encoding: str = "utf-8",
         content_type: str = "application/json",
-        dumps: JSONEncoder = dumps,
         *args: Any,
         **kwargs: Any,
     ) -> None:
-        super().__init__(value, encoding, content_type, dumps, *args, **kwargs)
+        # Codecs encode into bytes, skip encoding into str of the base class
+        BytesPayload.__init__(
+            self,
+            dumps(value),
+            *args,
+            encoding=encoding,
+            content_type=content_type,
+            **kwargs,
+        )
+
+
+def json_response(
+    data: Any, status: int = HTTPStatus.OK, **kwargs: Any
+) -> web.Response:
+    """
+    `web.json_response` encoding `data` with the codec of the process
+    """
 
+    return web.Response(body=JsonPayload(data), status=status, **kwargs)
 
-class AsyncGenJsonListPayload(Payload):
+
+class RawJSON(str):
+    """
+    Value already encoded to JSON, it is written as is.
+    May hold several comma separated items of the list
+    """
+
+
+class AsyncGenPayload(Payload):
+    """
+    Payload of parts encoded from AsyncIterable instances.
+
+    Parts are collected in a buffer and written by chunks of at least
+    `chunk_size` bytes: every write is a trip through the event loop.
+    The writer waits for the client to drain its buffer, so slow
+    clients hold at most a few chunks in memory.
+    """
+
+    def __init__(
+        self,
+        value: Any,
+        chunk_size: int = Config.CITIZENS_STREAM_CHUNK_SIZE,
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        self.chunk_size = chunk_size
+        # Set by `compression_middleware` if the client accepts compression
+        self.compressor: Optional[Compressor] = None
+        # Set by `cache_middleware` to keep the body written to the client
+        self.recorder: Optional[BodyRecorder] = None
+        super().__init__(value, *args, **kwargs)
+
+    def iter_parts(self) -> AsyncIterator[bytes]:
+        raise NotImplementedError
+
+    async def write(self, writer):
+        buffer = bytearray()
+        # Parts release their resources even if the client has gone away
+        async with aclosing(self.iter_parts()) as parts:
+            async for part in parts:
+                buffer += part
+
+                if len(buffer) >= self.chunk_size:
+                    # The chunk may be kept by the transport, the buffer is reused
+                    await self.write_chunk(writer, bytes(buffer))
+                    buffer.clear()
+
+        await self.write_chunk(writer, bytes(buffer))
+        if self.compressor is not None:
+            await writer.write(self.compressor.flush())
+        if self.recorder is not None:
+            await self.recorder.finish()
+
+    async def write_chunk(self, writer, chunk: bytes) -> None:
+        if self.recorder is not None:
+            self.recorder.write(chunk)
+
+        if self.compressor is not None:
+            # Compressor may keep the chunk until it has enough data
+            chunk = await self.compressor.compress(chunk)
+            if not chunk:
+                return
+
+        await writer.write(chunk)
+
+
+class AsyncGenJsonListPayload(AsyncGenPayload):
     """
     Iterate over AsyncIterable instances to serialize
     the data by parts and send to client
@@ -52,21 +135,65 @@ class AsyncGenJsonListPayload(Payload):
         **kwargs: Any,
     ) -> None:
         self.root_object = root_object
-        super().__init__(value, encoding, content_type, *args, **kwargs)
+        super().__init__(
+            value, *args, content_type=content_type, encoding=encoding, **kwargs
+        )
 
-    async def write(self, writer):
-        await writer.write(('{"%s": [' % self.root_object).encode(self._encoding))
+    async def iter_parts(self) -> AsyncIterator[bytes]:
+        yield ('{"%s": [' % self.root_object).encode(self._encoding)
+
+        separator = b""
+        async with aclosing(self._value) as rows:
+            async for row in rows:
+                if isinstance(row, RawJSON):
+                    yield separator + row.encode(self._encoding)
+                else:
+                    yield separator + dumps(row)
+                separator = b","
 
-        first = True
-        async for row in self._value:
-            if not first:
-                await writer.write(b",")
-            else:
-                first = False
+        yield b"]}"
 
-            await writer.write(dumps(row).encode(self._encoding))
 
-        await writer.write(b"]}")
+class AsyncGenRecordsPayload(AsyncGenPayload):
+    """
+    Iterate over AsyncIterable of batches of rows
+    and send them encoded in `record_format`
+    """
 
+    def __init__(
+        self, value: Any, record_format: RecordFormat, *args: Any, **kwargs: Any
+    ) -> None:
+        self.record_format = record_format
+        super().__init__(
+            value, *args, content_type=record_format.content_type, **kwargs
+        )
+
+    async def iter_parts(self) -> AsyncIterator[bytes]:
+        yield self.record_format.start()
+        async with aclosing(self._value) as batches:
+            async for rows in batches:
+                yield self.record_format.encode(rows)
+        yield self.record_format.finish()
+
+
+class AsyncGenBytesPayload(AsyncGenPayload):
+    """
+    Send parts of AsyncIterable already encoded into bytes
+    """
 
-__all__ = ("JsonPayload", "AsyncGenJsonListPayload")
+    async def iter_parts(self) -> AsyncIterator[bytes]:
+        async with aclosing(self._value) as parts:
+            async for part in parts:
+                yield part
+
+
+__all__ = (
+    "EncodedPayload",
+    "JsonPayload",
+    "AsyncGenPayload",
+    "AsyncGenBytesPayload",
+    "AsyncGenJsonListPayload",
+    "AsyncGenRecordsPayload",
+    "RawJSON",
+    "json_response",
+)
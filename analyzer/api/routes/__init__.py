@@ -12,16 +12,36 @@ async def get_next_num(request: web.Request) -> web.Response:
     return web.Response(text=f"Next number for number {num} is: {num + 1}")
 """
 
-from .imports import ImportsView
+from .imports import ImportsView, ImportsStreamView, ImportsCopyView
+from .import_jobs import ImportJobView
+from .derived_imports import DerivedImportView
+from .export import ImportExportView
 from .citizens import CitizensView
 from .citizen import CitizenView
 from .citizen_presents import CitizenPresentsView
 from .age_stats import AgeStatsView
+from .metrics import MetricsView
+from .upload_sessions import (
+    UploadSessionsView,
+    UploadSessionView,
+    UploadSessionBatchView,
+    UploadSessionCommitView,
+)
 
 ROUTES = (
     ImportsView,
+    ImportsStreamView,
+    ImportsCopyView,
+    ImportJobView,
+    DerivedImportView,
+    ImportExportView,
+    UploadSessionsView,
+    UploadSessionView,
+    UploadSessionBatchView,
+    UploadSessionCommitView,
     CitizensView,
     CitizenView,
     CitizenPresentsView,
     AgeStatsView,
+    MetricsView,
 )
@@ -1,7 +1,7 @@
-from aiohttp import web
 from aiohttp_apispec import docs, response_schema
 from sqlalchemy import func, select, text
 
+from analyzer.api.payload import json_response
 from analyzer.api.schema import AgeStatsResponseSchema
 from analyzer.db.schema import citizen_table
 from analyzer.utils.pg import rounded
@@ -10,12 +10,20 @@ from .base import BaseCitizenView
 
 class AgeStatsView(BaseCitizenView):
     URL_PATH = r"/imports/{import_id:\d+}/cities/stats/percentile/age"
+    CACHEABLE = True
     CURRENT_DATE = text("TIMEZONE('utc', CURRENT_TIMESTAMP)")
 
-    @docs(summary="Citizens age stats grouped by city")
+    @docs(
+        summary="Citizens age stats grouped by city",
+        description=(
+            "Stats may be requested in bulk formats with `Accept` header, "
+            "see citizens of the import"
+        ),
+    )
     @response_schema(AgeStatsResponseSchema())
     async def get(self):
         await self.check_if_import_exists()
+        record_format = self.negotiate_format()
 
         age = func.age(self.CURRENT_DATE, citizen_table.c.birth_date)
         age = func.date_part("year", age)
@@ -36,6 +44,10 @@ class AgeStatsView(BaseCitizenView):
 
         async with self.pg.acquire() as conn:
             result = await conn.execute(query)
-            stats = [self.serialize_row(row) for row in await result.fetchall()]
+            serialize = self.get_serializer(query)
+            stats = [serialize(row) for row in await result.fetchall()]
 
-        return web.json_response(data={"data": stats})
+        if record_format is not None:
+            return self.records_response(query, stats, record_format)
+
+        return json_response(data={"data": stats})
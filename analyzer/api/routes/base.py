@@ -2,19 +2,58 @@
     Resource `View` base classes
 """
 
-from aiohttp import web
+from aiohttp import hdrs, web
+from aiohttp_apispec import request_schema
 from aiopg import Pool
-from aiopg.sa.result import RowProxy
-from datetime import date
-from decimal import Decimal
+from http import HTTPStatus
+from marshmallow import Schema
 from sqlalchemy.sql import Select
-from sqlalchemy import select, func, and_
-
-from analyzer.db.schema import citizen_table, relation_table, import_table, Gender
+from sqlalchemy import select
+from typing import (
+    Any,
+    AsyncIterable,
+    Callable,
+    Optional,
+    Sequence,
+    Type,
+    Union,
+)
+
+from analyzer.api.middleware import format_http_error
+from analyzer.api.payload import AsyncGenRecordsPayload, json_response
+from analyzer.api.serializer import RowSerializer, get_row_serializer
+from analyzer.api.validator import MalformedJsonError
+from analyzer.db.schema import citizen_table, import_table
+from analyzer.utils.formats import (
+    CONTENT_TYPES,
+    FORMATS,
+    RecordFormat,
+    negotiate_content_type,
+)
+from analyzer.utils.ingest import single_batch
+from analyzer.utils.pool import ProcessPool
+
+
+def request_schema_docs(schema: Schema, **kwargs) -> Callable:
+    """
+    Document request body with `schema`, but leave its validation
+    to the handler: `validation_middleware` skips handlers with no
+    `__schemas__`
+    """
+
+    def wrapper(handler: Callable) -> Callable:
+        handler = request_schema(schema, **kwargs)(handler)
+        del handler.__schemas__
+        return handler
+
+    return wrapper
 
 
 class BaseView(web.View):
     URL_PATH: str
+    # GET responses are cached by `cache_middleware` and validated by ETags
+    # of `etag_middleware` until the import `import_id` of the path is changed
+    CACHEABLE = False
 
     @property
     def app(self) -> web.Application:
@@ -24,6 +63,37 @@ class BaseView(web.View):
     def pg(self) -> Pool:
         return self.request.app["pg"]
 
+    @property
+    def pool(self) -> ProcessPool:
+        return self.request.app["pool"]
+
+    def created(self, import_id: int, replayed: bool = False) -> web.Response:
+        """
+        Response of the created import, `replayed` if it has been created
+        by a former request
+        """
+
+        return json_response(
+            data={"data": {"import_id": import_id}},
+            status=HTTPStatus.CREATED,
+            headers={"Idempotent-Replayed": "true"} if replayed else None,
+        )
+
+    async def load_body(self, load: Callable[[bytes], Any]) -> Any:
+        """
+        Decode and validate request body with `load(body)`.
+        Large bodies are processed in the process pool.
+        """
+
+        body = await self.request.read()
+        try:
+            if len(body) < self.app["config"].VALIDATION_POOL_MIN_BODY_SIZE:
+                return load(body)
+
+            return await self.pool.run(load, body)
+        except MalformedJsonError as err:
+            raise format_http_error(web.HTTPBadRequest, f"Malformed JSON: {err}")
+
 
 class BaseImportView(BaseView):
     @property
@@ -43,48 +113,68 @@ class BaseImportView(BaseView):
 
 class BaseCitizenView(BaseImportView):
 
-    def serialize_row(self, row: RowProxy) -> dict:
-        row = dict(row)
-
-        for k, v in row.items():
-            if isinstance(v, date):
-                row[k] = v.strftime(self.app["config"].BIRTH_DATE_FORMAT)
-            if isinstance(v, Gender):
-                row[k] = v.value
-            if isinstance(v, Decimal):
-                row[k] = float(v)
+    def get_serializer(
+        self, query: Select, fields: Optional[Sequence[str]] = None
+    ) -> RowSerializer:
+        """
+        Compiled serializer of `query` rows, see `analyzer.api.serializer`
+        """
+
+        return get_row_serializer(query, self.app["config"].BIRTH_DATE_FORMAT, fields)
+
+    def negotiate_format(self) -> Optional[Type[RecordFormat]]:
+        """
+        Record format the client accepts, None for JSON
+        """
+
+        content_type = negotiate_content_type(self.request.headers.get(hdrs.ACCEPT, ""))
+        if content_type is None:
+            raise format_http_error(
+                web.HTTPNotAcceptable,
+                f"Supported content types: {', '.join(CONTENT_TYPES)}",
+            )
 
-        return row
+        return FORMATS.get(content_type)
+
+    def records_response(
+        self,
+        query: Select,
+        batches: Union[AsyncIterable[Sequence[dict]], Sequence[dict]],
+        record_format: Type[RecordFormat],
+        fields: Optional[Sequence[str]] = None,
+    ) -> web.Response:
+        """
+        Response of serialized `query` rows encoded in `record_format`
+        by batches, as they are produced. Rows already fetched at once
+        may be passed as a single batch
+        """
+
+        if isinstance(batches, Sequence):
+            batches = single_batch(batches)
+
+        columns = {column.key: column.type for column in query.selected_columns}
+        if fields is not None:
+            columns = {field: columns[field] for field in fields}
+
+        payload = AsyncGenRecordsPayload(
+            batches,
+            record_format(columns),
+            chunk_size=self.app["citizens_stream_chunk_size"],
+        )
+        return web.Response(body=payload)
 
     @property
     def CITIZENS_QUERY(self) -> Select:
-        return (
-            select(
-                [
-                    citizen_table.c.citizen_id,
-                    citizen_table.c.name,
-                    citizen_table.c.birth_date,
-                    citizen_table.c.gender,
-                    citizen_table.c.town,
-                    citizen_table.c.street,
-                    citizen_table.c.building,
-                    citizen_table.c.apartment,
-                    func.array_remove(
-                        func.array_agg(relation_table.c.relative_id), None
-                    ).label("relatives"),
-                ]
-            )
-            .select_from(
-                citizen_table.outerjoin(
-                    relation_table,
-                    and_(
-                        citizen_table.c.import_id == relation_table.c.import_id,
-                        citizen_table.c.citizen_id == relation_table.c.citizen_id,
-                    ),
-                )
-            )
-            .group_by(
-                citizen_table.c.import_id,
+        return select(
+            [
                 citizen_table.c.citizen_id,
-            )
+                citizen_table.c.name,
+                citizen_table.c.birth_date,
+                citizen_table.c.gender,
+                citizen_table.c.town,
+                citizen_table.c.street,
+                citizen_table.c.building,
+                citizen_table.c.apartment,
+                citizen_table.c.relatives,
+            ]
         )
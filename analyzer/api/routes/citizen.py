@@ -1,19 +1,20 @@
 import logging
 
 
-from aiohttp import web
 from aiohttp.web_exceptions import HTTPNotFound
-from aiohttp_apispec import docs, request_schema, response_schema
+from aiohttp_apispec import docs, response_schema
 from aiopg.sa import SAConnection
-from datetime import date, datetime
 from aiopg.sa.result import RowProxy
 from marshmallow import ValidationError
-from sqlalchemy import and_, or_
-from typing import List
+from sqlalchemy import and_, func, or_
+from typing import Callable, List
 
+from analyzer.api.payload import json_response
 from analyzer.api.schema import PatchCitizenSchema, PatchCitizenResponseSchema
-from analyzer.db.schema import citizen_table, relation_table
-from .base import BaseCitizenView
+from analyzer.api.validator import load_patch_citizen_body
+from analyzer.db.schema import citizen_table, import_table, relation_table
+from analyzer.utils.cache import notify_invalidation
+from .base import BaseCitizenView, request_schema_docs
 
 
 logger = logging.getLogger(__name__)
@@ -26,10 +27,6 @@ class CitizenView(BaseCitizenView):
     def citizen_id(self):
         return int(self.request.match_info.get("citizen_id"))
 
-    @classmethod
-    def convert_client_date(cls, date: date) -> datetime:
-        return datetime.strptime(date, "%d.%m.%Y").strftime("%Y-%m-%d")
-
     async def acquire_lock(self, conn: SAConnection, import_id: int) -> None:
         await conn.execute("SELECT pg_advisory_xact_lock(%s)", (import_id,))
 
@@ -57,10 +54,10 @@ class CitizenView(BaseCitizenView):
         citizen: RowProxy,
         data: dict,
     ) -> None:
-        values = {k: v for k, v in data.items() if k != "relatives"}
-
-        if "birth_date" in values:
-            values["birth_date"] = self.convert_client_date(values["birth_date"])
+        # Relatives of the citizen itself are written as a whole,
+        # relatives of its (former) relatives are changed by
+        # `add_relatives` and `remove_relatives`
+        values = dict(data)
 
         if values:
             query = (
@@ -137,6 +134,10 @@ class CitizenView(BaseCitizenView):
                 }
             )
 
+        await self.update_counterparts(
+            conn, import_id, citizen_id, relative_ids, func.array_append
+        )
+
     async def remove_relatives(
         self,
         conn: SAConnection,
@@ -167,11 +168,47 @@ class CitizenView(BaseCitizenView):
         query = relation_table.delete().where(or_(*conditions))
         await conn.execute(query)
 
+        await self.update_counterparts(
+            conn, import_id, citizen_id, relative_ids, func.array_remove
+        )
+
+    async def update_counterparts(
+        self,
+        conn: SAConnection,
+        import_id: int,
+        citizen_id: int,
+        relative_ids: List[int],
+        update: Callable,
+    ) -> None:
+        """
+        Append `citizen_id` to (or remove it from) `citizen_table.c.relatives`
+        of the citizens `relative_ids` with `update` array function
+        """
+
+        relative_ids = [
+            relative_id for relative_id in relative_ids if relative_id != citizen_id
+        ]
+        if not relative_ids:
+            return
+
+        query = (
+            citizen_table.update()
+            .values(relatives=update(citizen_table.c.relatives, citizen_id))
+            .where(
+                and_(
+                    citizen_table.c.import_id == import_id,
+                    citizen_table.c.citizen_id.in_(relative_ids),
+                )
+            )
+        )
+        await conn.execute(query)
+
     @docs(summary="Update citizen data from import `import_id` with id `citizen_id`")
-    @request_schema(PatchCitizenSchema())
+    @request_schema_docs(PatchCitizenSchema())
     @response_schema(PatchCitizenResponseSchema())
     async def patch(self):
-        data = await self.request.json()
+        # Large lists of relatives are validated in the process pool
+        data = await self.load_body(load_patch_citizen_body)
         async with self.pg.acquire() as conn:
             async with conn.begin() as _:
 
@@ -191,6 +228,21 @@ class CitizenView(BaseCitizenView):
                     data["data"],
                 )
 
+                # Changed import must not be found by the content of another one
+                # and must not be served by its former ETags
+                await conn.execute(
+                    import_table.update()
+                    .values(content_hash=None, version=import_table.c.version + 1)
+                    .where(import_table.c.import_id == self.import_id)
+                )
+
                 citizen = await self.get_citizen(conn, self.import_id, self.citizen_id)
 
-        return web.json_response(data={"data": self.serialize_row(citizen)})
+                # Other processes drop their responses once the change commits
+                await notify_invalidation(conn, self.app["cache"], self.import_id)
+
+        # Responses computed before the commit are stale
+        await self.app["cache"].invalidate(self.import_id)
+
+        serialize = self.get_serializer(self.CITIZENS_QUERY)
+        return json_response(data={"data": serialize(citizen)})
@@ -1,9 +1,9 @@
-from aiohttp import web
 from aiohttp_apispec import docs, response_schema
 from itertools import groupby
 from http import HTTPStatus
 from sqlalchemy import Integer, cast, func, select, and_
 
+from analyzer.api.payload import json_response
 from analyzer.api.schema import CitizenPresentsResponseSchema
 from analyzer.db.schema import citizen_table, relation_table
 from .base import BaseCitizenView
@@ -11,11 +11,20 @@ from .base import BaseCitizenView
 
 class CitizenPresentsView(BaseCitizenView):
     URL_PATH = r"/imports/{import_id:\d+}/citizens/presents"
+    CACHEABLE = True
 
-    @docs(summary="Get data about how many presents do citizens buy each month")
+    @docs(
+        summary="Get data about how many presents do citizens buy each month",
+        description=(
+            "Presents may be requested in bulk formats with `Accept` header, "
+            "see citizens of the import: rows of `month`, `citizen_id` "
+            "and `presents`"
+        ),
+    )
     @response_schema(CitizenPresentsResponseSchema(), code=HTTPStatus.OK.value)
     async def get(self):
         await self.check_if_import_exists()
+        record_format = self.negotiate_format()
 
         month = func.date_part("month", citizen_table.c.birth_date)
         month = cast(month, Integer).label("month")
@@ -45,15 +54,15 @@ class CitizenPresentsView(BaseCitizenView):
             result = await conn.execute(query)
             rows = await result.fetchall()
 
+        if record_format is not None:
+            serialize = self.get_serializer(query)
+            presents = [serialize(row) for row in rows]
+            return self.records_response(query, presents, record_format)
+
         data = {i: [] for i in range(1, 13)}
+        serialize = self.get_serializer(query, ("citizen_id", "presents"))
 
         for month, rows in groupby(rows, key=lambda row: row["month"]):
-            for row in rows:
-                data[month].append(
-                    {
-                        "citizen_id": row["citizen_id"],
-                        "presents": row["presents"],
-                    }
-                )
+            data[month].extend(map(serialize, rows))
 
-        return web.json_response(data={"data": data})
+        return json_response(data={"data": data})
@@ -1,23 +1,197 @@
 from aiohttp import web
-from aiohttp_apispec import docs, response_schema
+from aiohttp_apispec import docs, querystring_schema, response_schema
+from contextlib import aclosing
+from marshmallow import ValidationError
+from sqlalchemy import Text, cast, func, literal, select
+from sqlalchemy.sql import Select
+from typing import AsyncIterator, Mapping, Optional, Sequence
 
-from analyzer.utils.pg import SelectQuery
-from analyzer.api.schema import CitizensResponseSchema
+from analyzer.utils.pg import SelectQuery, to_char_format
+from analyzer.api.payload import AsyncGenJsonListPayload, RawJSON, json_response
+from analyzer.api.schema import CitizensQuerySchema, CitizensResponseSchema
+from analyzer.api.validator import CITIZEN_FIELDS
 from analyzer.db.schema import citizen_table
 from .base import BaseCitizenView
 
+FILTER_FIELDS = ("town", "street", "gender")
+PAGE_FIELDS = ("limit", "after", "cursor")
+
 
 class CitizensView(BaseCitizenView):
     URL_PATH = r"/imports/{import_id:\d+}/citizens"
+    CACHEABLE = True
+
+    def make_query(self, fields: Sequence[str], params: Mapping) -> Select:
+        """
+        Citizen columns of `fields` for the citizens of the import matching
+        the filters of `params`. `(import_id, town, street)` and
+        `(import_id, street)` indexes are used for the filters
+        """
+
+        query = select([citizen_table.c[field] for field in fields]).where(
+            citizen_table.c.import_id == self.import_id
+        )
+
+        for field in FILTER_FIELDS:
+            if field in params:
+                query = query.where(citizen_table.c[field] == params[field])
+
+        return query
+
+    def make_page_query(
+        self,
+        fields: Sequence[str],
+        params: Mapping,
+        after: Optional[int],
+        limit: int,
+    ) -> Select:
+        """
+        Keyset page of citizens: an index range scan of the citizen
+        primary key
+        """
+
+        query = (
+            self.make_query(fields, params)
+            .order_by(citizen_table.c.citizen_id)
+            .limit(limit)
+        )
+
+        if after is not None:
+            query = query.where(citizen_table.c.citizen_id > after)
+
+        return query
+
+    def make_json_query(self, fields: Sequence[str], params: Mapping) -> Select:
+        """
+        Citizens rendered into JSON by PostgreSQL, one text row per citizen
+        """
+
+        date_format = to_char_format(self.app["config"].BIRTH_DATE_FORMAT)
+        values = []
+        for field in fields:
+            value = citizen_table.c[field]
+            if field == "birth_date":
+                value = func.to_char(value, date_format)
+            values.extend((literal(field), value))
+
+        return self.make_query(fields, params).with_only_columns(
+            [cast(func.json_build_object(*values), Text).label("citizen")]
+        )
+
+    async def iter_citizens(self, query: Select) -> AsyncIterator[dict]:
+        serialize = self.get_serializer(query)
+        async with aclosing(aiter(SelectQuery(query, self.pg))) as rows:
+            async for row in rows:
+                yield serialize(row)
+
+    async def iter_citizens_json(self, query: Select) -> AsyncIterator[RawJSON]:
+        # Each fetched batch of citizens is sent as a single chunk
+        async with aclosing(SelectQuery(query, self.pg).batches()) as batches:
+            async for rows in batches:
+                yield RawJSON(",".join([row[0] for row in rows]))
 
-    @docs(summary="Get citizens for the specified import")
+    async def iter_records(self, query: Select) -> AsyncIterator[Sequence[dict]]:
+        serialize = self.get_serializer(query)
+        async with aclosing(SelectQuery(query, self.pg).batches()) as batches:
+            async for rows in batches:
+                yield [serialize(row) for row in rows]
+
+    def stream(self, citizens: AsyncIterator) -> web.Response:
+        # Citizens are serialized and sent by chunks as they are fetched
+        payload = AsyncGenJsonListPayload(
+            citizens, chunk_size=self.app["citizens_stream_chunk_size"]
+        )
+        return web.Response(body=payload)
+
+    @staticmethod
+    def get_page_params(params: Mapping) -> dict:
+        """
+        Projection and filters of the paginated query, as tokens keep them
+        """
+
+        page_params = {field: params[field] for field in FILTER_FIELDS if field in params}
+        if "fields" in params:
+            page_params["fields"] = list(dict.fromkeys(params["fields"]))
+        return page_params
+
+    async def get_page(self, fields: Sequence[str], params: Mapping) -> web.Response:
+        page_params = self.get_page_params(params)
+        page = params.get("cursor") or {
+            "import_id": self.import_id,
+            "after": params.get("after"),
+            "limit": params.get("limit", self.app["config"].CITIZENS_PAGE_SIZE),
+        }
+        if page["import_id"] != self.import_id:
+            raise ValidationError({"cursor": ["Token belongs to another import"]})
+
+        if "cursor" in params:
+            # Following pages are pages of the query of the first one
+            token_params = self.get_page_params(page)
+            if any(token_params.get(key) != page_params[key] for key in page_params):
+                raise ValidationError({"cursor": ["Token belongs to another query"]})
+            page_params = token_params
+            fields = tuple(page_params.get("fields", CITIZEN_FIELDS))
+
+        # Keyset of the next page is selected even if it is not requested
+        query_fields = fields if "citizen_id" in fields else ("citizen_id", *fields)
+        # One more citizen tells if there is the next page
+        query = self.make_page_query(
+            query_fields, page_params, page["after"], page["limit"] + 1
+        )
+        async with self.pg.acquire() as conn:
+            result = await conn.execute(query)
+            rows = await result.fetchall()
+
+        next_page = None
+        if len(rows) > page["limit"]:
+            rows = rows[: page["limit"]]
+            next_page = {**page, **page_params, "after": rows[-1]["citizen_id"]}
+
+        # Keyset column is left out by the serializer unless requested
+        serialize = self.get_serializer(query, fields)
+        citizens = [serialize(row) for row in rows]
+
+        return json_response(
+            data={
+                "data": citizens,
+                "next": CitizensQuerySchema().dump({"cursor": next_page})["cursor"],
+            }
+        )
+
+    @docs(
+        summary="Get citizens for the specified import",
+        description=(
+            "Only citizen `fields` (comma separated) are returned if passed, "
+            "citizens may be filtered by `town`, `street` and `gender`. "
+            "Citizens are returned by pages ordered by `citizen_id` if any "
+            "of the pagination parameters is passed: `limit` citizens with "
+            "`citizen_id` greater than `after`. Pass `next` token of the "
+            "response as `cursor` to get the next page of the same fields "
+            "and filters, `next` is null for the last one. Whole imports may be requested in bulk formats "
+            "with `Accept` header: `application/x-ndjson`, `text/csv`, "
+            "`application/msgpack` or `application/vnd.apache.arrow.stream`"
+        ),
+    )
+    @querystring_schema(CitizensQuerySchema())
     @response_schema(CitizensResponseSchema())
     async def get(self):
         await self.check_if_import_exists()
 
-        query = self.CITIZENS_QUERY.where(citizen_table.c.import_id == self.import_id)
+        params = self.request["querystring"]
+        fields = tuple(dict.fromkeys(params.get("fields", CITIZEN_FIELDS)))
+        record_format = self.negotiate_format()
 
-        async with self.pg.acquire() as conn:
-            data = [self.serialize_row(row) async for row in SelectQuery(query, conn)]
+        # Pages are always returned in JSON with the token of the next one
+        if params.keys() & set(PAGE_FIELDS):
+            return await self.get_page(fields, params)
+
+        if record_format is not None:
+            query = self.make_query(fields, params)
+            return self.records_response(query, self.iter_records(query), record_format)
+
+        if self.app["citizens_json_renderer"] == "postgres":
+            query = self.make_json_query(fields, params)
+            return self.stream(self.iter_citizens_json(query))
 
-        return web.json_response(data={"data": data})
+        query = self.make_query(fields, params)
+        return self.stream(self.iter_citizens(query))
@@ -0,0 +1,158 @@
+from aiohttp import web
+from aiohttp_apispec import docs, response_schema
+from aiopg.sa import SAConnection
+from http import HTTPStatus
+from marshmallow import ValidationError
+from sqlalchemy import select
+from typing import Sequence
+
+from analyzer.api.schema import DeriveImportSchema, ImportsResponseSchema
+from analyzer.api.validator import CITIZEN_FIELDS, load_derive_import_body
+from analyzer.db.schema import (
+    citizen_stage_table,
+    citizen_table,
+    import_table,
+    relation_stage_table,
+    relation_table,
+    stage_id_seq,
+)
+from analyzer.utils.ingest import insert_stage_rows, make_move_stage_query
+
+from .base import BaseImportView, request_schema_docs
+
+CITIZEN_COLUMNS = ", ".join(
+    column for column in citizen_table.columns.keys() if column != "import_id"
+)
+
+# Copy rows of the source import except for the changed and removed citizens
+COPY_CITIZENS_QUERY = (
+    f"INSERT INTO {citizen_table.name} (import_id, {CITIZEN_COLUMNS}) "
+    f"SELECT %(import_id)s, {CITIZEN_COLUMNS} FROM {citizen_table.name} "
+    f"WHERE import_id = %(source_id)s AND NOT citizen_id = ANY(%(touched)s)"
+)
+COPY_RELATIONS_QUERY = (
+    f"INSERT INTO {relation_table.name} (import_id, citizen_id, relative_id) "
+    f"SELECT %(import_id)s, citizen_id, relative_id FROM {relation_table.name} "
+    f"WHERE import_id = %(source_id)s AND NOT citizen_id = ANY(%(touched)s)"
+)
+
+# Relations of the source import are known to be paired, so only
+# relations of changed and removed (`touched`) citizens are checked.
+# Both queries use primary key indexes and return (citizen_id, relative_id)
+DERIVED_CHECKS = (
+    # Relation of a changed citizen has no counterpart: the relative
+    # has been changed or removed as well, or has no such relation
+    f"SELECT s.citizen_id, s.relative_id FROM {relation_stage_table.name} AS s "
+    f"WHERE s.stage_id = %(stage_id)s AND NOT EXISTS ("
+    f"SELECT 1 FROM {relation_stage_table.name} AS c "
+    f"WHERE c.stage_id = s.stage_id "
+    f"AND c.citizen_id = s.relative_id AND c.relative_id = s.citizen_id"
+    f") AND (s.relative_id = ANY(%(touched)s) OR NOT EXISTS ("
+    f"SELECT 1 FROM {relation_table.name} AS c "
+    f"WHERE c.import_id = %(source_id)s "
+    f"AND c.citizen_id = s.relative_id AND c.relative_id = s.citizen_id"
+    f")) ORDER BY s.citizen_id, s.relative_id LIMIT 1",
+    # Unchanged citizen refers to a relative which has been removed
+    # or has dropped the relation
+    f"SELECT r.relative_id, r.citizen_id FROM {relation_table.name} AS r "
+    f"WHERE r.import_id = %(source_id)s AND r.citizen_id = ANY(%(touched)s) "
+    f"AND NOT r.relative_id = ANY(%(touched)s) AND NOT EXISTS ("
+    f"SELECT 1 FROM {relation_stage_table.name} AS c "
+    f"WHERE c.stage_id = %(stage_id)s "
+    f"AND c.citizen_id = r.citizen_id AND c.relative_id = r.relative_id"
+    f") ORDER BY r.relative_id, r.citizen_id LIMIT 1",
+)
+
+
+class DerivedImportView(BaseImportView):
+    """
+    Creates a new import from an existing one and changes of its citizens.
+
+    Changed citizens are written into the staging tables and checked
+    against the source import, the rest is copied with a single
+    `INSERT ... SELECT` per table: the request costs the size of
+    the changes rather than the size of the import.
+    """
+
+    URL_PATH = r"/imports/{import_id:\d+}/derive"
+
+    async def acquire_lock(self, conn: SAConnection) -> None:
+        # Blocks `CitizenView.patch` of the source import, but
+        # not other imports derived from it at the same time
+        await conn.execute("SELECT pg_advisory_xact_lock_shared(%s)", (self.import_id,))
+
+    async def check(self, conn: SAConnection, params: dict) -> None:
+        for query in DERIVED_CHECKS:
+            result = await conn.execute(query, params)
+            violation = await result.first()
+            if violation is not None:
+                citizen_id, relative_id = violation.as_tuple()
+                raise ValidationError(
+                    {
+                        "_schema": [
+                            f"citizen {relative_id} does not have relation with {citizen_id}"
+                        ]
+                    }
+                )
+
+    async def derive(
+        self,
+        conn: SAConnection,
+        citizens: Sequence[dict],
+        removed: Sequence[int],
+    ) -> int:
+        stage_id = await conn.scalar(select([stage_id_seq.next_value()]))
+        await insert_stage_rows(conn, stage_id, citizens)
+
+        params = {
+            "source_id": self.import_id,
+            "stage_id": stage_id,
+            "touched": [citizen["citizen_id"] for citizen in citizens] + list(removed),
+        }
+        await self.check(conn, params)
+
+        result = await conn.execute(
+            import_table.insert().values().returning(import_table.c.import_id)
+        )
+        params["import_id"] = await result.scalar()
+
+        for copy_query, table, stage in (
+            (COPY_CITIZENS_QUERY, citizen_table, citizen_stage_table),
+            (COPY_RELATIONS_QUERY, relation_table, relation_stage_table),
+        ):
+            await conn.execute(copy_query, params)
+            await conn.execute(make_move_stage_query(table, stage), params)
+
+        return params["import_id"]
+
+    @docs(
+        summary="Create import from import `import_id` and changes of its citizens",
+        description=(
+            "Citizens of the request are added to the new import, replacing "
+            "ones with the same `citizen_id`; `removed` citizens are left out. "
+            "Relatives of changed citizens are replaced as a whole, so both "
+            "sides of a changed relation have to be sent. The source import "
+            "stays unchanged"
+        ),
+    )
+    @request_schema_docs(DeriveImportSchema())
+    @response_schema(ImportsResponseSchema(), code=HTTPStatus.CREATED.value)
+    async def post(self):
+        rows, removed = await self.load_body(load_derive_import_body)
+        citizens = [dict(zip(CITIZEN_FIELDS, row)) for row in rows]
+
+        async with self.pg.acquire() as conn:
+            async with conn.begin() as _:
+                await self.acquire_lock(conn)
+
+                result = await conn.execute(
+                    select([import_table.c.import_id]).where(
+                        import_table.c.import_id == self.import_id
+                    )
+                )
+                if await result.scalar() is None:
+                    raise web.HTTPNotFound()
+
+                import_id = await self.derive(conn, citizens, removed)
+
+        return self.created(import_id)
@@ -0,0 +1,40 @@
+import uuid
+
+from aiohttp import web
+from aiohttp_apispec import docs, querystring_schema
+
+from analyzer.api.payload import AsyncGenBytesPayload
+from analyzer.api.schema import ExportQuerySchema
+from analyzer.utils.export import ExportEngine
+
+from .base import BaseImportView
+
+
+class ImportExportView(BaseImportView):
+    URL_PATH = r"/imports/{import_id:\d+}/export"
+
+    @property
+    def export(self) -> ExportEngine:
+        return self.app["export"]
+
+    @docs(
+        summary="Export import with citizens and their relations",
+        description=(
+            "Returns `multipart/mixed` body with `citizen` and `relation` parts "
+            "holding rows of the tables in COPY `format`: `csv` (default, with "
+            "a header) or PostgreSQL `binary`. The body may be posted to "
+            "`/imports/copy` as is to create a new import"
+        ),
+    )
+    @querystring_schema(ExportQuerySchema())
+    async def get(self):
+        await self.check_if_import_exists()
+
+        format = self.request["querystring"].get("format", "csv")
+        boundary = uuid.uuid4().hex
+        payload = AsyncGenBytesPayload(
+            self.export.export(self.import_id, format, boundary),
+            chunk_size=self.app["citizens_stream_chunk_size"],
+            content_type=f"multipart/mixed; boundary={boundary}",
+        )
+        return web.Response(body=payload)
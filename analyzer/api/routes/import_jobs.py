@@ -0,0 +1,42 @@
+from aiohttp import web
+from aiohttp_apispec import docs, response_schema
+from http import HTTPStatus
+
+from analyzer.api.payload import json_response
+from analyzer.api.schema import ImportJobResponseSchema
+from analyzer.db.schema import import_job_table
+from .base import BaseView
+
+
+class ImportJobView(BaseView):
+    URL_PATH = r"/imports/jobs/{job_id:\d+}"
+
+    @property
+    def job_id(self) -> int:
+        return int(self.request.match_info.get("job_id"))
+
+    @docs(summary="Get state of the asynchronous import job")
+    @response_schema(ImportJobResponseSchema(), code=HTTPStatus.OK.value)
+    async def get(self):
+        query = import_job_table.select().where(
+            import_job_table.c.job_id == self.job_id
+        )
+
+        async with self.pg.acquire() as conn:
+            result = await conn.execute(query)
+            job = await result.fetchone()
+
+        if not job:
+            raise web.HTTPNotFound()
+
+        return json_response(
+            data={
+                "data": {
+                    "job_id": job["job_id"],
+                    "phase": job["phase"].value,
+                    "rows_written": job["rows_written"],
+                    "import_id": job["import_id"],
+                    "error": job["error"],
+                }
+            }
+        )
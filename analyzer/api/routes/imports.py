@@ -1,95 +1,239 @@
 from aiohttp import web
-from aiohttp_apispec import docs, request_schema, response_schema
-from aiomisc import chunk_list
-from datetime import datetime, date
+from functools import partial
+from aiohttp.web_urldispatcher import DynamicResource
+from aiohttp_apispec import docs, response_schema
 from http import HTTPStatus
-from typing import Generator
-from sqlalchemy import insert
-
-from analyzer.api.schema import ImportsSchema, ImportsResponseSchema
-from analyzer.db.schema import citizen_table, relation_table, import_table
-from analyzer.utils.pg import MAX_QUERY_ARGS
-
-from .base import BaseView
+from marshmallow import ValidationError
+from marshmallow.fields import Field
+from typing import Mapping, Optional
+
+from analyzer.api.middleware import format_http_error
+from analyzer.api.payload import json_response
+from analyzer.api.schema import (
+    ImportJobIdResponseSchema,
+    ImportsResponseSchema,
+    ImportsStreamValidator,
+)
+from analyzer.api.validator import (
+    CITIZEN_FIELDS,
+    CompiledCitizenSchema,
+    CompiledImportsSchema,
+    load_imports_body,
+)
+from analyzer.utils.export import ExportEngine
+from analyzer.utils.ingest import (
+    CitizenBatches,
+    DuplicateImportError,
+    IngestEngine,
+    find_import,
+    single_batch,
+)
+from analyzer.utils.jobs import ImportJobQueue
+from analyzer.utils.json_stream import JsonStreamError, iter_json_array
+
+from .base import BaseView, request_schema_docs
+from .import_jobs import ImportJobView
 
 
 class ImportsView(BaseView):
     URL_PATH = "/imports"
 
-    MAX_CITIZENS_PER_INSERT = MAX_QUERY_ARGS // len(citizen_table.columns)
-    MAX_RELATIONS_PER_INSERT = MAX_QUERY_ARGS // len(relation_table.columns)
+    @property
+    def ingest(self) -> IngestEngine:
+        return self.app["ingest"]
 
-    @classmethod
-    def convert_client_date(cls, date: date) -> datetime:
-        return datetime.strptime(date, "%d.%m.%Y").strftime("%Y-%m-%d")
+    @property
+    def jobs(self) -> ImportJobQueue:
+        return self.app["jobs"]
 
-    @classmethod
-    def make_citizen_table_rows(cls, citizens: dict, import_id: int) -> Generator:
+    @property
+    def respond_async(self) -> bool:
         """
-        Generate rows to insert into `citizen_table` lazy.
-
-        Important:
-            One generated row has no relatives field.
-            Call `ImportsView.make_relations_table_rows(citizens, import_id)`
-            to generate relatives for each citizen.
+        Whether client asked to process the request asynchronously (RFC 7240)
         """
 
-        for citizen in citizens:
-            yield {
-                "import_id": import_id,
-                "citizen_id": citizen["citizen_id"],
-                "name": citizen["name"],
-                "birth_date": cls.convert_client_date(citizen["birth_date"]),
-                "gender": citizen["gender"],
-                "town": citizen["town"],
-                "street": citizen["street"],
-                "building": citizen["building"],
-                "apartment": citizen["apartment"],
-            }
-
-    @classmethod
-    def make_relation_table_rows(cls, citizens: dict, import_id: int) -> Generator:
+        preferences = self.request.headers.getall("Prefer", ())
+        return any(
+            token.split("=")[0].strip().lower() == "respond-async"
+            for preference in preferences
+            for token in preference.replace(";", ",").split(",")
+        )
+
+    @property
+    def idempotency_key(self) -> Optional[str]:
+        return self.request.headers.get("Idempotency-Key")
+
+    async def find_duplicate(self, content_hash: Optional[str] = None) -> Optional[int]:
         """
-        Generate rows to insert into `relation_table` lazy.
+        Return `import_id` of the import created by the same request before.
+
+        Without `Idempotency-Key` header imports are looked up by content
+        hash, if `IMPORT_CONTENT_DEDUP` is enabled.
         """
 
-        for citizen in citizens:
-            for relative_id in citizen["relatives"]:
-                yield {
-                    "import_id": import_id,
-                    "citizen_id": citizen["citizen_id"],
-                    "relative_id": relative_id,
-                }
+        key = self.idempotency_key
+        dedup = self.app["config"].IMPORT_CONTENT_DEDUP
+        row = await find_import(self.pg, key, content_hash if dedup else None)
+        if row is None:
+            return None
+
+        same_key = key is not None and row["idempotency_key"] == key
+        if same_key and content_hash and row["content_hash"] != content_hash:
+            # Content hash is reset once the import has been changed and is
+            # not stored for streamed imports, then the content is unknown
+            message = (
+                "Idempotency-Key has already been used for another import"
+                if row["content_hash"]
+                else "Idempotency-Key has already been used for an import "
+                "with unknown or changed content"
+            )
+            raise format_http_error(web.HTTPUnprocessableEntity, message)
+
+        return row["import_id"]
+
+    async def submit_job(self, citizens: list, values: Mapping) -> web.Response:
+        job_id = await self.jobs.submit(citizens, values)
+        if job_id is None:
+            raise web.HTTPServiceUnavailable(text="Import queue is full")
+
+        location = DynamicResource(ImportJobView.URL_PATH).url_for(job_id=str(job_id))
+        return json_response(
+            data={"data": {"job_id": job_id}},
+            status=HTTPStatus.ACCEPTED,
+            headers={"Location": str(location), "Preference-Applied": "respond-async"},
+        )
 
-    @docs(summary="Add import with citizens info")
-    @request_schema(ImportsSchema())
+    @docs(
+        summary="Add import with citizens info",
+        description=(
+            "With `Prefer: respond-async` header the import is written in "
+            "background, see `Location` header of the response for its state.\n\n"
+            "Repeated request with the same `Idempotency-Key` header returns "
+            "the import created by the first one with `Idempotent-Replayed` header"
+        ),
+    )
+    @request_schema_docs(CompiledImportsSchema())
     @response_schema(ImportsResponseSchema(), code=HTTPStatus.CREATED.value)
+    @response_schema(ImportJobIdResponseSchema(), code=HTTPStatus.ACCEPTED.value)
     async def post(self):
-        data = await self.request.json()
-        async with self.pg.acquire() as conn:
-            async with conn.begin() as _:
-                result = await conn.execute(
-                    import_table.insert().values().returning(import_table.c.import_id)
-                )
-                import_id = await result.scalar()
-
-                citizens = data.get("citizens")
-                citizen_rows = self.make_citizen_table_rows(citizens, import_id)
-                relation_rows = self.make_relation_table_rows(citizens, import_id)
-
-                chunked_citizen_rows = chunk_list(
-                    citizen_rows, self.MAX_CITIZENS_PER_INSERT
-                )
-                chunked_relation_rows = chunk_list(
-                    relation_rows, self.MAX_RELATIONS_PER_INSERT
-                )
-
-                for chunk in chunked_citizen_rows:
-                    await conn.execute(insert(citizen_table).values(chunk))
-
-                for chunk in chunked_relation_rows:
-                    await conn.execute(insert(relation_table).values(chunk))
-
-        return web.json_response(
-            data={"data": {"import_id": import_id}}, status=HTTPStatus.CREATED
+        hash_content = (
+            self.idempotency_key is not None or self.app["config"].IMPORT_CONTENT_DEDUP
+        )
+        rows, content_hash = await self.load_body(
+            partial(load_imports_body, content_hash=hash_content)
+        )
+
+        import_id = await self.find_duplicate(content_hash)
+        if import_id is not None:
+            return self.created(import_id, replayed=True)
+
+        citizens = [dict(zip(CITIZEN_FIELDS, row)) for row in rows]
+        values = {"idempotency_key": self.idempotency_key, "content_hash": content_hash}
+
+        if self.respond_async:
+            return await self.submit_job(citizens, values)
+
+        try:
+            import_id = await self.ingest.ingest(single_batch(citizens), values=values)
+        except DuplicateImportError:
+            # The same request has been processed concurrently
+            return self.created(await self.find_duplicate(content_hash), replayed=True)
+
+        return self.created(import_id)
+
+
+class ImportsStreamView(ImportsView):
+    """
+    Same as `ImportsView`, but citizens are parsed, validated and written
+    to the database while the request body is still being received.
+
+    The body is not validated by `validation_middleware`, so only the
+    current batch of citizens is kept in memory along with the ids
+    the validator needs: ids of the citizens received so far and
+    relations waiting for their counterparts.
+    """
+
+    URL_PATH = "/imports/stream"
+
+    async def iter_batches(self) -> CitizenBatches:
+        cfg = self.app["config"]
+        validator = ImportsStreamValidator(CompiledCitizenSchema())
+        citizens = iter_json_array(
+            self.request.content,
+            "citizens",
+            chunk_size=cfg.IMPORT_STREAM_CHUNK_SIZE,
+            max_size=self.request.client_max_size,
         )
+
+        batch = []
+        try:
+            async for citizen in citizens:
+                batch.append(validator.validate(citizen))
+
+                if len(batch) >= cfg.IMPORT_STREAM_BATCH_SIZE:
+                    yield batch
+                    batch = []
+        except JsonStreamError as err:
+            raise format_http_error(web.HTTPBadRequest, f"Malformed JSON: {err}")
+        except KeyError:
+            message = Field.default_error_messages["required"]
+            raise ValidationError({"citizens": [message]})
+
+        validator.finish()
+
+        if batch:
+            yield batch
+
+    @docs(
+        summary="Add import with citizens info, streaming the request body",
+        description=(
+            "Repeated request with the same `Idempotency-Key` header returns "
+            "the import created by the first one, the body is not read"
+        ),
+    )
+    @response_schema(ImportsResponseSchema(), code=HTTPStatus.CREATED.value)
+    async def post(self):
+        # Content is not known beforehand, so only the key is checked
+        import_id = await self.find_duplicate()
+        if import_id is not None:
+            return self.created(import_id, replayed=True)
+
+        values = {"idempotency_key": self.idempotency_key}
+        try:
+            import_id = await self.ingest.ingest(self.iter_batches(), values=values)
+        except DuplicateImportError:
+            return self.created(await self.find_duplicate(), replayed=True)
+
+        return self.created(import_id)
+
+
+class ImportsCopyView(ImportsView):
+    """
+    Creates an import from a body exported by `ImportExportView`.
+    Tables are streamed into PostgreSQL with COPY as they are received,
+    the import is checked once it has been loaded.
+    """
+
+    URL_PATH = "/imports/copy"
+
+    @property
+    def export(self) -> ExportEngine:
+        return self.app["export"]
+
+    @docs(
+        summary="Add import exported from `/imports/{import_id}/export`",
+        description=(
+            "Expects `multipart` body with `citizen` and `relation` parts "
+            "of `text/csv` or `application/octet-stream` (PostgreSQL binary "
+            "COPY format) content type"
+        ),
+    )
+    @response_schema(ImportsResponseSchema(), code=HTTPStatus.CREATED.value)
+    async def post(self):
+        if self.request.content_type.split("/")[0] != "multipart":
+            raise format_http_error(
+                web.HTTPUnsupportedMediaType, "Expected multipart body"
+            )
+
+        import_id = await self.export.load(await self.request.multipart())
+        return self.created(import_id)
@@ -0,0 +1,20 @@
+from aiohttp_apispec import docs, response_schema
+from http import HTTPStatus
+
+from analyzer.api.payload import json_response
+from analyzer.api.schema import MetricsResponseSchema
+from analyzer.utils.metrics import Metrics
+from .base import BaseView
+
+
+class MetricsView(BaseView):
+    URL_PATH = "/metrics"
+
+    @property
+    def metrics(self) -> Metrics:
+        return self.app["metrics"]
+
+    @docs(summary="Get counters and timings of the worker process")
+    @response_schema(MetricsResponseSchema(), code=HTTPStatus.OK.value)
+    async def get(self):
+        return json_response(data={"data": self.metrics.snapshot()})
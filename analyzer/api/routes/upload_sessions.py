@@ -0,0 +1,304 @@
+from aiohttp import web
+from aiohttp.web_urldispatcher import DynamicResource
+from aiohttp_apispec import docs, response_schema
+from aiopg.sa.result import RowProxy
+from datetime import timedelta
+from http import HTTPStatus
+from marshmallow import ValidationError
+from sqlalchemy import func, select
+from typing import Mapping, Optional, Sequence
+
+from analyzer.api.middleware import format_http_error
+from analyzer.api.payload import json_response
+from analyzer.api.schema import (
+    ImportsResponseSchema,
+    UploadSessionResponseSchema,
+)
+from analyzer.api.validator import (
+    CITIZEN_FIELDS,
+    CompiledUploadBatchSchema,
+    load_upload_batch_body,
+)
+from analyzer.db.schema import (
+    UploadSessionState,
+    citizen_stage_table,
+    citizen_table,
+    import_table,
+    relation_stage_table,
+    relation_table,
+    stage_id_seq,
+    upload_session_table,
+)
+from analyzer.utils.ingest import (
+    STAGE_CHECKS,
+    insert_stage_rows,
+    make_move_stage_query,
+)
+
+from .base import BaseView, request_schema_docs
+
+
+class BaseUploadSessionView(BaseView):
+    @property
+    def session_id(self) -> int:
+        return int(self.request.match_info.get("session_id"))
+
+    async def lock_session(self, conn) -> RowProxy:
+        """
+        Select the session locking it till the end of the transaction,
+        so concurrent requests to the same session are serialized
+        """
+
+        result = await conn.execute(
+            upload_session_table.select()
+            .where(upload_session_table.c.session_id == self.session_id)
+            .with_for_update()
+        )
+        session = await result.first()
+
+        if session is None:
+            raise web.HTTPNotFound()
+
+        return session
+
+    @staticmethod
+    async def drop_stages(conn, stage_ids: Sequence[int]) -> None:
+        for stage in (citizen_stage_table, relation_stage_table):
+            await conn.execute(stage.delete().where(stage.c.stage_id.in_(stage_ids)))
+
+    def session_response(
+        self,
+        session: Mapping,
+        status: int = HTTPStatus.OK,
+        headers: Optional[Mapping] = None,
+    ) -> web.Response:
+        return json_response(
+            data={
+                "data": {
+                    "session_id": session["session_id"],
+                    "state": session["state"].value,
+                    "batches": session["batches"],
+                    "citizens": session["citizens"],
+                    "import_id": session["import_id"],
+                }
+            },
+            status=status,
+            headers=headers,
+        )
+
+
+class UploadSessionsView(BaseUploadSessionView):
+    URL_PATH = "/imports/sessions"
+
+    async def expire_sessions(self, conn) -> None:
+        """
+        Drop sessions which have not been used for `UPLOAD_SESSION_TTL`
+        seconds together with their staged citizens
+        """
+
+        ttl = timedelta(seconds=self.app["config"].UPLOAD_SESSION_TTL)
+        result = await conn.execute(
+            upload_session_table.delete()
+            .where(upload_session_table.c.updated_at < func.now() - ttl)
+            .returning(upload_session_table.c.stage_id)
+        )
+        stage_ids = [row["stage_id"] for row in await result.fetchall()]
+
+        if stage_ids:
+            await self.drop_stages(conn, stage_ids)
+
+    @docs(
+        summary="Open session to upload citizens of a large import by batches",
+        description=(
+            "Upload batches with `PUT` requests to the `batches` of the session, "
+            "see `Location` header of the response, then `commit` the session "
+            "to create the import. Sessions unused for a day are dropped"
+        ),
+    )
+    @response_schema(UploadSessionResponseSchema(), code=HTTPStatus.CREATED.value)
+    async def post(self):
+        async with self.pg.acquire() as conn:
+            async with conn.begin() as _:
+                await self.expire_sessions(conn)
+
+                result = await conn.execute(
+                    upload_session_table.insert()
+                    .values(stage_id=stage_id_seq.next_value(), state=UploadSessionState.open)
+                    .returning(*upload_session_table.columns)
+                )
+                session = await result.first()
+
+        location = DynamicResource(UploadSessionView.URL_PATH).url_for(
+            session_id=str(session["session_id"])
+        )
+        return self.session_response(
+            session, HTTPStatus.CREATED, headers={"Location": str(location)}
+        )
+
+
+class UploadSessionView(BaseUploadSessionView):
+    URL_PATH = r"/imports/sessions/{session_id:\d+}"
+
+    @docs(summary="Get state of the upload session")
+    @response_schema(UploadSessionResponseSchema(), code=HTTPStatus.OK.value)
+    async def get(self):
+        async with self.pg.acquire() as conn:
+            result = await conn.execute(
+                upload_session_table.select().where(
+                    upload_session_table.c.session_id == self.session_id
+                )
+            )
+            session = await result.first()
+
+        if session is None:
+            raise web.HTTPNotFound()
+
+        return self.session_response(session)
+
+    @docs(summary="Drop the upload session and citizens uploaded within it")
+    async def delete(self):
+        async with self.pg.acquire() as conn:
+            async with conn.begin() as _:
+                session = await self.lock_session(conn)
+                await self.drop_stages(conn, [session["stage_id"]])
+                await conn.execute(
+                    upload_session_table.delete().where(
+                        upload_session_table.c.session_id == self.session_id
+                    )
+                )
+
+        return web.Response(status=HTTPStatus.NO_CONTENT)
+
+
+class UploadSessionBatchView(BaseUploadSessionView):
+    URL_PATH = r"/imports/sessions/{session_id:\d+}/batches/{batch:\d+}"
+
+    @property
+    def batch(self) -> int:
+        return int(self.request.match_info.get("batch"))
+
+    @docs(
+        summary="Upload batch of citizens within the session",
+        description=(
+            "Batches are numbered from 1 and have to be uploaded in order. "
+            "Batch which has already been uploaded is not written again, "
+            "the response has `Idempotent-Replayed` header, so a failed "
+            "upload may be resumed from the last batch of the session"
+        ),
+    )
+    @request_schema_docs(CompiledUploadBatchSchema())
+    @response_schema(UploadSessionResponseSchema(), code=HTTPStatus.OK.value)
+    async def put(self):
+        if self.batch < 1:
+            raise web.HTTPNotFound()
+
+        rows = await self.load_body(load_upload_batch_body)
+        citizens = [dict(zip(CITIZEN_FIELDS, row)) for row in rows]
+        max_citizens = self.app["config"].UPLOAD_SESSION_MAX_CITIZENS
+
+        async with self.pg.acquire() as conn:
+            async with conn.begin() as _:
+                session = await self.lock_session(conn)
+
+                if session["state"] is not UploadSessionState.open:
+                    raise format_http_error(
+                        web.HTTPConflict, "Upload session has already been committed"
+                    )
+
+                if self.batch <= session["batches"]:
+                    return self.session_response(
+                        session, headers={"Idempotent-Replayed": "true"}
+                    )
+
+                if self.batch != session["batches"] + 1:
+                    raise format_http_error(
+                        web.HTTPConflict, f"Batch {session['batches'] + 1} is expected"
+                    )
+
+                if session["citizens"] + len(citizens) > max_citizens:
+                    raise ValidationError(
+                        {"citizens": [f"Session can't have more than {max_citizens} citizens"]}
+                    )
+
+                await insert_stage_rows(conn, session["stage_id"], citizens)
+
+                result = await conn.execute(
+                    upload_session_table.update()
+                    .values(
+                        batches=self.batch,
+                        citizens=upload_session_table.c.citizens + len(citizens),
+                    )
+                    .where(upload_session_table.c.session_id == self.session_id)
+                    .returning(*upload_session_table.columns)
+                )
+                session = await result.first()
+
+        return self.session_response(session)
+
+
+class UploadSessionCommitView(BaseUploadSessionView):
+    URL_PATH = r"/imports/sessions/{session_id:\d+}/commit"
+
+    async def check(self, conn, session: Mapping) -> None:
+        """
+        Check citizens of all the uploaded batches the way `ImportsSchema` does
+        """
+
+        params = {"stage_id": session["stage_id"]}
+
+        # Staging tables are UNLOGGED: they are emptied by crash recovery
+        result = await conn.execute(
+            select([func.count()])
+            .select_from(citizen_stage_table)
+            .where(citizen_stage_table.c.stage_id == session["stage_id"])
+        )
+        if await result.scalar() != session["citizens"]:
+            raise format_http_error(
+                web.HTTPConflict,
+                "Uploaded citizens have been lost, the session has to be uploaded again",
+            )
+
+        for query, message in STAGE_CHECKS:
+            result = await conn.execute(query, params)
+            violation = await result.first()
+            if violation is not None:
+                raise ValidationError({"_schema": [message.format(*violation.as_tuple())]})
+
+    @docs(
+        summary="Create import with citizens uploaded within the session",
+        description=(
+            "Session failing the checks of the import stays open: it has "
+            "to be deleted and uploaded again. Repeated commit returns the "
+            "same import with `Idempotent-Replayed` header"
+        ),
+    )
+    @response_schema(ImportsResponseSchema(), code=HTTPStatus.CREATED.value)
+    async def post(self):
+        async with self.pg.acquire() as conn:
+            async with conn.begin() as _:
+                session = await self.lock_session(conn)
+
+                if session["state"] is UploadSessionState.committed:
+                    return self.created(session["import_id"], replayed=True)
+
+                await self.check(conn, session)
+
+                result = await conn.execute(
+                    import_table.insert().values().returning(import_table.c.import_id)
+                )
+                import_id = await result.scalar()
+
+                params = {"import_id": import_id, "stage_id": session["stage_id"]}
+                for table, stage in (
+                    (citizen_table, citizen_stage_table),
+                    (relation_table, relation_stage_table),
+                ):
+                    await conn.execute(make_move_stage_query(table, stage), params)
+
+                await conn.execute(
+                    upload_session_table.update()
+                    .values(state=UploadSessionState.committed, import_id=import_id)
+                    .where(upload_session_table.c.session_id == self.session_id)
+                )
+
+        return self.created(import_id)
@@ -1,11 +1,17 @@
+import binascii
+import json
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import date
 
 from marshmallow import Schema, validates, ValidationError, validates_schema
-from marshmallow.fields import Str, Int, Float, Date, List, Nested
+from marshmallow.fields import Field, Str, Int, Float, Date, Dict, List, Nested
 from marshmallow.validate import Length, OneOf, Range
+from webargs.fields import DelimitedList
 
 from analyzer.config import Config
-from analyzer.db.schema import Gender
+from analyzer.db.schema import Gender, ImportJobPhase, UploadSessionState
+from analyzer.utils.export import EXPORT_FORMATS
 
 
 class BaseCitizenSchema(Schema):
@@ -43,6 +49,70 @@ class CitizenSchema(BaseCitizenSchema):
 
 class CitizensResponseSchema(Schema):
     data = Nested(CitizenSchema(many=True), required=True)
+    # Continuation token of the next page, only for paginated requests
+    next = Str(allow_none=True)
+
+
+class CitizensPageSchema(Schema):
+    import_id = Int(validate=Range(min=0), strict=True, required=True)
+    after = Int(validate=Range(min=0), strict=True, required=True)
+    limit = Int(
+        validate=Range(min=1, max=Config.MAX_CITIZENS_PAGE_SIZE),
+        strict=True,
+        required=True,
+    )
+    # projection and filters of the first page, if passed
+    fields = List(Str(validate=OneOf(CitizenSchema().fields)), validate=Length(min=1))
+    town = Str(validate=Length(min=1, max=256))
+    street = Str(validate=Length(min=1, max=256))
+    gender = Str(validate=OneOf([gender.value for gender in Gender]))
+
+
+class ContinuationToken(Field):
+    """
+    Opaque token of the next page: `schema` data encoded
+    with JSON and URL-safe base64
+    """
+
+    default_error_messages = {"invalid": "Not a valid continuation token."}
+
+    def __init__(self, schema: Schema, **kwargs):
+        super().__init__(**kwargs)
+        self.schema = schema
+
+    def _serialize(self, value, attr, obj, **kwargs):
+        if value is None:
+            return None
+
+        data = json.dumps(self.schema.dump(value), separators=(",", ":"))
+        return urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        try:
+            padding = "=" * (-len(value) % 4)
+            return self.schema.load(json.loads(urlsafe_b64decode(value + padding)))
+        except (TypeError, ValueError, binascii.Error, ValidationError) as err:
+            raise self.make_error("invalid") from err
+
+
+class CitizensQuerySchema(Schema):
+    # projection
+    fields = DelimitedList(
+        Str(validate=OneOf(CitizenSchema().fields)), validate=Length(min=1)
+    )
+    # filters
+    town = Str(validate=Length(min=1, max=256))
+    street = Str(validate=Length(min=1, max=256))
+    gender = Str(validate=OneOf([gender.value for gender in Gender]))
+    # pagination
+    limit = Int(validate=Range(min=1, max=Config.MAX_CITIZENS_PAGE_SIZE))
+    after = Int(validate=Range(min=0))
+    cursor = ContinuationToken(CitizensPageSchema())
+
+    @validates_schema
+    def validate_cursor(self, data, **_):
+        if "cursor" in data and data.keys() & {"limit", "after"}:
+            raise ValidationError("cursor can't be combined with limit and after")
 
 
 class PatchCitizenSchema(Schema):
@@ -86,6 +156,114 @@ class ImportsSchema(Schema):
                     )
 
 
+class UploadBatchSchema(Schema):
+    """
+    Batch of citizens uploaded within a session. Uniqueness of citizens
+    and relations are checked across all batches once the session
+    is committed
+    """
+
+    citizens = Nested(
+        CitizenSchema,
+        many=True,
+        required=True,
+        validate=Length(min=1, max=Config.MAX_CITIZEN_INSTANCES_WITHIN_IMPORT),
+    )
+
+
+class DeriveImportSchema(Schema):
+    """
+    Changes of an import: added or changed citizens replace citizens
+    with the same `citizen_id`, `removed` citizens are not copied.
+    Relations of the derived import are checked on the server
+    """
+
+    citizens = Nested(
+        CitizenSchema,
+        many=True,
+        load_default=list,
+        validate=Length(max=Config.MAX_CITIZEN_INSTANCES_WITHIN_IMPORT),
+    )
+    removed = List(
+        Int(validate=Range(min=0), strict=True),
+        load_default=list,
+        validate=Length(max=Config.MAX_CITIZEN_INSTANCES_WITHIN_IMPORT),
+    )
+
+    @validates_schema
+    def validate_unique_citizen_id(self, data, **_):
+        citizen_ids = set(data["removed"])
+        if len(citizen_ids) != len(data["removed"]):
+            raise ValidationError("removed ids must be unique values")
+
+        for citizen in data["citizens"]:
+            if citizen["citizen_id"] in citizen_ids:
+                raise ValidationError(
+                    f"citizen_id {citizen['citizen_id']} is not unique"
+                )
+
+            citizen_ids.add(citizen["citizen_id"])
+
+
+class ImportsStreamValidator:
+    """
+    Validate citizens of an import one by one as they arrive,
+    reporting the same errors as `ImportsSchema` does.
+
+    Call `finish()` after the last citizen to check that every
+    relation has got its counterpart.
+    """
+
+    def __init__(
+        self,
+        schema: Schema = None,
+        max_citizens: int = Config.MAX_CITIZEN_INSTANCES_WITHIN_IMPORT,
+    ):
+        self.schema = schema or CitizenSchema()
+        self.max_citizens = max_citizens
+        self.count = 0
+        self.citizen_ids = set()
+        # relations (citizen_id, relative_id) waiting for the relative to respond
+        self.unpaired = set()
+
+    def validate(self, citizen: dict) -> dict:
+        index = self.count
+        self.count += 1
+
+        if self.count > self.max_citizens:
+            message = Length.message_max.format(max=self.max_citizens)
+            raise ValidationError({"citizens": [message]})
+
+        try:
+            citizen = self.schema.load(citizen)
+        except ValidationError as err:
+            raise ValidationError({"citizens": {index: err.messages}})
+
+        citizen_id = citizen["citizen_id"]
+        if citizen_id in self.citizen_ids:
+            raise ValidationError({"_schema": [f"citizen_id {citizen_id} is not unique"]})
+        self.citizen_ids.add(citizen_id)
+
+        for relative_id in citizen["relatives"]:
+            if (relative_id, citizen_id) in self.unpaired:
+                self.unpaired.remove((relative_id, citizen_id))
+            elif relative_id != citizen_id:
+                self.unpaired.add((citizen_id, relative_id))
+
+        return citizen
+
+    def finish(self) -> None:
+        if self.unpaired:
+            citizen_id, relative_id = min(self.unpaired)
+            raise ValidationError(
+                {
+                    "_schema": [
+                        f"citizen {relative_id} does not have relation with {citizen_id}"
+                    ]
+                }
+            )
+
+
 class ImportsIdSchema(Schema):
     import_id = Int(validate=Range(min=0), strict=True, required=True)
 
@@ -94,6 +272,60 @@ class ImportsResponseSchema(Schema):
     data = Nested(ImportsIdSchema(), required=True)
 
 
+class ExportQuerySchema(Schema):
+    format = Str(validate=OneOf(EXPORT_FORMATS))
+
+
+class ImportJobIdSchema(Schema):
+    job_id = Int(validate=Range(min=0), strict=True, required=True)
+
+
+class ImportJobIdResponseSchema(Schema):
+    data = Nested(ImportJobIdSchema(), required=True)
+
+
+class ImportJobSchema(ImportJobIdSchema):
+    phase = Str(validate=OneOf([phase.value for phase in ImportJobPhase]), required=True)
+    rows_written = Int(validate=Range(min=0), strict=True, required=True)
+    import_id = Int(validate=Range(min=0), strict=True, allow_none=True, required=True)
+    error = Dict(allow_none=True, required=True)
+
+
+class ImportJobResponseSchema(Schema):
+    data = Nested(ImportJobSchema(), required=True)
+
+
+class UploadSessionSchema(Schema):
+    session_id = Int(validate=Range(min=0), strict=True, required=True)
+    state = Str(
+        validate=OneOf([state.value for state in UploadSessionState]), required=True
+    )
+    batches = Int(validate=Range(min=0), strict=True, required=True)
+    citizens = Int(validate=Range(min=0), strict=True, required=True)
+    import_id = Int(validate=Range(min=0), strict=True, allow_none=True, required=True)
+
+
+class UploadSessionResponseSchema(Schema):
+    data = Nested(UploadSessionSchema(), required=True)
+
+
+class TimingSchema(Schema):
+    count = Int(validate=Range(min=0), strict=True, required=True)
+    total = Float(validate=Range(min=0), required=True)
+    avg = Float(validate=Range(min=0), required=True)
+    max = Float(validate=Range(min=0), required=True)
+
+
+class MetricsSchema(Schema):
+    counters = Dict(keys=Str(), values=Int(), required=True)
+    gauges = Dict(keys=Str(), values=Float(), required=True)
+    timings = Dict(keys=Str(), values=Nested(TimingSchema()), required=True)
+
+
+class MetricsResponseSchema(Schema):
+    data = Nested(MetricsSchema(), required=True)
+
+
 class PresentsSchema(Schema):
     citizen_id = Int(validate=Range(min=0), strict=True, required=True)
     presents = Int(validate=Range(min=0), strict=True, required=True)
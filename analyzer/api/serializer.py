@@ -0,0 +1,117 @@
+"""
+    Row serializers compiled from column types of queries
+
+    Types of the selected columns are known before the query is run, so
+    instead of checking every value of every row with `isinstance`, the
+    conversion of each column is chosen once and compiled into a single
+    function turning a row into a JSON serializable dict.
+
+    Compiled functions take aiopg `RowProxy` rows and read the values of
+    the serialized columns by their positions. The latest `CACHE_SIZE` of
+    them are cached by the names and types of the columns, so requests
+    with the same query reuse them.
+"""
+
+from aiopg.sa.result import RowProxy
+from collections import OrderedDict
+from sqlalchemy import ARRAY, Column, Date, Enum, Numeric
+from sqlalchemy.sql import ColumnElement, Select
+from sqlalchemy.types import TypeEngine
+from typing import Any, Callable, Optional, Sequence, Tuple
+
+from analyzer.api.validator import SourceCompiler
+
+RowSerializer = Callable[[RowProxy], dict]
+
+# Fields of citizens may be requested in any order, so the number
+# of serializers is bounded
+CACHE_SIZE = 256
+
+_serializers: "OrderedDict[Tuple, RowSerializer]" = OrderedDict()
+
+
+class RowSerializerCompiler(SourceCompiler):
+    """
+    Generate source of a function serializing rows of known columns
+    """
+
+    def __init__(self, date_format: str):
+        super().__init__()
+        self.date_format = self.constant(date_format)
+
+    def convert(self, type_: TypeEngine, value: str) -> Optional[str]:
+        """
+        Expression converting not null driver `value` of `type_` into
+        a JSON serializable one, None if the value is serializable as is
+        """
+
+        if isinstance(type_, Date):
+            return f"{value}.strftime({self.date_format})"
+        if isinstance(type_, Enum) and type_.enum_class is not None:
+            # Members of enums are returned by the result processor
+            return f"{value}.value"
+        if isinstance(type_, Numeric):
+            return f"float({value})"
+        if isinstance(type_, ARRAY):
+            item = self.convert(type_.item_type, "item")
+            if item is not None:
+                return f"[None if item is None else {item} for item in {value}]"
+
+        return None
+
+    def field(self, column: ColumnElement, value: str) -> str:
+        converted = self.convert(column.type, value)
+        if converted is None:
+            return value
+
+        if isinstance(column, Column) and not column.nullable:
+            return converted
+
+        return f"(None if {value} is None else {converted})"
+
+    def compile_serializer(
+        self, columns: Sequence[ColumnElement], fields: Sequence[str]
+    ) -> RowSerializer:
+        keys = [column.key for column in columns]
+        self.emit(0, "def serialize(row):")
+
+        items = []
+        for field in fields:
+            # Positions are unambiguous, unlike names of the columns
+            index = keys.index(field)
+            self.emit(1, f"v{index} = row[{index}]")
+            items.append(f"{field!r}: {self.field(columns[index], f'v{index}')}")
+
+        self.emit(1, f"return {{{', '.join(items)}}}")
+
+        return self.compile("serialize")
+
+
+def column_signature(column: ColumnElement) -> Tuple[str, str, Any]:
+    return column.key, repr(column.type), getattr(column, "nullable", True)
+
+
+def get_row_serializer(
+    query: Select, date_format: str, fields: Optional[Sequence[str]] = None
+) -> RowSerializer:
+    """
+    Serializer of `query` rows into dicts with `fields`
+    (all of the selected columns if not passed)
+    """
+
+    columns = list(query.selected_columns)
+    if fields is None:
+        fields = [column.key for column in columns]
+
+    key = (tuple(map(column_signature, columns)), date_format, tuple(fields))
+    serializer = _serializers.get(key)
+    if serializer is not None:
+        _serializers.move_to_end(key)
+        return serializer
+
+    compiler = RowSerializerCompiler(date_format)
+    serializer = _serializers[key] = compiler.compile_serializer(columns, fields)
+    if len(_serializers) > CACHE_SIZE:
+        _serializers.popitem(last=False)
+
+    return serializer
@@ -0,0 +1,386 @@
+"""
+    Validators compiled from marshmallow schemas
+
+    Marshmallow validates every value through several layers of field
+    and validator objects. Here the same checks are generated once as
+    plain Python source and compiled into a single function.
+
+    Compiled functions only answer whether data is valid: they return
+    the deserialized data or None. Errors are reported by the original
+    schema, so the error structure stays exactly the same.
+
+    `load_*_body` functions decode and validate raw request bodies,
+    they are meant to be run in `ProcessPool` workers.
+"""
+
+import hashlib
+import json
+
+from datetime import datetime
+from marshmallow import Schema, ValidationError
+from marshmallow.decorators import VALIDATES
+from marshmallow.utils import missing
+from marshmallow.fields import Date, Field, Int, List, Nested, Str
+from marshmallow.validate import Length, OneOf, Range
+from operator import itemgetter
+from typing import Any, Callable, Dict, Mapping, Optional, Sequence, Tuple
+
+from analyzer.api.schema import (
+    CitizenSchema,
+    DeriveImportSchema,
+    ImportsSchema,
+    PatchCitizenSchema,
+    UploadBatchSchema,
+)
+from analyzer.utils.codec import loads
+
+Loader = Callable[[Any], Optional[dict]]
+INDENT = "    "
+
+
+class SourceCompiler:
+    """
+    Collect source of a function line by line and compile it
+    with the values it refers to
+    """
+
+    def __init__(self, namespace: Optional[Dict[str, Any]] = None):
+        self.namespace = dict(namespace or {})
+        self.lines = []
+
+    def constant(self, value: Any) -> str:
+        name = f"_c{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def emit(self, level: int, line: str) -> None:
+        self.lines.append(INDENT * level + line)
+
+    def compile(self, name: str) -> Callable:
+        source = "\n".join(self.lines)
+        exec(compile(source, f"<compiled {name}>", "exec"), self.namespace)
+        return self.namespace[name]
+
+
+class SchemaCompiler(SourceCompiler):
+    """
+    Generate source of a function deserializing data like `schema.load()`
+    """
+
+    def __init__(self):
+        super().__init__(
+            {
+                "ValidationError": ValidationError,
+                "strptime": datetime.strptime,
+                "missing": missing,
+            }
+        )
+
+    def validators(self, level: int, field: Field, value: str) -> None:
+        for validator in field.validators:
+            if isinstance(validator, Length) and validator.equal is None:
+                size = f"len({value})"
+                if validator.min is not None:
+                    self.emit(level, f"if {size} < {validator.min}: return None")
+                if validator.max is not None:
+                    self.emit(level, f"if {size} > {validator.max}: return None")
+            elif isinstance(validator, OneOf):
+                choices = self.constant(frozenset(validator.choices))
+                self.emit(level, f"if {value} not in {choices}: return None")
+            elif isinstance(validator, Range):
+                if validator.min is not None:
+                    op = "<" if validator.min_inclusive else "<="
+                    self.emit(level, f"if {value} {op} {validator.min!r}: return None")
+                if validator.max is not None:
+                    op = ">" if validator.max_inclusive else ">="
+                    self.emit(level, f"if {value} {op} {validator.max!r}: return None")
+            else:
+                self.call(level, self.constant(validator), value)
+
+    def call(self, level: int, func: str, value: str) -> None:
+        self.emit(level, "try:")
+        self.emit(level + 1, f"{func}({value})")
+        self.emit(level, "except ValidationError:")
+        self.emit(level + 1, "return None")
+
+    def field(self, level: int, field: Field, value: str) -> None:
+        """
+        Emit checks of `value` variable, replacing it with deserialized value
+        """
+
+        if field.allow_none or field.data_key or field.attribute:
+            raise NotImplementedError(f"Unsupported field options: {field!r}")
+
+        if isinstance(field, Str):
+            self.emit(level, f"if type({value}) is not str: return None")
+        elif isinstance(field, Int) and field.strict:
+            # bool is not accepted by marshmallow as well
+            self.emit(level, f"if type({value}) is not int: return None")
+        elif isinstance(field, Date) and field.format not in (None, "iso", "iso8601"):
+            fmt = self.constant(field.format)
+            self.emit(level, f"if type({value}) is not str or not {value}: return None")
+            self.emit(level, "try:")
+            self.emit(level + 1, f"{value} = strptime({value}, {fmt}).date()")
+            self.emit(level, "except ValueError:")
+            self.emit(level + 1, "return None")
+        elif isinstance(field, List):
+            item = f"{value}_item"
+            items = f"{value}_items"
+            self.emit(level, f"if type({value}) is not list: return None")
+            self.emit(level, f"{items} = []")
+            self.emit(level, f"for {item} in {value}:")
+            self.field(level + 1, field.inner, item)
+            self.emit(level + 1, f"{items}.append({item})")
+            self.emit(level, f"{value} = {items}")
+        else:
+            raise NotImplementedError(f"Unsupported field: {field!r}")
+
+        self.validators(level, field, value)
+
+    def schema(self, level: int, schema: Schema, data: str, result: str) -> None:
+        """
+        Emit deserialization of `data` object into `result` dict
+        """
+
+        hooks = {}
+        for name in schema._hooks[VALIDATES]:
+            hook = getattr(schema, name)
+            hooks[hook.__marshmallow_hook__[VALIDATES]["field_name"]] = hook
+
+        fields = schema.fields
+        self.emit(level, f"if type({data}) is not dict: return None")
+        known = self.constant(frozenset(fields))
+        self.emit(level, f"if not {known}.issuperset({data}): return None")
+        self.emit(level, f"{result} = {{}}")
+
+        for name, field in fields.items():
+            value = f"{result}_{name}"
+            self.emit(level, f"{value} = {data}.get({name!r}, missing)")
+            self.emit(level, f"if {value} is missing:")
+            if field.required:
+                self.emit(level + 1, "return None")
+            else:
+                self.emit(level + 1, "pass")
+            self.emit(level, "else:")
+            self.field(level + 1, field, value)
+            if name in hooks:
+                self.call(level + 1, self.constant(hooks[name]), value)
+            self.emit(level + 1, f"{result}[{name!r}] = {value}")
+
+
+def compile_schema_loader(schema: Schema) -> Loader:
+    """
+    Compile a function returning deserialized data if `schema` accepts it,
+    None otherwise
+    """
+
+    compiler = SchemaCompiler()
+    compiler.emit(0, "def load(data):")
+    compiler.schema(1, schema, "data", "result")
+    compiler.emit(1, "return result")
+    return compiler.compile("load")
+
+
+def compile_imports_loader(schema: Schema, check_import: bool = True) -> Loader:
+    """
+    Compile `ImportsSchema` validation into a single pass over citizens.
+
+    Besides citizen fields it checks what `ImportsSchema` schema
+    validators do: uniqueness of `citizen_id` and that every relation
+    has got its counterpart. Without `check_import` only citizens
+    themselves are validated, like `UploadBatchSchema` does.
+    """
+
+    field = schema.fields["citizens"]
+    if not isinstance(field, Nested) or not field.many:
+        raise NotImplementedError(f"Unsupported field: {field!r}")
+
+    compiler = SchemaCompiler()
+    compiler.emit(0, "def load(data):")
+    compiler.emit(1, "if type(data) is not dict or data.keys() != {'citizens'}: return None")
+    compiler.emit(1, "citizens = data['citizens']")
+    compiler.emit(1, "if type(citizens) is not list: return None")
+    compiler.validators(1, field, "citizens")
+    compiler.emit(1, "result = []")
+    compiler.emit(1, "citizen_ids = set()")
+    compiler.emit(1, "unpaired = set()")
+    compiler.emit(1, "for item in citizens:")
+    compiler.schema(2, field.schema, "item", "citizen")
+    if check_import:
+        compiler.emit(2, "citizen_id = citizen['citizen_id']")
+        compiler.emit(2, "if citizen_id in citizen_ids: return None")
+        compiler.emit(2, "citizen_ids.add(citizen_id)")
+        compiler.emit(2, "for relative_id in citizen['relatives']:")
+        compiler.emit(3, "if (relative_id, citizen_id) in unpaired:")
+        compiler.emit(4, "unpaired.remove((relative_id, citizen_id))")
+        compiler.emit(3, "elif relative_id != citizen_id:")
+        compiler.emit(4, "unpaired.add((citizen_id, relative_id))")
+    compiler.emit(2, "result.append(citizen)")
+    if check_import:
+        compiler.emit(1, "if unpaired: return None")
+    compiler.emit(1, "return {'citizens': result}")
+    return compiler.compile("load")
+
+
+class CompiledSchemaMixin:
+    """
+    Take the compiled fast path in `load()`, the original
+    marshmallow implementation reports errors
+    """
+
+    _compiled_loaders: Dict[type, Loader] = {}
+
+    def compile_loader(self) -> Loader:
+        return compile_schema_loader(self)
+
+    @property
+    def fast_load(self) -> Loader:
+        cls = type(self)
+        if cls not in self._compiled_loaders:
+            self._compiled_loaders[cls] = self.compile_loader()
+
+        return self._compiled_loaders[cls]
+
+    def load(self, data: Mapping, *, many=None, partial=None, unknown=None):
+        if many is None and partial is None and unknown is None:
+            result = self.fast_load(data)
+            if result is not None:
+                return result
+
+        return super().load(data, many=many, partial=partial, unknown=unknown)
+
+
+class CompiledCitizenSchema(CompiledSchemaMixin, CitizenSchema):
+    pass
+
+
+class CompiledImportsSchema(CompiledSchemaMixin, ImportsSchema):
+    def compile_loader(self) -> Loader:
+        return compile_imports_loader(self)
+
+
+class CompiledUploadBatchSchema(CompiledSchemaMixin, UploadBatchSchema):
+    def compile_loader(self) -> Loader:
+        return compile_imports_loader(self, check_import=False)
+
+
+class MalformedJsonError(ValueError):
+    pass
+
+
+# Order of citizen values in rows returned by `load_imports_body`
+CITIZEN_FIELDS = tuple(CitizenSchema().fields)
+# Order of citizen values hashed by `hash_citizens`, must never change
+CANONICAL_CITIZEN_FIELDS = (
+    "citizen_id",
+    "name",
+    "birth_date",
+    "gender",
+    "town",
+    "street",
+    "building",
+    "apartment",
+    "relatives",
+)
+
+IMPORTS_SCHEMA = CompiledImportsSchema()
+PATCH_CITIZEN_SCHEMA = PatchCitizenSchema()
+UPLOAD_BATCH_SCHEMA = CompiledUploadBatchSchema()
+DERIVE_IMPORT_SCHEMA = DeriveImportSchema()
+
+
+def load_json_body(body: bytes, schema: Schema) -> dict:
+    """
+    Decode and validate request body the way `validation_middleware`
+    does: empty body has no data, keys unknown to the schema are ignored.
+
+    Raised exceptions carry no input data, so they are cheap to pickle.
+    """
+
+    try:
+        data = loads(body) if body else {}
+    except ValueError as err:
+        raise MalformedJsonError(str(err)) from None
+
+    if not isinstance(data, dict):
+        data = {}
+
+    try:
+        return schema.load({k: v for k, v in data.items() if k in schema.fields})
+    except ValidationError as err:
+        raise ValidationError(err.messages) from None
+
+
+def hash_citizens(citizens: Sequence[Mapping]) -> str:
+    """
+    SHA-256 of citizens which does not depend on their order,
+    order of relatives or JSON formatting
+    """
+
+    digest = hashlib.sha256()
+    for citizen in sorted(citizens, key=itemgetter("citizen_id")):
+        canonical = [
+            sorted(citizen[name]) if name == "relatives" else citizen[name]
+            for name in CANONICAL_CITIZEN_FIELDS
+        ]
+        digest.update(json.dumps(canonical, default=str, ensure_ascii=False).encode())
+        digest.update(b"\n")
+
+    return digest.hexdigest()
+
+
+def load_imports_body(
+    body: bytes,
+    content_hash: bool = False,
+) -> Tuple[Sequence[tuple], Optional[str]]:
+    """
+    Return citizens of `ImportsView` request as tuples of `CITIZEN_FIELDS`
+    values: tuples are several times cheaper to unpickle than dicts.
+
+    Content hash of the citizens is computed on demand.
+    """
+
+    citizens = load_json_body(body, IMPORTS_SCHEMA)["citizens"]
+    rows = [tuple(citizen[name] for name in CITIZEN_FIELDS) for citizen in citizens]
+    return rows, hash_citizens(citizens) if content_hash else None
+
+
+def load_upload_batch_body(body: bytes) -> Sequence[tuple]:
+    """
+    Return citizens of the uploaded batch as tuples of `CITIZEN_FIELDS` values
+    """
+
+    citizens = load_json_body(body, UPLOAD_BATCH_SCHEMA)["citizens"]
+    return [tuple(citizen[name] for name in CITIZEN_FIELDS) for citizen in citizens]
+
+
+def load_derive_import_body(body: bytes) -> Tuple[Sequence[tuple], Sequence[int]]:
+    """
+    Return changed citizens as tuples of `CITIZEN_FIELDS` values
+    and ids of removed citizens
+    """
+
+    data = load_json_body(body, DERIVE_IMPORT_SCHEMA)
+    rows = [tuple(citizen[name] for name in CITIZEN_FIELDS) for citizen in data["citizens"]]
+    return rows, data["removed"]
+
+
+def load_patch_citizen_body(body: bytes) -> dict:
+    return load_json_body(body, PATCH_CITIZEN_SCHEMA)
+
+
+__all__ = (
+    "compile_schema_loader",
+    "compile_imports_loader",
+    "CompiledCitizenSchema",
+    "CompiledImportsSchema",
+    "CompiledUploadBatchSchema",
+    "MalformedJsonError",
+    "CITIZEN_FIELDS",
+    "load_json_body",
+    "hash_citizens",
+    "load_imports_body",
+    "load_upload_batch_body",
+    "load_derive_import_body",
+    "load_patch_citizen_body",
+)
@@ -0,0 +1,36 @@
+"""Deferrable relation keys
+
+Revision ID: 9a4d6c3b7e15
+Revises: 5c1f8e2a9d47
+Create Date: 2026-10-18 10:24:51.307214
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4d6c3b7e15'
+down_revision: Union[str, None] = '5c1f8e2a9d47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+FOREIGN_KEYS = (
+    'fk__relation_import_id_citizen_id_citizen',
+    'fk__relation_import_id_relative_id_citizen',
+)
+
+
+def upgrade() -> None:
+    # Altering constraints in place does not check existing rows again
+    for name in FOREIGN_KEYS:
+        op.execute(
+            f'ALTER TABLE relation ALTER CONSTRAINT {name} '
+            'DEFERRABLE INITIALLY IMMEDIATE'
+        )
+
+
+def downgrade() -> None:
+    for name in FOREIGN_KEYS:
+        op.execute(f'ALTER TABLE relation ALTER CONSTRAINT {name} NOT DEFERRABLE')
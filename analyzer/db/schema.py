@@ -7,9 +7,14 @@ from sqlalchemy import (
     ForeignKey,
     String,
     Date,
+    DateTime,
     Enum as pgEnum,
     ForeignKeyConstraint,
+    Index,
+    Sequence,
+    func,
 )
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 
 
 # Naming Convention for tables and constraints
@@ -38,7 +43,32 @@ class Gender(Enum):
     female = "female"
 
 
-import_table = Table("import", metadata, Column("import_id", Integer, primary_key=True))
+@unique
+class ImportJobPhase(Enum):
+    queued = "queued"
+    citizens = "citizens"
+    relations = "relations"
+    done = "done"
+    failed = "failed"
+
+
+@unique
+class UploadSessionState(Enum):
+    open = "open"
+    committed = "committed"
+
+
+import_table = Table(
+    "import",
+    metadata,
+    Column("import_id", Integer, primary_key=True),
+    # `Idempotency-Key` header of the request which has created the import
+    Column("idempotency_key", String, nullable=True, unique=True),
+    # SHA-256 of the canonicalized citizens, reset once the import is changed
+    Column("content_hash", String(64), nullable=True, index=True),
+    # Incremented by every change of the import, ETags of responses depend on it
+    Column("version", Integer, nullable=False, server_default="1"),
+)
 
 citizen_table = Table(
     "citizen",
@@ -48,10 +78,16 @@ citizen_table = Table(
     Column("name", String, nullable=False),
     Column("birth_date", Date, nullable=False),
     Column("gender", pgEnum(Gender, name="gender"), nullable=False),
-    Column("town", String, nullable=False, index=True),
+    Column("town", String, nullable=False),
     Column("street", String, nullable=False),
     Column("building", String, nullable=False),
     Column("apartment", Integer, nullable=False),
+    # Copy of the citizen relations from `relation_table`, written together
+    # with them, so citizens are read without joining `relation_table`
+    Column("relatives", ARRAY(Integer), nullable=False, server_default="{}"),
+    # citizens of an import filtered by town (and street) or by street
+    Index(None, "import_id", "town", "street"),
+    Index(None, "import_id", "street"),
 )
 
 relation_table = Table(
@@ -60,12 +96,95 @@ relation_table = Table(
     Column("import_id", Integer, primary_key=True),
     Column("citizen_id", Integer, primary_key=True),
     Column("relative_id", Integer, primary_key=True),
+    # Imports defer the checks, so relations are written along with
+    # the batch of citizens and may refer to the following batches
     ForeignKeyConstraint(
         ("import_id", "citizen_id"),
         ("citizen.import_id", "citizen.citizen_id"),
+        deferrable=True,
+        initially="IMMEDIATE",
     ),
     ForeignKeyConstraint(
         ("import_id", "relative_id"),
         ("citizen.import_id", "citizen.citizen_id"),
+        deferrable=True,
+        initially="IMMEDIATE",
+    ),
+)
+
+import_job_table = Table(
+    "import_job",
+    metadata,
+    Column("job_id", Integer, primary_key=True),
+    Column("phase", pgEnum(ImportJobPhase, name="import_job_phase"), nullable=False),
+    Column("rows_written", Integer, nullable=False, server_default="0"),
+    Column("import_id", Integer, ForeignKey("import.import_id"), nullable=True),
+    Column("error", JSONB, nullable=True),
+    Column("created_at", DateTime(timezone=True), nullable=False, server_default=func.now()),
+    Column(
+        "updated_at",
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now(),
+    ),
+)
+
+# New imports may be loaded into the staging tables first (without
+# constraints and WAL), checked and then moved to `citizen_table`
+# and `relation_table`. Rows of one import share the same `stage_id`
+stage_id_seq = Sequence("stage_id_seq", metadata=metadata)
+
+citizen_stage_table = Table(
+    "citizen_stage",
+    metadata,
+    Column("stage_id", Integer, nullable=False),
+    Column("citizen_id", Integer, nullable=False),
+    Column("name", String, nullable=False),
+    Column("birth_date", Date, nullable=False),
+    Column("gender", pgEnum(Gender, name="gender"), nullable=False),
+    Column("town", String, nullable=False),
+    Column("street", String, nullable=False),
+    Column("building", String, nullable=False),
+    Column("apartment", Integer, nullable=False),
+    Column("relatives", ARRAY(Integer), nullable=False, server_default="{}"),
+    Index(None, "stage_id", "citizen_id"),
+    prefixes=["UNLOGGED"],
+)
+
+relation_stage_table = Table(
+    "relation_stage",
+    metadata,
+    Column("stage_id", Integer, nullable=False),
+    Column("citizen_id", Integer, nullable=False),
+    Column("relative_id", Integer, nullable=False),
+    Index(None, "stage_id", "citizen_id", "relative_id"),
+    prefixes=["UNLOGGED"],
+)
+
+# Citizens of a large import may be uploaded by batches within a session.
+# Batches are accumulated in the staging tables under the session `stage_id`
+# and moved into a new import once the session is committed
+upload_session_table = Table(
+    "upload_session",
+    metadata,
+    Column("session_id", Integer, primary_key=True),
+    Column("stage_id", Integer, nullable=False, unique=True),
+    Column(
+        "state",
+        pgEnum(UploadSessionState, name="upload_session_state"),
+        nullable=False,
+    ),
+    # Number of the last uploaded batch, batches are numbered from 1
+    Column("batches", Integer, nullable=False, server_default="0"),
+    Column("citizens", Integer, nullable=False, server_default="0"),
+    Column("import_id", Integer, ForeignKey("import.import_id"), nullable=True),
+    Column("created_at", DateTime(timezone=True), nullable=False, server_default=func.now()),
+    Column(
+        "updated_at",
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now(),
     ),
 )
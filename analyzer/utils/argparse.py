@@ -8,6 +8,7 @@ from typing import Callable
 from yarl import URL
 
 from analyzer.config import Config
+from analyzer.utils.codec import CODEC_CHOICES
 
 
 def validate(type: Callable, constraint: Callable) -> Callable:
@@ -29,6 +30,8 @@ def validate(type: Callable, constraint: Callable) -> Callable:
 Type validation handlers:
 """
 positive_int = validate(int, lambda x: x > 0)
+non_negative_int = validate(int, lambda x: x >= 0)
+compression_level = validate(int, lambda x: 1 <= x <= 9)
 
 
 def get_arg_parser(cfg: Config = None) -> ArgumentParser:
@@ -68,6 +71,66 @@ def get_arg_parser(cfg: Config = None) -> ArgumentParser:
         type=positive_int,
         help="Client's max allowed request size (bytes) that ANALYZER API would be able process",
     )
+    group.add_argument(
+        "--json-codec",
+        default=cfg.JSON_CODEC,
+        choices=CODEC_CHOICES,
+        help=(
+            "Codec of JSON request and response bodies, auto uses "
+            "orjson if it is installed and the standard json module otherwise"
+        ),
+    )
+
+    group = parser.add_argument_group("Compression options")
+    group.add_argument(
+        "--compression-min-size",
+        default=cfg.COMPRESSION_MIN_SIZE,
+        type=non_negative_int,
+        help=(
+            "Minimal size (bytes) of JSON responses compressed if the client "
+            "accepts gzip, brotli or zstd; streamed responses are always compressed"
+        ),
+    )
+    group.add_argument(
+        "--compression-level",
+        default=cfg.COMPRESSION_LEVEL,
+        type=compression_level,
+        help="Compression level from 1 (fastest) to 9 (smallest) of every coding",
+    )
+
+    group = parser.add_argument_group("Cache options")
+    group.add_argument(
+        "--response-cache-size",
+        default=cfg.RESPONSE_CACHE_SIZE,
+        type=non_negative_int,
+        help=(
+            "Maximum size (bytes) of cached citizens, presents and age stats "
+            "responses, 0 to disable the cache"
+        ),
+    )
+    group.add_argument(
+        "--response-cache-ttl",
+        default=cfg.RESPONSE_CACHE_TTL,
+        type=positive_int,
+        help="Seconds a cached response is served for",
+    )
+    group.add_argument(
+        "--response-cache-backend",
+        default=cfg.RESPONSE_CACHE_BACKEND,
+        choices=("memory", "sqlite"),
+        help=(
+            "Keep cached responses in memory of every process or in a SQLite "
+            "file shared by processes of the host"
+        ),
+    )
+    group.add_argument(
+        "--response-cache-path",
+        default=cfg.RESPONSE_CACHE_PATH,
+        help=(
+            "SQLite file of the shared cache, keep it on tmpfs (e.g. /dev/shm); "
+            "every database needs its own file"
+        ),
+    )
 
     group = parser.add_argument_group("PostgreSQL options")
     group.add_argument(
@@ -88,6 +151,88 @@ def get_arg_parser(cfg: Config = None) -> ArgumentParser:
         default=cfg.DATABASE_PG_POOL_MAX_SIZE,
         help="Maximum database async connections",
     )
+    group.add_argument(
+        "--pg-sync-pool-max-size",
+        type=int,
+        default=cfg.DATABASE_PG_SYNC_POOL_MAX_SIZE,
+        help=(
+            "Maximum database sync connections, shared by imports and exports "
+            "written with COPY"
+        ),
+    )
+
+    group = parser.add_argument_group("Import options")
+    group.add_argument(
+        "--import-engine",
+        default=cfg.IMPORT_ENGINE,
+        choices=("insert", "copy", "staging"),
+        help=(
+            "How citizens of a new import are written to the database: "
+            "chunked multi-row INSERT statements, COPY ... FROM STDIN or "
+            "COPY into staging tables checked and moved with INSERT ... SELECT"
+        ),
+    )
+    group.add_argument(
+        "--import-copy-format",
+        default=cfg.IMPORT_COPY_FORMAT,
+        choices=("text", "binary"),
+        help="Data format used by the copy and staging import engines",
+    )
+    group.add_argument(
+        "--import-synchronous-commit",
+        default=cfg.IMPORT_SYNCHRONOUS_COMMIT,
+        choices=("on", "off"),
+        help=(
+            "Whether import transactions wait for WAL to be flushed to disk. "
+            "With off the latest imports may be lost on a server crash"
+        ),
+    )
+    group.add_argument(
+        "--import-pipeline-depth",
+        default=cfg.IMPORT_PIPELINE_DEPTH,
+        type=positive_int,
+        help="Number of encoded chunks of an import allowed to wait for the database",
+    )
+    group.add_argument(
+        "--import-job-workers",
+        default=cfg.IMPORT_JOB_WORKERS,
+        type=positive_int,
+        help="Number of asynchronous imports being written concurrently",
+    )
+    group.add_argument(
+        "--import-job-queue-size",
+        default=cfg.IMPORT_JOB_QUEUE_SIZE,
+        type=positive_int,
+        help="Number of asynchronous imports allowed to wait for a free worker",
+    )
+
+    group = parser.add_argument_group("Citizens options")
+    group.add_argument(
+        "--citizens-json-renderer",
+        default=cfg.CITIZENS_JSON_RENDERER,
+        choices=("python", "postgres"),
+        help=(
+            "Who renders citizens of an import into JSON: the app, row by row, "
+            "or PostgreSQL, the app only forwards the rendered text"
+        ),
+    )
+    group.add_argument(
+        "--citizens-stream-chunk-size",
+        default=cfg.CITIZENS_STREAM_CHUNK_SIZE,
+        type=positive_int,
+        help="Minimal size (bytes) of chunks of citizens streamed to the socket",
+    )
+
+    group = parser.add_argument_group("Validation options")
+    group.add_argument(
+        "--validation-pool-size",
+        default=cfg.VALIDATION_POOL_SIZE,
+        type=non_negative_int,
+        help=(
+            "Number of processes decoding and validating large request bodies, "
+            "0 to do it in the event loop"
+        ),
+    )
 
     group = parser.add_argument_group("Logging options")
     group.add_argument(
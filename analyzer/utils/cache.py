@@ -0,0 +1,645 @@
+"""
+    Cache of encoded response bodies
+
+    Imports are changed only by `CitizenView.patch`, so responses of read
+    endpoints are cached by the view, the import and the query and dropped
+    for exactly the changed import once the change is committed.
+
+    The changing transaction sends `NOTIFY` to `INVALIDATION_CHANNEL`, which
+    PostgreSQL delivers on commit to every process serving the API: each of
+    them listens to the channel and drops bodies of the changed import.
+    Bodies are kept in memory of the process or in a SQLite file shared by
+    processes of the host (put it on tmpfs to keep it in memory), so a body
+    computed by one process is served by all of them. Entries expire after
+    `ttl` seconds anyway.
+"""
+
+import aiopg
+import asyncio
+import logging
+import sqlite3
+import time
+import uuid
+
+from aiohttp import web
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from configargparse import Namespace
+from psycopg2 import Error as PGError
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from analyzer.config import Config
+from analyzer.utils.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "response_cache"
+
+# Generation of the whole cache (changed by `clear()`)
+# and generation of the import (changed by `invalidate()`)
+Generation = Tuple[int, int]
+
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    content_type: str
+
+
+class ResponseCache:
+    """
+    LRU cache of response bodies holding at most `max_size` bytes of them,
+    disabled if `max_size` is 0. Counters and gauges of the cache are kept
+    in `metrics` under the `cache.` prefix.
+
+    Bodies are stored along with the generation of the import they were
+    computed at: bodies computed before a change are not stored.
+    """
+
+    NAME: str
+    # A single body may take at most this part of the cache,
+    # so one large response does not evict all the others
+    MAX_ENTRY_SHARE = 4
+
+    def __init__(
+        self,
+        max_size: int = Config.RESPONSE_CACHE_SIZE,
+        ttl: float = Config.RESPONSE_CACHE_TTL,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.metrics = metrics or Metrics()
+        # Notifications of this cache are not handled by its own listener
+        self.source = uuid.uuid4().hex
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @property
+    def max_entry_size(self) -> int:
+        return self.max_size // self.MAX_ENTRY_SHARE
+
+    async def fetch(self, key: Hashable) -> Tuple[Optional[CacheEntry], bool]:
+        """
+        Entry of `key` (None if there is none or it has expired)
+        and whether it has expired
+        """
+
+        raise NotImplementedError
+
+    async def store(
+        self,
+        key: Hashable,
+        import_id: int,
+        generation: Generation,
+        entry: CacheEntry,
+    ) -> Optional[int]:
+        """
+        Store entry unless the import has changed since `generation`,
+        return number of evicted entries, None if it is not stored
+        """
+
+        raise NotImplementedError
+
+    async def generation(self, import_id: int) -> Generation:
+        raise NotImplementedError
+
+    async def drop(self, import_id: Optional[int]) -> None:
+        """
+        Drop entries of the import (all of them if None)
+        and change its generation
+        """
+
+        raise NotImplementedError
+
+    async def get(self, key: Hashable) -> Optional[CacheEntry]:
+        entry, expired = await self.fetch(key)
+        if expired:
+            self.metrics.inc("cache.expirations")
+
+        self.metrics.inc("cache.misses" if entry is None else "cache.hits")
+        return entry
+
+    async def set(
+        self,
+        key: Hashable,
+        import_id: int,
+        generation: Generation,
+        body: bytes,
+        content_type: str,
+    ) -> bool:
+        """
+        Store body of the import computed at its `generation`,
+        return whether it has been stored
+        """
+
+        if len(body) > self.max_entry_size:
+            return False
+
+        evicted = await self.store(
+            key, import_id, generation, CacheEntry(body, content_type)
+        )
+        if evicted:
+            self.metrics.inc("cache.evictions", evicted)
+
+        return evicted is not None
+
+    async def invalidate(self, import_id: int) -> None:
+        """
+        Drop bodies of the changed import
+        """
+
+        await self.drop(import_id)
+        self.metrics.inc("cache.invalidations")
+
+    async def clear(self) -> None:
+        """
+        Drop all the bodies: changes of imports might have been missed
+        """
+
+        await self.drop(None)
+
+    def update_gauges(self, size: int, entries: int) -> None:
+        self.metrics.set("cache.size", size)
+        self.metrics.set("cache.entries", entries)
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryEntry(NamedTuple):
+    import_id: int
+    entry: CacheEntry
+    expires: float
+
+
+class MemoryResponseCache(ResponseCache):
+    """
+    Cache in memory of the process
+    """
+
+    NAME = "memory"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.size = 0
+        self.entries: "OrderedDict[Hashable, MemoryEntry]" = OrderedDict()
+        self.keys: Dict[int, Set[Hashable]] = defaultdict(set)
+        self.epoch = 0
+        self.generations: Dict[int, int] = defaultdict(int)
+
+    async def generation(self, import_id: int) -> Generation:
+        return self.epoch, self.generations.get(import_id, 0)
+
+    async def fetch(self, key: Hashable) -> Tuple[Optional[CacheEntry], bool]:
+        item = self.entries.get(key)
+        if item is None:
+            return None, False
+
+        if item.expires <= time.monotonic():
+            self.remove(key)
+            self.update_gauges(self.size, len(self.entries))
+            return None, True
+
+        self.entries.move_to_end(key)
+        return item.entry, False
+
+    async def store(
+        self,
+        key: Hashable,
+        import_id: int,
+        generation: Generation,
+        entry: CacheEntry,
+    ) -> Optional[int]:
+        if generation != await self.generation(import_id):
+            return None
+
+        self.remove(key)
+        expires = time.monotonic() + self.ttl
+        self.entries[key] = MemoryEntry(import_id, entry, expires)
+        self.keys[import_id].add(key)
+        self.size += len(entry.body)
+
+        evicted = 0
+        while self.size > self.max_size:
+            self.remove(next(iter(self.entries)))
+            evicted += 1
+
+        self.update_gauges(self.size, len(self.entries))
+        return evicted
+
+    def remove(self, key: Hashable) -> None:
+        item = self.entries.pop(key, None)
+        if item is None:
+            return
+
+        self.size -= len(item.entry.body)
+        keys = self.keys[item.import_id]
+        keys.discard(key)
+        if not keys:
+            del self.keys[item.import_id]
+
+    async def drop(self, import_id: Optional[int]) -> None:
+        if import_id is None:
+            self.epoch += 1
+            keys = list(self.entries)
+        else:
+            self.generations[import_id] += 1
+            keys = list(self.keys.get(import_id, ()))
+
+        for key in keys:
+            self.remove(key)
+
+        self.update_gauges(self.size, len(self.entries))
+
+
+class SqliteResponseCache(ResponseCache):
+    """
+    Cache in a SQLite file shared by processes of the host.
+
+    Statements run in a thread of the cache (SQLite connections are bound
+    to their threads) and write transactions are `IMMEDIATE`, so processes
+    change the cache one at a time. Errors of SQLite are logged, the cache
+    behaves as empty.
+
+    A hit is a single SELECT: times of access are collected in memory and
+    written by the next store, or once `ACCESS_BATCH_SIZE` of them have
+    been collected. Triggers keep the total size of the bodies, so the
+    least recently used entries are evicted by the index on access time
+    without reading the whole table.
+    """
+
+    NAME = "sqlite"
+    TIMEOUT = 5
+    ACCESS_BATCH_SIZE = 256
+    # Generation of the whole cache is stored as generation of this import
+    EPOCH_IMPORT_ID = -1
+
+    PRAGMAS = ("PRAGMA journal_mode = WAL", "PRAGMA synchronous = OFF")
+    SCHEMA = (
+        # `used` is the time of the latest access in nanoseconds
+        "CREATE TABLE IF NOT EXISTS response ("
+        "key TEXT PRIMARY KEY, import_id INTEGER NOT NULL, body BLOB NOT NULL, "
+        "size INTEGER NOT NULL, content_type TEXT NOT NULL, "
+        "expires REAL NOT NULL, used INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS response_import_id ON response (import_id)",
+        "CREATE INDEX IF NOT EXISTS response_used ON response (used)",
+        "CREATE TABLE IF NOT EXISTS generation ("
+        "import_id INTEGER PRIMARY KEY, value INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS usage ("
+        "id INTEGER PRIMARY KEY CHECK (id = 0), "
+        "size INTEGER NOT NULL, entries INTEGER NOT NULL)",
+        # Files created before the usage table are counted once
+        "INSERT OR IGNORE INTO usage (id, size, entries) "
+        "SELECT 0, total(size), count(*) FROM response",
+        "CREATE TRIGGER IF NOT EXISTS response_insert AFTER INSERT ON response "
+        "BEGIN UPDATE usage SET size = size + NEW.size, entries = entries + 1; END",
+        "CREATE TRIGGER IF NOT EXISTS response_delete AFTER DELETE ON response "
+        "BEGIN UPDATE usage SET size = size - OLD.size, entries = entries - 1; END",
+    )
+
+    def __init__(self, path: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.conn: Optional[sqlite3.Connection] = None
+        # Times of access by keys, not written yet. Used by the thread only
+        self.accessed: Dict[str, int] = {}
+
+    def connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            # Transactions are begun explicitly
+            conn = sqlite3.connect(
+                self.path, timeout=self.TIMEOUT, isolation_level=None
+            )
+            for statement in self.PRAGMAS:
+                conn.execute(statement)
+            # Usage is counted by a single process
+            conn.execute("BEGIN IMMEDIATE")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self.conn = conn
+
+        return self.conn
+
+    async def run(self, func: Callable, *args, default: Any = None) -> Any:
+        def call():
+            conn = self.connect()
+            try:
+                return func(conn, *args)
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, call)
+        except sqlite3.Error:
+            logger.exception(f"Response cache {self.path} has failed")
+            return default
+
+    @staticmethod
+    def key(key: Hashable) -> str:
+        return repr(key)
+
+    def get_generation(self, conn: sqlite3.Connection, import_id: int) -> Generation:
+        rows = dict(
+            conn.execute(
+                "SELECT import_id, value FROM generation WHERE import_id IN (?, ?)",
+                (self.EPOCH_IMPORT_ID, import_id),
+            ).fetchall()
+        )
+        return rows.get(self.EPOCH_IMPORT_ID, 0), rows.get(import_id, 0)
+
+    def get_usage(self, conn: sqlite3.Connection) -> Tuple[int, int]:
+        return conn.execute("SELECT size, entries FROM usage").fetchone()
+
+    def set_gauges(self, conn: sqlite3.Connection) -> None:
+        self.update_gauges(*self.get_usage(conn))
+
+    def write_accessed(self, conn: sqlite3.Connection) -> None:
+        """
+        Write collected times of access within the transaction begun
+        """
+
+        conn.executemany(
+            "UPDATE response SET used = max(used, ?) WHERE key = ?",
+            [(used, key) for key, used in self.accessed.items()],
+        )
+        self.accessed.clear()
+
+    async def generation(self, import_id: int) -> Generation:
+        # Nothing is stored if the generation is unknown
+        return await self.run(self.get_generation, import_id, default=(-1, -1))
+
+    def fetch_sync(
+        self, conn: sqlite3.Connection, key: str
+    ) -> Tuple[Optional[CacheEntry], bool]:
+        row = conn.execute(
+            "SELECT body, content_type, expires FROM response WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None, False
+
+        body, content_type, expires = row
+        if expires <= time.time():
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM response WHERE key = ?", (key,))
+            conn.commit()
+            self.accessed.pop(key, None)
+            self.set_gauges(conn)
+            return None, True
+
+        self.accessed[key] = time.time_ns()
+        if len(self.accessed) >= self.ACCESS_BATCH_SIZE:
+            conn.execute("BEGIN IMMEDIATE")
+            self.write_accessed(conn)
+            conn.commit()
+
+        return CacheEntry(body, content_type), False
+
+    async def fetch(self, key: Hashable) -> Tuple[Optional[CacheEntry], bool]:
+        return await self.run(self.fetch_sync, self.key(key), default=(None, False))
+
+    def store_sync(
+        self,
+        conn: sqlite3.Connection,
+        key: str,
+        import_id: int,
+        generation: Generation,
+        entry: CacheEntry,
+    ) -> Optional[int]:
+        conn.execute("BEGIN IMMEDIATE")
+        if generation != self.get_generation(conn, import_id):
+            return None
+
+        self.write_accessed(conn)
+        # Deleted explicitly, as REPLACE does not fire delete triggers
+        conn.execute("DELETE FROM response WHERE key = ?", (key,))
+        conn.execute(
+            "INSERT INTO response "
+            "(key, import_id, body, size, content_type, expires, used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                import_id,
+                entry.body,
+                len(entry.body),
+                entry.content_type,
+                time.time() + self.ttl,
+                time.time_ns(),
+            ),
+        )
+
+        # Least recently used entries not fitting into the cache are evicted
+        evicted = []
+        size, _ = self.get_usage(conn)
+        if size > self.max_size:
+            rows = conn.execute("SELECT key, size FROM response ORDER BY used")
+            for row_key, row_size in rows:
+                evicted.append((row_key,))
+                size -= row_size
+                if size <= self.max_size:
+                    break
+            rows.close()
+
+        conn.executemany("DELETE FROM response WHERE key = ?", evicted)
+        conn.commit()
+        self.set_gauges(conn)
+        return len(evicted)
+
+    async def store(
+        self,
+        key: Hashable,
+        import_id: int,
+        generation: Generation,
+        entry: CacheEntry,
+    ) -> Optional[int]:
+        return await self.run(
+            self.store_sync, self.key(key), import_id, generation, entry
+        )
+
+    def drop_sync(self, conn: sqlite3.Connection, import_id: Optional[int]) -> None:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT INTO generation (import_id, value) VALUES (?, 1) "
+            "ON CONFLICT (import_id) DO UPDATE SET value = value + 1",
+            (self.EPOCH_IMPORT_ID if import_id is None else import_id,),
+        )
+        if import_id is None:
+            conn.execute("DELETE FROM response")
+            self.accessed.clear()
+        else:
+            conn.execute("DELETE FROM response WHERE import_id = ?", (import_id,))
+        conn.commit()
+        self.set_gauges(conn)
+
+    async def drop(self, import_id: Optional[int]) -> None:
+        await self.run(self.drop_sync, import_id)
+
+    async def close(self) -> None:
+        def close():
+            if self.conn is not None:
+                if self.accessed:
+                    try:
+                        self.conn.execute("BEGIN IMMEDIATE")
+                        self.write_accessed(self.conn)
+                        self.conn.commit()
+                    except sqlite3.Error:
+                        logger.exception(f"Response cache {self.path} has failed")
+                self.conn.close()
+
+        await asyncio.get_running_loop().run_in_executor(self.executor, close)
+        self.executor.shutdown()
+
+
+class BodyRecorder:
+    """
+    Collect chunks of a streamed body and pass the body to `on_complete`
+    once it has been written, unless it is larger than `max_size`
+    """
+
+    def __init__(self, max_size: int, on_complete: Callable[[bytes], Awaitable]):
+        self.max_size = max_size
+        self.on_complete = on_complete
+        self.size = 0
+        self.chunks: Optional[List[bytes]] = []
+
+    def write(self, chunk: bytes) -> None:
+        if self.chunks is None:
+            return
+
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            self.chunks = None
+        else:
+            self.chunks.append(chunk)
+
+    async def finish(self) -> None:
+        if self.chunks is not None:
+            await self.on_complete(b"".join(self.chunks))
+
+
+async def notify_invalidation(conn, cache: ResponseCache, import_id: int) -> None:
+    """
+    Notify other processes about the change of the import,
+    the notification is delivered once `conn` transaction commits
+    """
+
+    await conn.execute(
+        "SELECT pg_notify(%s, %s)",
+        (INVALIDATION_CHANNEL, f"{import_id} {cache.source}"),
+    )
+
+
+class InvalidationListener:
+    """
+    Listen to `INVALIDATION_CHANNEL` on a dedicated connection and drop
+    bodies of the changed imports. Changes may be missed while the
+    connection is lost, so the cache is cleared once it is restored.
+    """
+
+    RECONNECT_DELAY = 1
+
+    def __init__(self, dsn: str, cache: ResponseCache):
+        self.dsn = dsn
+        self.cache = cache
+        self.task: Optional[asyncio.Task] = None
+
+    async def connect(self) -> aiopg.Connection:
+        conn = await aiopg.connect(self.dsn)
+        try:
+            async with conn.cursor() as cur:
+                await cur.execute(f"LISTEN {INVALIDATION_CHANNEL}")
+        except BaseException:
+            await conn.close()
+            raise
+
+        await self.cache.clear()
+        return conn
+
+    async def handle(self, notification) -> None:
+        try:
+            import_id, source = notification.payload.split()
+            import_id = int(import_id)
+        except ValueError:
+            # Anyone may notify the channel, the listener must keep listening
+            logger.warning(
+                f"Malformed response cache notification {notification.payload!r}"
+            )
+            return
+
+        if source != self.cache.source:
+            await self.cache.invalidate(import_id)
+
+    async def listen(self, conn: aiopg.Connection) -> None:
+        while True:
+            try:
+                while True:
+                    await self.handle(await conn.notifies.get())
+            except (PGError, OSError):
+                logger.exception("Response cache listener has lost the connection")
+            finally:
+                await conn.close()
+
+            while True:
+                await asyncio.sleep(self.RECONNECT_DELAY)
+                try:
+                    conn = await self.connect()
+                    break
+                except (PGError, OSError):
+                    logger.warning("Response cache listener has failed to reconnect")
+
+    async def start(self) -> None:
+        conn = await self.connect()
+        self.task = asyncio.create_task(self.listen(conn))
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+
+async def setup_cache(app: web.Application, args: Namespace):
+    """
+    Create response cache chosen by `--response-cache-backend` option
+    and listen to changes of imports made by other processes.
+    Expects `app["metrics"]` to be set up
+    """
+
+    options = {
+        "max_size": args.response_cache_size,
+        "ttl": args.response_cache_ttl,
+        "metrics": app["metrics"],
+    }
+    if args.response_cache_backend == SqliteResponseCache.NAME:
+        cache = SqliteResponseCache(args.response_cache_path, **options)
+    else:
+        cache = MemoryResponseCache(**options)
+    app["cache"] = cache
+
+    listener = None
+    if cache.enabled:
+        listener = InvalidationListener(str(args.pg_url), cache)
+        await listener.start()
+        logger.info(f"Using {cache.NAME} response cache")
+
+    try:
+        yield
+    finally:
+        if listener is not None:
+            await listener.close()
+        await cache.close()
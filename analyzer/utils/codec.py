@@ -0,0 +1,105 @@
+"""
+    JSON codecs of request and response bodies
+
+    The codec is chosen once per process with `set_json_codec()` (see
+    `--json-codec`): payloads are created by aiohttp with no access to
+    the app, and request bodies are decoded in process pool workers.
+
+    Rows of responses are converted into JSON types by their compiled
+    serializers (see `analyzer.api.serializer`), dates are formatted in
+    `Config.BIRTH_DATE_FORMAT` there. Codecs encode everything else, so
+    dates not formatted beforehand are encoded in ISO 8601, enums as their
+    values and decimals as floats. orjson is used if installed.
+"""
+
+import json
+
+from datetime import date
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Dict, Tuple, Type, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonCodec:
+    """
+    Codec of the standard library `json` module
+    """
+
+    name = "json"
+
+    def default(self, value: Any) -> Any:
+        if isinstance(value, date):
+            return value.isoformat()
+        if isinstance(value, Enum):
+            return value.value
+        if isinstance(value, Decimal):
+            return float(value)
+
+        raise TypeError(f"Unserializable value: {value!r}")
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value, default=self.default, ensure_ascii=False).encode()
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """
+        Decode JSON document, raises `ValueError` if it is malformed
+        """
+
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """
+    Codec of orjson: dates and enums are encoded natively,
+    only decimals are passed to `default()`
+    """
+
+    name = "orjson"
+
+    def dumps(self, value: Any) -> bytes:
+        return orjson.dumps(
+            value, default=self.default, option=orjson.OPT_NON_STR_KEYS
+        )
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        # orjson.JSONDecodeError is a ValueError as well
+        return orjson.loads(data)
+
+
+CODECS: Dict[str, Type[JsonCodec]] = {JsonCodec.name: JsonCodec}
+if orjson is not None:
+    CODECS[OrjsonCodec.name] = OrjsonCodec
+
+CODEC_CHOICES: Tuple[str, ...] = ("auto", *CODECS)
+
+_codec: JsonCodec = JsonCodec()
+
+
+def set_json_codec(name: str) -> None:
+    """
+    Use codec `name` in this process, "auto" is the fastest one installed
+    """
+
+    global _codec
+
+    if name == "auto":
+        name = OrjsonCodec.name if OrjsonCodec.name in CODECS else JsonCodec.name
+
+    _codec = CODECS[name]()
+
+
+def get_json_codec() -> JsonCodec:
+    return _codec
+
+
+def dumps(value: Any) -> bytes:
+    return _codec.dumps(value)
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    return _codec.loads(data)
@@ -0,0 +1,145 @@
+"""
+    Compression of response bodies
+
+    gzip is always available, brotli and zstd are used if `brotli`
+    and `zstandard` packages are installed. Compressors are incremental,
+    so streamed bodies are compressed chunk by chunk; large chunks are
+    compressed in the default executor (zlib, brotli and zstandard
+    release the GIL), so the event loop keeps serving other requests.
+"""
+
+import asyncio
+import zlib
+
+from typing import Dict, Optional, Type
+
+from analyzer.config import Config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Compressor:
+    """
+    Incremental compressor of a single body
+    """
+
+    coding: str
+
+    def __init__(
+        self,
+        level: int = Config.COMPRESSION_LEVEL,
+        executor_size: int = Config.COMPRESSION_EXECUTOR_SIZE,
+    ):
+        self.level = level
+        self.executor_size = executor_size
+
+    def compress_sync(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def flush(self) -> bytes:
+        """
+        Rest of the compressed body, the compressor can't be used after
+        """
+
+        raise NotImplementedError
+
+    async def compress(self, data: bytes) -> bytes:
+        if len(data) < self.executor_size:
+            return self.compress_sync(data)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.compress_sync, data)
+
+
+class GzipCompressor(Compressor):
+    coding = "gzip"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compressor = zlib.compressobj(
+            self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+
+    def compress_sync(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor(Compressor):
+    coding = "br"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compressor = brotli.Compressor(quality=self.level)
+
+    def compress_sync(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor(Compressor):
+    coding = "zstd"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def compress_sync(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+# Available codings in the order of preference
+CODINGS: Dict[str, Type[Compressor]] = {}
+if zstandard is not None:
+    CODINGS[ZstdCompressor.coding] = ZstdCompressor
+if brotli is not None:
+    CODINGS[BrotliCompressor.coding] = BrotliCompressor
+CODINGS[GzipCompressor.coding] = GzipCompressor
+
+
+def parse_quality(params: str) -> float:
+    for param in params.split(";"):
+        name, _, value = param.partition("=")
+        if name.strip() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0
+
+    return 1
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """
+    Coding of `CODINGS` the client prefers according to `Accept-Encoding`,
+    None if the body should not be compressed
+    """
+
+    qualities = {}
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        qualities[coding.strip()] = parse_quality(params)
+
+    default = qualities.get("*", 0)
+    quality, coding = max(
+        ((qualities.get(coding, default), coding) for coding in CODINGS),
+        # Codings with the same quality are chosen in the order of preference
+        key=lambda item: item[0],
+    )
+
+    return coding if quality > 0 else None
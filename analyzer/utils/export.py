@@ -0,0 +1,343 @@
+"""
+    Export of imports with `COPY ... TO STDOUT` and load of exported
+    imports with `COPY ... FROM STDIN`
+
+    An export is a `multipart/mixed` body with a part per table, `citizen`
+    and `relation`, holding the output of COPY in CSV (with a header) or
+    binary format as PostgreSQL has written it. Python passes the output
+    by chunks of `ROWS_PER_COPY` citizens and does no work per row.
+
+    Exports are loaded back the same way: every part is streamed into
+    a temporary table with COPY, the import is checked with a few
+    set-based queries and moved into `citizen_table` and `relation_table`.
+"""
+
+import asyncio
+import io
+
+from aiohttp import BodyPartReader, MultipartReader, hdrs, web
+from configargparse import Namespace
+from marshmallow import ValidationError
+from psycopg2 import DataError, IntegrityError
+from sqlalchemy import MetaData, Table
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from analyzer.db.schema import (
+    citizen_stage_table,
+    citizen_table,
+    import_table,
+    relation_stage_table,
+    relation_table,
+)
+from analyzer.utils.ingest import (
+    PGCOPY_HEADER,
+    PGCOPY_TRAILER,
+    make_move_stage_query,
+    make_stage_checks,
+)
+from analyzer.utils.pg import SyncPool
+
+# Content types of parts by COPY formats
+EXPORT_FORMATS = {"csv": "text/csv", "binary": "application/octet-stream"}
+
+# Exported rows are loaded into temporary tables shaped as the staging ones,
+# each of them holds a single import
+_copy_metadata = MetaData()
+citizen_copy_table = citizen_stage_table.to_metadata(
+    _copy_metadata, name="citizen_copy"
+)
+relation_copy_table = relation_stage_table.to_metadata(
+    _copy_metadata, name="relation_copy"
+)
+COPY_STAGE_ID = 0
+
+# Exported tables and temporary tables they are loaded into by part names
+EXPORT_TABLES = {
+    citizen_table.name: (citizen_table, citizen_copy_table),
+    relation_table.name: (relation_table, relation_copy_table),
+}
+
+# Exported tables are split into ranges of `citizen_id` starting
+# with every `%(rows)s`-th citizen of the import
+RANGES_QUERY = (
+    f"SELECT citizen_id FROM ("
+    f"SELECT citizen_id, row_number() OVER (ORDER BY citizen_id) AS n "
+    f"FROM {citizen_table.name} WHERE import_id = %(import_id)s"
+    f") AS citizens WHERE n %% %(rows)s = 1 ORDER BY citizen_id"
+)
+
+# Checks of `ImportsSchema` the staging checks do not cover, COPY
+# has already checked types of values
+COPY_CHECKS = (
+    (
+        f"SELECT citizen_id FROM {citizen_copy_table.name} "
+        f"WHERE citizen_id < 0 OR apartment < 0 OR birth_date > current_date "
+        f"OR char_length(name) NOT BETWEEN 1 AND 256 "
+        f"OR char_length(town) NOT BETWEEN 1 AND 256 "
+        f"OR char_length(street) NOT BETWEEN 1 AND 256 "
+        f"OR char_length(building) NOT BETWEEN 1 AND 256 "
+        f"OR EXISTS ("
+        f"SELECT 1 FROM unnest(relatives) AS relative_id GROUP BY relative_id "
+        f"HAVING relative_id IS NULL OR relative_id < 0 OR count(*) > 1"
+        f") ORDER BY citizen_id LIMIT 1",
+        "citizen {0} is not valid",
+    ),
+    (
+        # `relatives` of citizens are a copy of their relations
+        f"SELECT coalesce(c.citizen_id, r.citizen_id) FROM ("
+        f"SELECT citizen_id, unnest(relatives) AS relative_id "
+        f"FROM {citizen_copy_table.name}"
+        f") AS c FULL JOIN {relation_copy_table.name} AS r "
+        f"ON r.citizen_id = c.citizen_id AND r.relative_id = c.relative_id "
+        f"WHERE c.citizen_id IS NULL OR r.citizen_id IS NULL "
+        f"ORDER BY 1 LIMIT 1",
+        "relatives of citizen {0} do not match its relations",
+    ),
+    *make_stage_checks(citizen_copy_table, relation_copy_table),
+)
+
+
+def get_columns(table: Table) -> List[str]:
+    return [column for column in table.columns.keys() if column != "import_id"]
+
+
+def make_copy_to_query(table: Table, format: str, header: bool) -> str:
+    order = ", ".join(column.name for column in table.primary_key)
+    # CSV of the first range starts with the header
+    header = header and format == "csv"
+    options = f"FORMAT {format}, HEADER" if header else f"FORMAT {format}"
+
+    return (
+        f"COPY (SELECT {', '.join(get_columns(table))} FROM {table.name} "
+        f"WHERE import_id = %(import_id)s AND citizen_id >= %(low)s "
+        f"AND (%(high)s IS NULL OR citizen_id < %(high)s) "
+        f"ORDER BY {order}) TO STDOUT WITH ({options})"
+    )
+
+
+def make_copy_from_query(table: Table, copy_table: Table, format: str) -> str:
+    options = "FORMAT csv, HEADER" if format == "csv" else f"FORMAT {format}"
+    columns = ", ".join(get_columns(table))
+    return f"COPY {copy_table.name} ({columns}) FROM STDIN WITH ({options})"
+
+
+def get_part_format(part: BodyPartReader) -> str:
+    content_type = part.headers.get(hdrs.CONTENT_TYPE, "").split(";")[0]
+    for format, format_content_type in EXPORT_FORMATS.items():
+        if content_type.strip().lower() == format_content_type:
+            return format
+
+    content_types = ", ".join(EXPORT_FORMATS.values())
+    raise ValidationError(
+        {part.name: [f"Content type must be one of: {content_types}"]}
+    )
+
+
+class PartFile:
+    """
+    File object reading body part of the request in the event loop
+    `loop` for `copy_expert` run in the default executor
+    """
+
+    def __init__(self, part: BodyPartReader, loop: asyncio.AbstractEventLoop):
+        self.part = part
+        self.loop = loop
+
+    def read(self, size: int) -> bytes:
+        future = asyncio.run_coroutine_threadsafe(self.part.read_chunk(size), self.loop)
+        return bytes(future.result())
+
+
+class ExportEngine:
+    """
+    Export imports and load exported ones with COPY.
+
+    psycopg2 does not support COPY for asynchronous connections (which
+    aiopg uses), so COPY runs on synchronous connections in the default
+    executor, as `CopyIngestEngine` does. Ranges of an export are copied
+    within a single `REPEATABLE READ` transaction, which is open until
+    the client receives the whole export.
+    """
+
+    ROWS_PER_COPY = 5000
+    READ_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, pool: SyncPool, rows_per_copy: int = ROWS_PER_COPY):
+        self.pool = pool
+        self.rows_per_copy = rows_per_copy
+
+    @staticmethod
+    def run(func: Callable, *args) -> Awaitable:
+        return asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def get_ranges(self, conn, import_id: int) -> List[Tuple[int, Optional[int]]]:
+        """
+        Begin the export transaction and split the import into ranges
+        of `citizen_id` (the last one is open)
+        """
+
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            cur.execute(
+                RANGES_QUERY, {"import_id": import_id, "rows": self.rows_per_copy}
+            )
+            bounds = [row[0] for row in cur.fetchall()] or [0]
+
+        return list(zip(bounds, [*bounds[1:], None]))
+
+    def copy_to(
+        self,
+        conn,
+        table: Table,
+        format: str,
+        params: dict,
+        first: bool,
+        last: bool,
+    ) -> bytes:
+        buffer = io.BytesIO()
+        with conn.cursor() as cur:
+            query = cur.mogrify(make_copy_to_query(table, format, first), params)
+            cur.copy_expert(query.decode(), buffer)
+
+        data = buffer.getvalue()
+        if format == "binary":
+            # Output of the ranges is joined into a single COPY file
+            start = 0 if first else len(PGCOPY_HEADER)
+            end = len(data) if last else len(data) - len(PGCOPY_TRAILER)
+            data = data[start:end]
+
+        return data
+
+    async def export(
+        self, import_id: int, format: str, boundary: str
+    ) -> AsyncIterator[bytes]:
+        """
+        Generate `multipart/mixed` body with `boundary` exporting
+        tables of the import in COPY `format`
+        """
+
+        async with self.pool.acquire() as conn:
+            try:
+                ranges = await self.run(self.get_ranges, conn, import_id)
+
+                for table in (citizen_table, relation_table):
+                    yield (
+                        f"--{boundary}\r\n"
+                        f"{hdrs.CONTENT_TYPE}: {EXPORT_FORMATS[format]}\r\n"
+                        f"{hdrs.CONTENT_DISPOSITION}: "
+                        f'attachment; name="{table.name}"\r\n\r\n'
+                    ).encode()
+
+                    for i, (low, high) in enumerate(ranges):
+                        params = {"import_id": import_id, "low": low, "high": high}
+                        first, last = i == 0, i == len(ranges) - 1
+                        yield await self.run(
+                            self.copy_to, conn, table, format, params, first, last
+                        )
+
+                    yield b"\r\n"
+
+                yield f"--{boundary}--\r\n".encode()
+            finally:
+                await self.run(conn.rollback)
+
+    def create_copy_tables(self, conn) -> None:
+        with conn.cursor() as cur:
+            for stage, copy_table in (
+                (citizen_stage_table, citizen_copy_table),
+                (relation_stage_table, relation_copy_table),
+            ):
+                cur.execute(
+                    f"CREATE TEMPORARY TABLE {copy_table.name} "
+                    f"(LIKE {stage.name} INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+                cur.execute(
+                    f"ALTER TABLE {copy_table.name} "
+                    f"ALTER COLUMN stage_id SET DEFAULT {COPY_STAGE_ID}"
+                )
+
+    def copy_from(self, conn, name: str, format: str, file: PartFile) -> int:
+        table, copy_table = EXPORT_TABLES[name]
+
+        with conn.cursor() as cur:
+            try:
+                cur.copy_expert(
+                    make_copy_from_query(table, copy_table, format),
+                    file,
+                    self.READ_CHUNK_SIZE,
+                )
+            except (DataError, IntegrityError) as err:
+                raise ValidationError({name: [err.diag.message_primary]})
+            return cur.rowcount
+
+    def create_import(self, conn) -> int:
+        """
+        Check the loaded import and move it from the temporary tables
+        """
+
+        params = {"stage_id": COPY_STAGE_ID}
+
+        with conn.cursor() as cur:
+            for query, message in COPY_CHECKS:
+                cur.execute(query, params)
+                violation = cur.fetchone()
+                if violation is not None:
+                    raise ValidationError({"_schema": [message.format(*violation)]})
+
+            cur.execute(
+                f"INSERT INTO {import_table.name} DEFAULT VALUES "
+                f"RETURNING {import_table.c.import_id.name}"
+            )
+            params["import_id"] = cur.fetchone()[0]
+
+            for table, copy_table in EXPORT_TABLES.values():
+                cur.execute(make_move_stage_query(table, copy_table), params)
+
+        return params["import_id"]
+
+    async def load(self, reader: MultipartReader) -> int:
+        """
+        Create import from the export read by `reader`,
+        raise `ValidationError` if it is not valid
+        """
+
+        loop = asyncio.get_running_loop()
+        loaded = set()
+
+        async with self.pool.acquire() as conn:
+            try:
+                await self.run(self.create_copy_tables, conn)
+
+                async for part in reader:
+                    # Nested multipart parts have no names
+                    if getattr(part, "name", None) not in EXPORT_TABLES:
+                        names = ", ".join(EXPORT_TABLES)
+                        raise ValidationError(
+                            {"_schema": [f"Parts must be named: {names}"]}
+                        )
+                    if part.name in loaded:
+                        raise ValidationError({part.name: ["Part is duplicated"]})
+
+                    format = get_part_format(part)
+                    await self.run(
+                        self.copy_from, conn, part.name, format, PartFile(part, loop)
+                    )
+                    loaded.add(part.name)
+
+                import_id = await self.run(self.create_import, conn)
+                await self.run(conn.commit)
+            except BaseException:
+                await self.run(conn.rollback)
+                raise
+
+        return import_id
+
+
+async def setup_export(app: web.Application, args: Namespace):
+    """
+    Create export engine using the pool of synchronous connections,
+    expects `app["sync_pg"]` to be set up by `setup_sync_pg`
+    """
+
+    app["export"] = ExportEngine(app["sync_pg"])
+    yield
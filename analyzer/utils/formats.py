@@ -0,0 +1,210 @@
+"""
+    Record formats of responses for bulk consumers
+
+    Rows of a query are encoded by batches, as they are fetched, into
+    newline delimited JSON, CSV, a stream of MessagePack maps or Arrow
+    IPC record batches. MessagePack and Arrow are available if `msgpack`
+    and `pyarrow` packages are installed.
+
+    Formats encode serialized rows (see `analyzer.api.serializer`):
+    dates are strings of `BIRTH_DATE_FORMAT`, enums are their values.
+"""
+
+import csv
+import io
+import json
+
+from operator import itemgetter
+from sqlalchemy import ARRAY, Integer, Numeric
+from sqlalchemy.types import TypeEngine
+from typing import Dict, Mapping, Optional, Sequence, Type
+
+from analyzer.utils.codec import dumps
+from analyzer.utils.compression import parse_quality
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+JSON_CONTENT_TYPE = "application/json"
+
+
+class RecordFormat:
+    """
+    Encoder of batches of rows with `columns` (field names and types)
+    into parts of a single response body
+    """
+
+    content_type: str
+
+    def __init__(self, columns: Mapping[str, TypeEngine]):
+        self.columns = columns
+
+    def start(self) -> bytes:
+        return b""
+
+    def encode(self, rows: Sequence[dict]) -> bytes:
+        raise NotImplementedError
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class NdjsonFormat(RecordFormat):
+    content_type = "application/x-ndjson"
+
+    def encode(self, rows: Sequence[dict]) -> bytes:
+        return b"".join([dumps(row) + b"\n" for row in rows])
+
+
+class CsvFormat(RecordFormat):
+    """
+    CSV with a header, arrays are written as JSON arrays
+    """
+
+    content_type = "text/csv"
+
+    def __init__(self, columns: Mapping[str, TypeEngine]):
+        super().__init__(columns)
+        self.arrays = [
+            field for field, type_ in columns.items() if isinstance(type_, ARRAY)
+        ]
+        # Rows are written as tuples of values in the order of columns
+        self.values = itemgetter(*columns) if len(columns) > 1 else None
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def flush(self) -> bytes:
+        data = self.buffer.getvalue().encode()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def start(self) -> bytes:
+        self.writer.writerow(self.columns)
+        return self.flush()
+
+    def encode(self, rows: Sequence[dict]) -> bytes:
+        # Rows are serialized for the response only, so they are changed in place
+        for field in self.arrays:
+            for row in rows:
+                row[field] = json.dumps(row[field], separators=(",", ":"))
+
+        if self.values is None:
+            self.writer.writerows(row.values() for row in rows)
+        else:
+            self.writer.writerows(map(self.values, rows))
+        return self.flush()
+
+
+class MsgpackFormat(RecordFormat):
+    """
+    Concatenated MessagePack maps, one per row
+    (read with `msgpack.Unpacker`)
+    """
+
+    content_type = "application/msgpack"
+
+    def __init__(self, columns: Mapping[str, TypeEngine]):
+        super().__init__(columns)
+        self.packer = msgpack.Packer()
+
+    def encode(self, rows: Sequence[dict]) -> bytes:
+        return b"".join([self.packer.pack(row) for row in rows])
+
+
+def arrow_type(type_: TypeEngine) -> "pyarrow.DataType":
+    if isinstance(type_, ARRAY):
+        return pyarrow.list_(arrow_type(type_.item_type))
+    if isinstance(type_, Integer):
+        return pyarrow.int64()
+    if isinstance(type_, Numeric):
+        return pyarrow.float64()
+
+    # Dates and enums are serialized into strings
+    return pyarrow.string()
+
+
+class ArrowFormat(RecordFormat):
+    """
+    Arrow IPC stream: the schema and a record batch per batch of rows
+    """
+
+    content_type = "application/vnd.apache.arrow.stream"
+
+    def __init__(self, columns: Mapping[str, TypeEngine]):
+        super().__init__(columns)
+        self.schema = pyarrow.schema(
+            [(field, arrow_type(type_)) for field, type_ in columns.items()]
+        )
+        self.sink = io.BytesIO()
+        self.writer = pyarrow.ipc.new_stream(self.sink, self.schema)
+
+    def flush(self) -> bytes:
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def start(self) -> bytes:
+        # Schema is written by the stream writer
+        return self.flush()
+
+    def encode(self, rows: Sequence[dict]) -> bytes:
+        batch = pyarrow.RecordBatch.from_pylist(list(rows), schema=self.schema)
+        self.writer.write_batch(batch)
+        return self.flush()
+
+    def finish(self) -> bytes:
+        self.writer.close()
+        return self.flush()
+
+
+# Available formats by content types, JSON has no record format
+FORMATS: Dict[str, Type[RecordFormat]] = {
+    NdjsonFormat.content_type: NdjsonFormat,
+    CsvFormat.content_type: CsvFormat,
+}
+if msgpack is not None:
+    FORMATS[MsgpackFormat.content_type] = MsgpackFormat
+if pyarrow is not None:
+    FORMATS[ArrowFormat.content_type] = ArrowFormat
+
+CONTENT_TYPES = (JSON_CONTENT_TYPE, *FORMATS)
+
+
+def negotiate_content_type(accept: str) -> Optional[str]:
+    """
+    Content type of `CONTENT_TYPES` the client prefers according to `Accept`
+    (JSON if it is not sent), None if none of them is acceptable
+    """
+
+    if not accept.strip():
+        return JSON_CONTENT_TYPE
+
+    qualities = {}
+    for item in accept.lower().split(","):
+        media_range, _, params = item.partition(";")
+        qualities[media_range.strip()] = parse_quality(params)
+
+    def quality(content_type: str) -> float:
+        main_type = content_type.split("/")[0]
+        for media_range in (content_type, f"{main_type}/*", "*/*"):
+            if media_range in qualities:
+                return qualities[media_range]
+        return 0
+
+    # Content types with the same quality are chosen in the order of preference
+    best, content_type = max(
+        ((quality(content_type), content_type) for content_type in CONTENT_TYPES),
+        key=lambda item: item[0],
+    )
+
+    return content_type if best > 0 else None
@@ -0,0 +1,788 @@
+"""
+    Engines writing citizens of a new import into the database
+"""
+
+import asyncio
+import io
+import logging
+import struct
+import time
+
+from aiohttp import web
+from aiomisc import chunk_list
+from aiopg.sa import Engine
+from aiopg.sa.result import RowProxy
+from configargparse import Namespace
+from contextlib import aclosing, contextmanager
+from datetime import date
+from marshmallow import ValidationError
+from psycopg2.errors import UniqueViolation
+from sqlalchemy import ARRAY, Date, Integer, Table, insert
+from sqlalchemy.sql.dml import Insert
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Generator,
+    Iterable,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from analyzer.db.schema import (
+    citizen_stage_table,
+    citizen_table,
+    import_table,
+    relation_stage_table,
+    relation_table,
+    stage_id_seq,
+)
+from analyzer.utils.metrics import Metrics
+from analyzer.utils.pg import MAX_QUERY_ARGS, SyncPool, compile_query
+
+logger = logging.getLogger(__name__)
+
+CitizenBatches = AsyncIterable[Sequence[Mapping]]
+# Called with the table and number of rows just written into it
+Progress = Callable[[Table, int], Awaitable[None]]
+
+
+def make_citizen_table_rows(
+    citizens: Iterable[Mapping],
+    import_id: int,
+    id_column: str = "import_id",
+) -> Generator:
+    """
+    Generate rows to insert into `citizen_table` lazy.
+    Rows for `citizen_stage_table` have `import_id` stored as `stage_id`.
+
+    Important:
+        Relatives of a generated row are only a copy of its relations.
+        Call `make_relation_table_rows(citizens, import_id)`
+        to generate relations for each citizen.
+    """
+
+    for citizen in citizens:
+        yield {
+            id_column: import_id,
+            "citizen_id": citizen["citizen_id"],
+            "name": citizen["name"],
+            "birth_date": citizen["birth_date"],
+            "gender": citizen["gender"],
+            "town": citizen["town"],
+            "street": citizen["street"],
+            "building": citizen["building"],
+            "apartment": citizen["apartment"],
+            "relatives": list(citizen["relatives"]),
+        }
+
+
+def make_relation_table_rows(
+    citizens: Iterable[Mapping],
+    import_id: int,
+    id_column: str = "import_id",
+) -> Generator:
+    """
+    Generate rows to insert into `relation_table` lazy.
+    """
+
+    for citizen in citizens:
+        for relative_id in citizen["relatives"]:
+            yield {
+                id_column: import_id,
+                "citizen_id": citizen["citizen_id"],
+                "relative_id": relative_id,
+            }
+
+
+async def single_batch(citizens: Sequence[Mapping]) -> CitizenBatches:
+    """
+    Represent already loaded citizens as `CitizenBatches`
+    """
+
+    yield citizens
+
+
+MAX_STAGED_CITIZENS_PER_INSERT = MAX_QUERY_ARGS // len(citizen_stage_table.columns)
+MAX_STAGED_RELATIONS_PER_INSERT = MAX_QUERY_ARGS // len(relation_stage_table.columns)
+
+
+async def insert_stage_rows(conn, stage_id: int, citizens: Sequence[Mapping]) -> None:
+    """
+    Write citizens into the staging tables with `SAConnection` `conn`.
+    Meant for small numbers of citizens, large imports are COPY'ed
+    by `StagingIngestEngine`
+    """
+
+    citizen_rows = make_citizen_table_rows(citizens, stage_id, "stage_id")
+    for chunk in chunk_list(citizen_rows, MAX_STAGED_CITIZENS_PER_INSERT):
+        await conn.execute(citizen_stage_table.insert().values(chunk))
+
+    relation_rows = make_relation_table_rows(citizens, stage_id, "stage_id")
+    for chunk in chunk_list(relation_rows, MAX_STAGED_RELATIONS_PER_INSERT):
+        await conn.execute(relation_stage_table.insert().values(chunk))
+
+
+# Name given to the unique constraint by `metadata` naming convention
+IDEMPOTENCY_KEY_CONSTRAINT = "uq__import_idempotency_key"
+
+
+class DuplicateImportError(Exception):
+    """
+    Import with the same `idempotency_key` already exists
+    """
+
+
+@contextmanager
+def check_duplicate_import() -> Iterator[None]:
+    try:
+        yield
+    except UniqueViolation as err:
+        if err.diag.constraint_name == IDEMPOTENCY_KEY_CONSTRAINT:
+            raise DuplicateImportError() from err
+        raise
+
+
+async def find_import(
+    pg: Engine,
+    idempotency_key: Optional[str] = None,
+    content_hash: Optional[str] = None,
+) -> Optional[RowProxy]:
+    """
+    Find import created with `idempotency_key` or, if there is none,
+    the one with the same (unchanged) content
+    """
+
+    conditions = []
+    if idempotency_key is not None:
+        conditions.append(import_table.c.idempotency_key == idempotency_key)
+    if content_hash is not None:
+        conditions.append(import_table.c.content_hash == content_hash)
+
+    async with pg.acquire() as conn:
+        for condition in conditions:
+            result = await conn.execute(
+                import_table.select().where(condition).order_by(import_table.c.import_id)
+            )
+            row = await result.first()
+            if row is not None:
+                return row
+
+    return None
+
+
+class Chunk(NamedTuple):
+    """
+    Rows of a table encoded to be written with a single database round trip
+    """
+
+    table: Table
+    rows: int
+    payload: Any
+
+
+class PipelineTimings:
+    """
+    Seconds spent by the stages of an import pipeline:
+
+    - read: waiting for batches of citizens (request parsing and validation)
+    - encode: turning rows into statements or COPY data
+    - write: database round trips
+    - backpressure: encoder waiting for the writer to free the queue
+    - starvation: writer waiting for the encoder
+    """
+
+    STAGES = ("read", "encode", "write", "backpressure", "starvation")
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.monotonic() - started
+
+    async def read(self, batches: CitizenBatches) -> CitizenBatches:
+        batches = batches.__aiter__()
+        while True:
+            with self.measure("read"):
+                try:
+                    citizens = await batches.__anext__()
+                except StopAsyncIteration:
+                    return
+
+            yield citizens
+
+    def __str__(self) -> str:
+        return ", ".join(
+            f"{stage} {seconds:.3f}s" for stage, seconds in self.seconds.items()
+        )
+
+
+class IngestEngine:
+    """
+    Creates an import record and writes citizens batches into it
+    within a single transaction.
+
+    Relations are written along with the batch of their citizens.
+    Their foreign keys are checked once the transaction is committed,
+    so a citizen may refer to relatives from any of the following
+    batches, and only the current batch is kept in memory.
+
+    Rows are encoded in a background task, staying up to
+    `pipeline_depth` chunks ahead of the database writer: encoding
+    of the next chunk overlaps with the round trip of the current one.
+
+    With `synchronous_commit` disabled the import transaction does not
+    wait for WAL to be flushed: a crash may lose the latest imports,
+    but never corrupts the database.
+    """
+
+    NAME: str
+    DISABLE_SYNCHRONOUS_COMMIT = "SET LOCAL synchronous_commit TO OFF"
+    DEFER_CONSTRAINTS = "SET CONSTRAINTS ALL DEFERRED"
+
+    def __init__(
+        self,
+        synchronous_commit: bool = True,
+        pipeline_depth: int = 2,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.synchronous_commit = synchronous_commit
+        self.pipeline_depth = pipeline_depth
+        self.metrics = metrics
+
+    async def ingest(
+        self,
+        batches: CitizenBatches,
+        progress: Optional[Progress] = None,
+        values: Optional[Mapping] = None,
+    ) -> int:
+        """
+        Write citizens into the new import, return its `import_id`.
+
+        `values` are stored into the `import_table` row. Raises
+        `DuplicateImportError` if an import with the same
+        `idempotency_key` has been created meanwhile.
+        """
+
+        raise NotImplementedError
+
+    @staticmethod
+    async def report(progress: Optional[Progress], table: Table, rows: int) -> None:
+        if progress is not None:
+            await progress(table, rows)
+
+    async def pipeline(
+        self,
+        chunks: AsyncIterator[Chunk],
+        write: Callable[[Chunk], Awaitable[int]],
+        timings: PipelineTimings,
+        progress: Optional[Progress] = None,
+    ) -> None:
+        """
+        Write `chunks` one by one with `write`, which returns number
+        of rows written, while the following chunks are being produced
+        """
+
+        queue = asyncio.Queue(maxsize=self.pipeline_depth)
+
+        async def produce():
+            try:
+                async with aclosing(chunks):
+                    async for chunk in chunks:
+                        with timings.measure("backpressure"):
+                            await queue.put((chunk, None))
+                await queue.put((None, None))
+            except Exception as err:
+                await queue.put((None, err))
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                with timings.measure("starvation"):
+                    chunk, err = await queue.get()
+
+                if err is not None:
+                    raise err
+                if chunk is None:
+                    return
+
+                with timings.measure("write"):
+                    rows = await write(chunk)
+                await self.report(progress, chunk.table, rows)
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+    def record(self, import_id: int, timings: PipelineTimings) -> None:
+        logger.info(f"Import {import_id} has been written by {self.NAME}: {timings}")
+        if self.metrics is not None:
+            for stage, seconds in timings.seconds.items():
+                self.metrics.observe(f"import.{stage}", seconds)
+
+    async def close(self) -> None:
+        pass
+
+
+class InsertIngestEngine(IngestEngine):
+    """
+    Write rows with chunked multi-row `INSERT ... VALUES` statements
+    """
+
+    NAME = "insert"
+
+    MAX_CITIZENS_PER_INSERT = MAX_QUERY_ARGS // len(citizen_table.columns)
+    MAX_RELATIONS_PER_INSERT = MAX_QUERY_ARGS // len(relation_table.columns)
+
+    def __init__(self, pg: Engine, **kwargs):
+        super().__init__(**kwargs)
+        self.pg = pg
+
+    def compile(self, query: Insert) -> Tuple[str, dict]:
+        """
+        Compile query the way `SAConnection.execute()` does,
+        so the writer only has to send it
+        """
+
+        return compile_query(query, self.pg.dialect)
+
+    async def encode(
+        self,
+        batches: CitizenBatches,
+        import_id: int,
+        timings: PipelineTimings,
+    ) -> AsyncIterator[Chunk]:
+        async for citizens in timings.read(batches):
+            for table, rows, max_rows in (
+                (
+                    citizen_table,
+                    make_citizen_table_rows(citizens, import_id),
+                    self.MAX_CITIZENS_PER_INSERT,
+                ),
+                (
+                    relation_table,
+                    make_relation_table_rows(citizens, import_id),
+                    self.MAX_RELATIONS_PER_INSERT,
+                ),
+            ):
+                for chunk in chunk_list(rows, max_rows):
+                    with timings.measure("encode"):
+                        query = self.compile(insert(table).values(chunk))
+                    yield Chunk(table, len(chunk), query)
+
+    async def ingest(
+        self,
+        batches: CitizenBatches,
+        progress: Optional[Progress] = None,
+        values: Optional[Mapping] = None,
+    ) -> int:
+        timings = PipelineTimings()
+
+        async with self.pg.acquire() as conn:
+
+            async def write(chunk: Chunk) -> int:
+                await conn.execute(*chunk.payload)
+                return chunk.rows
+
+            async with conn.begin() as _:
+                if not self.synchronous_commit:
+                    await conn.execute(self.DISABLE_SYNCHRONOUS_COMMIT)
+                await conn.execute(self.DEFER_CONSTRAINTS)
+
+                with check_duplicate_import():
+                    result = await conn.execute(
+                        import_table.insert()
+                        .values(**(values or {}))
+                        .returning(import_table.c.import_id)
+                    )
+                    import_id = await result.scalar()
+
+                chunks = self.encode(batches, import_id, timings)
+                await self.pipeline(chunks, write, timings, progress)
+
+        self.record(import_id, timings)
+        return import_id
+
+
+PG_EPOCH = date(2000, 1, 1)
+PGCOPY_HEADER = b"PGCOPY\n\377\r\n\0" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+INT4_OID = 23
+TEXT_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def encode_text_value(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, list):
+        return "{%s}" % ",".join(map(str, value))
+
+    return str(value).translate(TEXT_COPY_ESCAPES)
+
+
+def encode_binary_int(value: int) -> bytes:
+    return struct.pack("!ii", 4, value)
+
+
+def encode_binary_date(value: date) -> bytes:
+    return struct.pack("!ii", 4, (value - PG_EPOCH).days)
+
+
+def encode_binary_int_array(value: Sequence[int]) -> bytes:
+    # One dimension (unless empty), no NULLs, int4 elements, lower bound 1
+    header = struct.pack("!iii", 1 if value else 0, 0, INT4_OID)
+    if value:
+        header += struct.pack("!ii", len(value), 1)
+
+    data = header + b"".join(struct.pack("!ii", 4, item) for item in value)
+    return struct.pack("!i", len(data)) + data
+
+
+def encode_binary_text(value) -> bytes:
+    value = str(value).encode("utf-8")
+    return struct.pack("!i", len(value)) + value
+
+
+def make_binary_encoders(table: Table) -> Sequence[Callable]:
+    """
+    Choose binary encoder for each of the table columns by its type
+    """
+
+    encoders = []
+    for column in table.columns:
+        if isinstance(column.type, Integer):
+            encoders.append(encode_binary_int)
+        elif isinstance(column.type, Date):
+            encoders.append(encode_binary_date)
+        elif isinstance(column.type, ARRAY):
+            encoders.append(encode_binary_int_array)
+        else:
+            encoders.append(encode_binary_text)
+
+    return encoders
+
+
+class CopyIngestEngine(IngestEngine):
+    """
+    Stream rows into PostgreSQL with `COPY ... FROM STDIN`.
+
+    psycopg2 does not support COPY for asynchronous connections
+    (which aiopg uses), so the whole import transaction runs on a
+    dedicated synchronous connection in the default executor.
+    """
+
+    NAME = "copy"
+    FORMATS = ("text", "binary")
+    MAX_ROWS_PER_COPY = 5000
+
+    # Tables rows are copied into and the column rows are bound by
+    CITIZEN_TABLE = citizen_table
+    RELATION_TABLE = relation_table
+    ID_COLUMN = "import_id"
+
+    def __init__(
+        self,
+        pool: SyncPool,
+        format: str = "text",
+        **kwargs,
+    ):
+        if format not in self.FORMATS:
+            raise ValueError(f"Unsupported COPY format: {format}")
+
+        super().__init__(**kwargs)
+        self.pool = pool
+        self.format = format
+        self.binary_encoders = {
+            table.name: make_binary_encoders(table)
+            for table in (self.CITIZEN_TABLE, self.RELATION_TABLE)
+        }
+
+    def encode_rows(self, table: Table, rows: Iterable[Mapping]) -> io.BytesIO:
+        columns = table.columns.keys()
+        buffer = io.BytesIO()
+
+        if self.format == "binary":
+            encoders = self.binary_encoders[table.name]
+            fields_count = struct.pack("!h", len(columns))
+
+            buffer.write(PGCOPY_HEADER)
+            for row in rows:
+                buffer.write(fields_count)
+                for column, encode in zip(columns, encoders):
+                    buffer.write(encode(row[column]))
+            buffer.write(PGCOPY_TRAILER)
+        else:
+            for row in rows:
+                line = "\t".join(encode_text_value(row[column]) for column in columns)
+                buffer.write(line.encode("utf-8"))
+                buffer.write(b"\n")
+
+        buffer.seek(0)
+        return buffer
+
+    def copy(self, conn, table: Table, buffer: io.BytesIO) -> int:
+        columns = ", ".join(table.columns.keys())
+
+        with conn.cursor() as cur:
+            cur.copy_expert(
+                f"COPY {table.name} ({columns}) FROM STDIN WITH (FORMAT {self.format})",
+                buffer,
+            )
+            return cur.rowcount
+
+    def create_import(self, conn, values: Optional[Mapping] = None) -> int:
+        with conn.cursor() as cur:
+            if not self.synchronous_commit:
+                cur.execute(self.DISABLE_SYNCHRONOUS_COMMIT)
+            cur.execute(self.DEFER_CONSTRAINTS)
+
+            if values:
+                columns = ", ".join(values)
+                params = ", ".join(f"%({column})s" for column in values)
+                query = f"INSERT INTO {import_table.name} ({columns}) VALUES ({params})"
+            else:
+                query = f"INSERT INTO {import_table.name} DEFAULT VALUES"
+
+            with check_duplicate_import():
+                cur.execute(
+                    f"{query} RETURNING {import_table.c.import_id.name}", values
+                )
+            return cur.fetchone()[0]
+
+    @staticmethod
+    def run(func: Callable, *args) -> Awaitable:
+        return asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def encode(
+        self,
+        batches: CitizenBatches,
+        id: int,
+        timings: PipelineTimings,
+    ) -> AsyncIterator[Chunk]:
+        async for citizens in timings.read(batches):
+            for table, rows in (
+                (self.CITIZEN_TABLE, make_citizen_table_rows(citizens, id, self.ID_COLUMN)),
+                (self.RELATION_TABLE, make_relation_table_rows(citizens, id, self.ID_COLUMN)),
+            ):
+                for chunk in chunk_list(rows, self.MAX_ROWS_PER_COPY):
+                    with timings.measure("encode"):
+                        buffer = await self.run(self.encode_rows, table, chunk)
+
+                    yield Chunk(table, len(chunk), buffer)
+
+    async def write(
+        self,
+        conn,
+        import_id: int,
+        batches: CitizenBatches,
+        timings: PipelineTimings,
+        progress: Optional[Progress] = None,
+    ) -> None:
+        async def write(chunk: Chunk) -> int:
+            return await self.run(self.copy, conn, chunk.table, chunk.payload)
+
+        chunks = self.encode(batches, import_id, timings)
+        await self.pipeline(chunks, write, timings, progress)
+
+    async def ingest(
+        self,
+        batches: CitizenBatches,
+        progress: Optional[Progress] = None,
+        values: Optional[Mapping] = None,
+    ) -> int:
+        timings = PipelineTimings()
+
+        async with self.pool.acquire() as conn:
+            try:
+                import_id = await self.run(self.create_import, conn, values)
+                await self.write(conn, import_id, batches, timings, progress)
+                await self.run(conn.commit)
+            except BaseException:
+                await self.run(conn.rollback)
+                raise
+
+        self.record(import_id, timings)
+        return import_id
+
+
+def make_stage_checks(citizens: Table, relations: Table) -> Sequence[Tuple[str, str]]:
+    """
+    Queries finding the first row of `%(stage_id)s` staged in `citizens`
+    and `relations` violating constraints of `citizen_table` and
+    `relation_table` or checks of `ImportsSchema`, with the message
+    describing the violation
+    """
+
+    return (
+        (
+            f"SELECT citizen_id FROM {citizens.name} "
+            f"WHERE stage_id = %(stage_id)s "
+            f"GROUP BY citizen_id HAVING count(*) > 1 "
+            f"ORDER BY citizen_id LIMIT 1",
+            "citizen_id {0} is not unique",
+        ),
+        (
+            f"SELECT citizen_id FROM {relations.name} "
+            f"WHERE stage_id = %(stage_id)s "
+            f"GROUP BY citizen_id, relative_id HAVING count(*) > 1 "
+            f"ORDER BY citizen_id LIMIT 1",
+            "relatives of citizen {0} are not unique",
+        ),
+        (
+            # Relative missing from the import has no relations at all,
+            # so this also finds relations to nonexistent citizens
+            f"SELECT r.citizen_id, r.relative_id FROM {relations.name} AS r "
+            f"WHERE r.stage_id = %(stage_id)s AND NOT EXISTS ("
+            f"SELECT 1 FROM {relations.name} AS c "
+            f"WHERE c.stage_id = r.stage_id "
+            f"AND c.citizen_id = r.relative_id "
+            f"AND c.relative_id = r.citizen_id"
+            f") ORDER BY r.citizen_id, r.relative_id LIMIT 1",
+            "citizen {1} does not have relation with {0}",
+        ),
+    )
+
+
+STAGE_CHECKS = make_stage_checks(citizen_stage_table, relation_stage_table)
+
+
+def make_move_stage_query(table: Table, stage: Table) -> str:
+    """
+    Query moving rows of `%(stage_id)s` from `stage` into
+    `%(import_id)s` of `table` with a single statement
+    """
+
+    columns = [column for column in table.columns.keys() if column != "import_id"]
+    columns = ", ".join(columns)
+
+    return (
+        f"WITH staged AS ("
+        f"DELETE FROM {stage.name} WHERE stage_id = %(stage_id)s "
+        f"RETURNING {columns}"
+        f") "
+        f"INSERT INTO {table.name} (import_id, {columns}) "
+        f"SELECT %(import_id)s, {columns} FROM staged"
+    )
+
+
+class StagingIngestEngine(CopyIngestEngine):
+    """
+    COPY citizens into UNLOGGED staging tables, which have neither
+    constraints nor WAL, check the whole import with a few set-based
+    queries and move it into `citizen_table` and `relation_table`
+    with a single `INSERT ... SELECT` per table.
+
+    Relations are copied as soon as they are encoded. Their move still
+    fires the foreign key triggers of `relation_table` for every row:
+    disabling them takes superuser rights. Each trigger is a lookup of
+    the citizen primary key just inserted by the same transaction, so
+    the cost is an index probe per relation, not a round trip or a
+    separately checked row.
+    """
+
+    NAME = "staging"
+
+    CITIZEN_TABLE = citizen_stage_table
+    RELATION_TABLE = relation_stage_table
+    ID_COLUMN = "stage_id"
+
+    def create_stage(self, conn) -> int:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT nextval('{stage_id_seq.name}')")
+            return cur.fetchone()[0]
+
+    def check(self, conn, stage_id: int) -> None:
+        """
+        Raise `ValidationError` if staged citizens violate constraints
+        of `citizen_table` and `relation_table` or checks of `ImportsSchema`
+        """
+
+        with conn.cursor() as cur:
+            for query, message in STAGE_CHECKS:
+                cur.execute(query, {"stage_id": stage_id})
+                violation = cur.fetchone()
+                if violation is not None:
+                    raise ValidationError({"_schema": [message.format(*violation)]})
+
+    def move(self, conn, table: Table, stage: Table, import_id: int, stage_id: int) -> int:
+        """
+        Move staged rows into `table`, return number of rows moved
+        """
+
+        with conn.cursor() as cur:
+            cur.execute(
+                make_move_stage_query(table, stage),
+                {"import_id": import_id, "stage_id": stage_id},
+            )
+            return cur.rowcount
+
+    async def write(
+        self,
+        conn,
+        import_id: int,
+        batches: CitizenBatches,
+        timings: PipelineTimings,
+        progress: Optional[Progress] = None,
+    ) -> None:
+        stage_id = await self.run(self.create_stage, conn)
+
+        async def write(chunk: Chunk) -> int:
+            return await self.run(self.copy, conn, chunk.table, chunk.payload)
+
+        chunks = self.encode(batches, stage_id, timings)
+        await self.pipeline(chunks, write, timings)
+
+        with timings.measure("write"):
+            await self.run(self.check, conn, stage_id)
+
+        for table, stage in (
+            (citizen_table, citizen_stage_table),
+            (relation_table, relation_stage_table),
+        ):
+            with timings.measure("write"):
+                rows = await self.run(self.move, conn, table, stage, import_id, stage_id)
+            await self.report(progress, table, rows)
+
+
+async def setup_ingest(app: web.Application, args: Namespace):
+    """
+    Create import engine chosen by `--import-engine` option.
+    Expects `app["pg"]` and `app["sync_pg"]` to be set up
+    by `setup_pg` and `setup_sync_pg`, and `app["metrics"]`
+    """
+
+    options = {
+        "synchronous_commit": args.import_synchronous_commit == "on",
+        "pipeline_depth": args.import_pipeline_depth,
+        "metrics": app["metrics"],
+    }
+
+    if args.import_engine in (CopyIngestEngine.NAME, StagingIngestEngine.NAME):
+        engine_cls = (
+            StagingIngestEngine
+            if args.import_engine == StagingIngestEngine.NAME
+            else CopyIngestEngine
+        )
+        engine = engine_cls(app["sync_pg"], args.import_copy_format, **options)
+    else:
+        engine = InsertIngestEngine(app["pg"], **options)
+
+    logger.info(f"Using {engine.NAME} import engine")
+    app["ingest"] = engine
+
+    try:
+        yield
+    finally:
+        await engine.close()
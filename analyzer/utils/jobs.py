@@ -0,0 +1,257 @@
+"""
+    Background import jobs
+"""
+
+import asyncio
+import logging
+
+from functools import partial
+
+from aiohttp import web
+from aiohttp.payload import BytesPayload
+from aiopg.sa import Engine
+from configargparse import Namespace
+from marshmallow import ValidationError
+from sqlalchemy import Table
+from typing import Any, Awaitable, Callable, Mapping, Optional, Sequence
+
+from analyzer.db.schema import (
+    ImportJobPhase,
+    citizen_table,
+    import_job_table,
+)
+from analyzer.utils.codec import loads
+from analyzer.utils.ingest import (
+    DuplicateImportError,
+    IngestEngine,
+    find_import,
+    single_batch,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def describe_bad_request(err: web.HTTPBadRequest) -> Mapping[str, Any]:
+    """
+    Message and field errors of `err`, which is formatted
+    by `format_http_error` or has a plain text body
+    """
+
+    body = err.body._value if isinstance(err.body, BytesPayload) else err.body
+    try:
+        error = loads(body)["error"]
+        return {key: error[key] for key in ("message", "fields") if key in error}
+    except (TypeError, ValueError, KeyError):
+        return {"message": err.text or err.reason}
+
+
+class JobProgress:
+    """
+    Progress reported by the ingest of a job. It is only recorded in memory:
+    the latest state is written by a background task, so the ingest never
+    waits for a second connection of the pool while it holds one, and
+    reports arriving meanwhile are merged into a single update.
+    """
+
+    def __init__(self, update: Callable[..., Awaitable[None]]):
+        self.update = update
+        self.rows_written = 0
+        self.values: Optional[dict] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def __call__(self, table: Table, rows: int) -> None:
+        self.rows_written += rows
+        phase = (
+            ImportJobPhase.citizens
+            if table is citizen_table
+            else ImportJobPhase.relations
+        )
+        self.values = {"phase": phase, "rows_written": self.rows_written}
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        while self.values is not None:
+            values, self.values = self.values, None
+            await self.update(**values)
+
+    async def wait(self) -> None:
+        if self.task is not None:
+            await self.task
+
+    def cancel(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+
+
+class ImportJobQueue:
+    """
+    In-process queue of imports to be written by a fixed number of workers.
+    Job state is persisted to `import_job_table`.
+
+    Citizens of queued jobs are kept in memory only, so the process
+    owning the queue fails unfinished jobs left by its predecessor.
+    """
+
+    UNFINISHED_PHASES = (
+        ImportJobPhase.queued,
+        ImportJobPhase.citizens,
+        ImportJobPhase.relations,
+    )
+
+    def __init__(
+        self,
+        pg: Engine,
+        ingest: IngestEngine,
+        workers: int,
+        maxsize: int,
+    ):
+        self.pg = pg
+        self.ingest = ingest
+        self.workers_count = workers
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.workers = []
+
+    def full(self) -> bool:
+        return self.queue.full()
+
+    async def update(self, job_id: int, **values) -> None:
+        async with self.pg.acquire() as conn:
+            await conn.execute(
+                import_job_table.update()
+                .values(**values)
+                .where(import_job_table.c.job_id == job_id)
+            )
+
+    async def submit(
+        self,
+        citizens: Sequence[Mapping],
+        values: Optional[Mapping] = None,
+    ) -> Optional[int]:
+        """
+        Persist a new job and put it into the queue, `values` are stored
+        into the `import_table` row. Returns None if the queue is full.
+        """
+
+        if self.full():
+            return None
+
+        async with self.pg.acquire() as conn:
+            result = await conn.execute(
+                import_job_table.insert()
+                .values(phase=ImportJobPhase.queued)
+                .returning(import_job_table.c.job_id)
+            )
+            job_id = await result.scalar()
+
+        try:
+            self.queue.put_nowait((job_id, citizens, values))
+        except asyncio.QueueFull:
+            # Queue could have been filled while the job was being persisted
+            await self.fail(job_id, "Import queue is full")
+            return None
+
+        return job_id
+
+    async def fail_unfinished(self) -> int:
+        async with self.pg.acquire() as conn:
+            result = await conn.execute(
+                import_job_table.update()
+                .values(
+                    phase=ImportJobPhase.failed,
+                    error={"message": "Import has been interrupted"},
+                )
+                .where(import_job_table.c.phase.in_(self.UNFINISHED_PHASES))
+            )
+            return result.rowcount
+
+    async def fail(
+        self, job_id: int, message: str, fields: Optional[Mapping] = None
+    ) -> None:
+        error = {"message": message}
+        if fields:
+            error["fields"] = fields
+
+        await self.update(job_id, phase=ImportJobPhase.failed, error=error)
+
+    async def run(
+        self,
+        job_id: int,
+        citizens: Sequence[Mapping],
+        values: Optional[Mapping] = None,
+    ) -> None:
+        progress = JobProgress(partial(self.update, job_id))
+
+        await self.update(job_id, phase=ImportJobPhase.citizens)
+        try:
+            import_id = await self.ingest.ingest(single_batch(citizens), progress, values)
+        except DuplicateImportError:
+            # Import has been created by a concurrent request with the same key
+            row = await find_import(self.pg, values["idempotency_key"])
+            import_id = row["import_id"]
+        except BaseException:
+            # Progress must not overwrite the failure
+            progress.cancel()
+            raise
+
+        await progress.wait()
+        await self.update(job_id, phase=ImportJobPhase.done, import_id=import_id)
+
+    async def worker(self) -> None:
+        while True:
+            job_id, citizens, values = await self.queue.get()
+            try:
+                await self.run(job_id, citizens, values)
+            except asyncio.CancelledError:
+                await self.fail(job_id, "Import has been interrupted")
+                raise
+            # Imported data is wrong, the client is told why as in responses
+            except ValidationError as err:
+                await self.fail(job_id, "Import validation has failed", err.messages)
+            except web.HTTPBadRequest as err:
+                await self.fail(job_id, **describe_bad_request(err))
+            except Exception:
+                logger.exception(f"Import job {job_id} has failed")
+                await self.fail(job_id, "Import has failed")
+            finally:
+                self.queue.task_done()
+
+    def start(self) -> None:
+        self.workers = [
+            asyncio.create_task(self.worker()) for _ in range(self.workers_count)
+        ]
+
+    async def close(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+        while not self.queue.empty():
+            job_id, *_ = self.queue.get_nowait()
+            await self.fail(job_id, "Import has been interrupted")
+
+
+async def setup_jobs(app: web.Application, args: Namespace):
+    """
+    Start background import workers.
+    Expects `app["pg"]` and `app["ingest"]` to be set up
+    """
+
+    jobs = ImportJobQueue(
+        app["pg"],
+        app["ingest"],
+        workers=args.import_job_workers,
+        maxsize=args.import_job_queue_size,
+    )
+    failed = await jobs.fail_unfinished()
+    if failed:
+        logger.warning(f"Failed {failed} import jobs left unfinished")
+    jobs.start()
+    logger.info(f"Started {args.import_job_workers} import job workers")
+    app["jobs"] = jobs
+
+    try:
+        yield
+    finally:
+        await jobs.close()
@@ -0,0 +1,203 @@
+"""
+    Incremental parsing of JSON documents from a byte stream
+"""
+
+import codecs
+import json
+import re
+
+from aiohttp import StreamReader, web
+from typing import Any, AsyncIterator, Optional
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+
+
+class JsonStreamError(ValueError):
+    pass
+
+
+class JsonStreamReader:
+    """
+    Keeps only the undecoded tail of the stream in memory
+    """
+
+    # Decoding errors closer to the end of the buffer may be caused by
+    # a literal, a number or an escape sequence split between chunks
+    MAX_SPLIT_TOKEN = 16
+
+    __slots__ = (
+        "stream",
+        "chunk_size",
+        "max_size",
+        "size",
+        "eof",
+        "buffer",
+        "pos",
+        "_text",
+    )
+
+    decoder = json.JSONDecoder()
+
+    def __init__(
+        self,
+        stream: StreamReader,
+        chunk_size: int,
+        max_size: Optional[int] = None,
+    ):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.size = 0
+        self.eof = False
+        self.buffer = ""
+        self.pos = 0
+        self._text = codecs.getincrementaldecoder("utf-8")()
+
+    async def read(self) -> str:
+        if self.eof:
+            raise JsonStreamError("Unexpected end of JSON document")
+
+        chunk = await self.stream.read(self.chunk_size)
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise web.HTTPRequestEntityTooLarge(
+                max_size=self.max_size, actual_size=self.size
+            )
+
+        self.eof = not chunk
+        try:
+            return self._text.decode(chunk, final=self.eof)
+        except UnicodeDecodeError as err:
+            raise JsonStreamError(str(err))
+
+    async def fill(self, size: int = 0) -> None:
+        """
+        Read at least one chunk, until more than `size` characters
+        are pending or the stream is over
+        """
+
+        texts = [self.buffer[self.pos:]]
+        pending = len(texts[0])
+        while True:
+            text = await self.read()
+            texts.append(text)
+            pending += len(text)
+            if pending > size or self.eof:
+                break
+
+        self.buffer = "".join(texts)
+        self.pos = 0
+
+    async def skip_whitespace(self) -> None:
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or self.eof:
+                return
+            await self.fill()
+
+    async def peek(self) -> str:
+        await self.skip_whitespace()
+        if self.pos == len(self.buffer):
+            raise JsonStreamError("Unexpected end of JSON document")
+
+        return self.buffer[self.pos]
+
+    async def expect(self, *chars: str) -> str:
+        char = await self.peek()
+        if char not in chars:
+            raise JsonStreamError(
+                f"Expected {' or '.join(map(repr, chars))} at position {self.pos}"
+            )
+
+        self.pos += 1
+        return char
+
+    def truncated(self, err: json.JSONDecodeError) -> bool:
+        if err.msg.startswith("Unterminated string"):
+            return True
+        return len(self.buffer) - err.pos < self.MAX_SPLIT_TOKEN
+
+    def continued(self, value: Any, end: int) -> bool:
+        # A number at the end of the buffer may continue in the next chunk
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        return NUMBER_TAIL.match(self.buffer, end).end() == len(self.buffer)
+
+    async def value(self) -> Any:
+        """
+        Decode the next value. A value split between chunks is decoded
+        again once its pending text has doubled, so the total decoding
+        time is linear in its size. An invalid value fails as soon as
+        the error is followed by enough text to rule out a split token.
+        """
+
+        await self.skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as err:
+                if self.eof or not self.truncated(err):
+                    raise JsonStreamError(str(err))
+            else:
+                if self.eof or not self.continued(value, end):
+                    self.pos = end
+                    return value
+
+            await self.fill(2 * (len(self.buffer) - self.pos))
+
+    async def array(self) -> AsyncIterator[Any]:
+        await self.expect("[")
+        if await self.peek() == "]":
+            self.pos += 1
+            return
+
+        while True:
+            yield await self.value()
+            if await self.expect(",", "]") == "]":
+                return
+
+
+async def iter_json_array(
+    stream: StreamReader,
+    key: str,
+    chunk_size: int,
+    max_size: Optional[int] = None,
+) -> AsyncIterator[Any]:
+    """
+    Yield items of the array stored under `key` of the top-level
+    JSON object as soon as each of them has been received.
+
+    Values of other keys are decoded and skipped.
+    Raises `KeyError` if the object has no `key`.
+    """
+
+    reader = JsonStreamReader(stream, chunk_size, max_size)
+    found = False
+
+    await reader.expect("{")
+    if await reader.peek() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            name = await reader.value()
+            if not isinstance(name, str):
+                raise JsonStreamError("Object keys must be strings")
+            await reader.expect(":")
+
+            if name == key and not found:
+                found = True
+                async for item in reader.array():
+                    yield item
+            else:
+                await reader.value()
+
+            if await reader.expect(",", "}") == "}":
+                break
+
+    await reader.skip_whitespace()
+    if reader.pos != len(reader.buffer):
+        raise JsonStreamError(f"Extra data at position {reader.pos}")
+
+    if not found:
+        raise KeyError(key)
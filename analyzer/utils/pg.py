@@ -1,15 +1,23 @@
+import asyncio
 import logging
 import os
+import re
+import sys
+import time
 
 from aiohttp import web
-from aiopg.sa import create_engine, SAConnection
+from aiopg.sa import create_engine, Engine
+from aiopg.sa.result import RowProxy
 from alembic.config import Config as AlembicConfig
-from typing import AsyncIterable
+from contextlib import aclosing, asynccontextmanager
+from typing import Any, AsyncIterable, AsyncIterator, Optional, Sequence, Tuple
 from configargparse import Namespace
+from psycopg2.pool import ThreadedConnectionPool
 from pathlib import Path
-from sqlalchemy.sql import Select
+from sqlalchemy.engine import Dialect
+from sqlalchemy.sql import ClauseElement, Select
 from sqlalchemy.sql.functions import Function
-from sqlalchemy import Column, Numeric, cast, func
+from sqlalchemy import Column, Numeric, cast, func, text
 from typing import Union
 from types import SimpleNamespace
 
@@ -17,11 +25,33 @@ logger = logging.getLogger(__name__)
 
 CENSORED = "*****"
 MAX_QUERY_ARGS = 32767
+# `strftime` directives of dates and matching `to_char` template patterns
+TO_CHAR_PATTERNS = {"%d": "DD", "%m": "MM", "%Y": "YYYY", "%y": "YY", "%j": "DDD"}
 PROJECT_PATH = Path(__file__).parent.parent.resolve()
 
 
 def rounded(column: Column, fraction: int = 2) -> Function:
-    return func.round(cast(column, Numeric), fraction)
+    return func.round(cast(column, Numeric), fraction, type_=Numeric)
+
+
+def to_char_format(date_format: str) -> str:
+    """
+    Translate `strftime` date format into `to_char` template,
+    so PostgreSQL formats dates the same way Python does
+    """
+
+    template = []
+    for i, part in enumerate(re.split(r"(%.)", date_format)):
+        if i % 2:
+            if part not in TO_CHAR_PATTERNS:
+                raise ValueError(f"Unsupported date format directive: {part}")
+            template.append(TO_CHAR_PATTERNS[part])
+        elif part:
+            # Text in double quotes is not interpreted as patterns
+            escaped = part.replace("\\", "\\\\").replace('"', '\\"')
+            template.append(f'"{escaped}"')
+
+    return "".join(template)
 
 
 async def setup_pg(app: web.Application, args: Namespace):
@@ -42,9 +72,6 @@ async def setup_pg(app: web.Application, args: Namespace):
     async with engine.acquire() as conn:
         await conn.execute("SELECT 1")
         logger.info(f"Connected to database: {db_info}")
-        datestyle = "GERMAN, DMY"  # TODO: unhardcode to something like app["cfg"].PG_DATE_FORMAT
-        await conn.execute(f"SET datestyle = '{datestyle}'")
-        logger.info(f"Database date style set to: {datestyle}")
 
     try:
         yield
@@ -55,6 +82,59 @@ async def setup_pg(app: web.Application, args: Namespace):
         logger.info(f"Disconnected from database: {db_info}")
 
 
+class SyncPool:
+    """
+    Pool of synchronous psycopg2 connections shared by the engines which
+    COPY data in the default executor (imports and exports).
+
+    Nothing is connected until the first `acquire()`, so the pool costs
+    nothing if the engines are not used. ThreadedConnectionPool raises
+    instead of waiting for a free connection, so callers wait on
+    a semaphore of the pool size.
+    """
+
+    def __init__(self, dsn: str, maxsize: int):
+        self.dsn = dsn
+        self.maxsize = maxsize
+        self.semaphore = asyncio.Semaphore(maxsize)
+        self._pool: Optional[ThreadedConnectionPool] = None
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Any]:
+        async with self.semaphore:
+            if self._pool is None:
+                self._pool = ThreadedConnectionPool(
+                    minconn=0, maxconn=self.maxsize, dsn=self.dsn
+                )
+
+            loop = asyncio.get_running_loop()
+            conn = await loop.run_in_executor(None, self._pool.getconn)
+            try:
+                yield conn
+            finally:
+                self._pool.putconn(conn)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+
+
+async def setup_sync_pg(app: web.Application, args: Namespace):
+    """
+    Create pool of synchronous connections for imports and exports
+    written with COPY
+    """
+
+    pool = SyncPool(str(args.pg_url), args.pg_sync_pool_max_size)
+    app["sync_pg"] = pool
+
+    try:
+        yield
+    finally:
+        pool.close()
+
+
 def make_alembic_config(
     cmd_opts: Union[SimpleNamespace, Namespace],
     base_path: str = PROJECT_PATH,
@@ -85,36 +165,135 @@ def make_alembic_config(
     return config
 
 
+def compile_query(query: ClauseElement, dialect: Dialect) -> Tuple[str, dict]:
+    """
+    Compile query the way `SAConnection.execute()` does, returning
+    SQL with `pyformat` placeholders and processed parameters
+    """
+
+    compiled = query.compile(dialect=dialect)
+    processors = compiled._bind_processors
+    params = {
+        key: processors[key](value) if key in processors else value
+        for key, value in compiled.construct_params().items()
+    }
+    return str(compiled), params
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Rough number of bytes taken by a fetched value in memory
+    """
+
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+
+    return sys.getsizeof(value)
+
+
 class SelectQuery(AsyncIterable):
     """
     Used to send data from PostgreSQL straight to the client
-    after recieving it, in parts, without buffering all data
+    after recieving it, in parts, without buffering all data.
+
+    Rows are read through a server-side cursor (`DECLARE ... CURSOR`)
+    with `FETCH` statements, so only one batch of rows is held in memory:
+    ordinary psycopg2 cursors receive the whole result at once.
+
+    Batch size starts from `prefetch` rows and adapts to the fetched
+    rows: a batch takes up to `BATCH_BYTES` of memory and is fetched
+    within about `BATCH_LATENCY` seconds.
+
+    `timeout_ms` limits every statement of the query.
+
+    Connection is acquired from `pg` when the iteration starts and
+    released when it ends, so the query may be passed as a response
+    body and be iterated while the response is being sent.
     """
 
     PREFETCH = 500
+    MIN_PREFETCH = 50
+    MAX_PREFETCH = 10_000
+    BATCH_BYTES = 1024 * 1024
+    BATCH_LATENCY = 0.05
+    CURSOR_NAME = "select_query"
 
-    __slots__ = ("query", "conn", "prefetch", "timeout_ms")
+    __slots__ = ("query", "pg", "prefetch", "timeout_ms")
 
     def __init__(
         self,
         query: Select,
-        conn: SAConnection,
+        pg: Engine,
         prefetch: int = None,
         timeout_ms: int = None,
     ):
         self.query = query
-        self.conn = conn
+        self.pg = pg
         self.prefetch = prefetch or self.PREFETCH
         self.timeout_ms = timeout_ms
 
-    async def __aiter__(self):
-        async with self.conn.begin() as _:
-            if self.timeout_ms is not None:
-                await self.conn.execute(f"SET statement_timeout = {self.timeout_ms}")
-            async with self.conn.execute(self.query) as cur:
+    def adapt_prefetch(self, prefetch: int, rows: Sequence[RowProxy], seconds: float) -> int:
+        """
+        Size of the next batch: as many rows as fit into `BATCH_BYTES`,
+        growing at most twice per batch and shrinking proportionally
+        if the batch took longer than `BATCH_LATENCY` to fetch
+        """
+
+        row_size = max(estimate_size(rows[0].as_tuple()), 1)
+        size = min(self.BATCH_BYTES // row_size, prefetch * 2)
+        if seconds > self.BATCH_LATENCY:
+            size = min(size, int(prefetch * self.BATCH_LATENCY / seconds))
+
+        return max(self.MIN_PREFETCH, min(size, self.MAX_PREFETCH))
+
+    async def batches(self) -> AsyncIterator[Sequence[RowProxy]]:
+        """
+        Iterate over the rows by the fetched batches
+        """
+
+        sql, params = compile_query(self.query, self.pg.dialect)
+        # Typed textual query, so fetched values are processed the same way
+        # as values of `self.query` would be (e.g. enums)
+        fetch = text(f"FETCH :count FROM {self.CURSOR_NAME}").columns(
+            *self.query.selected_columns
+        )
+
+        async with self.pg.acquire() as conn:
+            async with conn.begin() as _:
+                if self.timeout_ms is not None:
+                    await conn.execute(
+                        "SELECT set_config('statement_timeout', %s, true)",
+                        (str(self.timeout_ms),),
+                    )
+
+                await conn.execute(
+                    f"DECLARE {self.CURSOR_NAME} NO SCROLL CURSOR FOR {sql}", params
+                )
+
+                prefetch = self.prefetch
+                first = True
                 while True:
-                    rows = await cur.fetchmany(self.prefetch)
+                    started = time.monotonic()
+                    result = await conn.execute(fetch, count=prefetch)
+                    rows = await result.fetchall()
+                    seconds = time.monotonic() - started
+
                     if not rows:
                         break
-                    for row in rows:
-                        yield row
+
+                    yield rows
+
+                    if len(rows) < prefetch:
+                        break
+
+                    # The first FETCH also waits for the query to start
+                    # producing rows, e.g. for sorting to finish
+                    prefetch = self.adapt_prefetch(prefetch, rows, 0 if first else seconds)
+                    first = False
+
+    async def __aiter__(self):
+        # Cursor and connection are released as soon as the iteration stops
+        async with aclosing(self.batches()) as batches:
+            async for rows in batches:
+                for row in rows:
+                    yield row
@@ -0,0 +1,138 @@
+"""
+    Process pool for CPU bound request processing
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from aiohttp import web
+from concurrent.futures import ProcessPoolExecutor
+from configargparse import Namespace
+from multiprocessing import get_context
+from typing import Any, Callable, Optional, Tuple
+
+from analyzer.utils.codec import set_json_codec
+from analyzer.utils.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+def timed_call(func: Callable, *args) -> Tuple[float, Optional[Exception], Any]:
+    """
+    Call `func` in a worker process, reporting when the call has started.
+
+    Exceptions are returned rather than raised, so the time spent
+    in the queue is known for failed calls as well.
+    """
+
+    # CLOCK_MONOTONIC is shared by all processes of the system
+    started = time.monotonic()
+    try:
+        return started, None, func(*args)
+    except Exception as err:
+        return started, err, None
+
+
+class ProcessPool:
+    """
+    Runs functions in worker processes, so decoding and validation
+    of large request bodies do not block the event loop.
+
+    Functions and their arguments must be picklable. With no workers
+    functions are called in the event loop.
+
+    Reports `process_pool.queue_time` (from submission till a worker
+    picked the call up), `process_pool.run_time` (including transfer
+    of the result back) and `process_pool.pending` calls.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        metrics: Metrics,
+        initializer: Optional[Callable] = None,
+        initargs: Tuple = (),
+    ):
+        self.workers = workers
+        self.metrics = metrics
+        self.pending = 0
+        self.executor = None
+
+        if workers:
+            # Forking a process with running threads (e.g. the default
+            # executor ones) is unsafe, so workers are spawned from scratch
+            self.executor = ProcessPoolExecutor(
+                workers,
+                mp_context=get_context("spawn"),
+                initializer=initializer,
+                initargs=initargs,
+            )
+
+    async def start(self) -> None:
+        """
+        Spawn workers beforehand, so the first requests do not wait for them
+        """
+
+        if self.executor is not None:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(
+                *(
+                    loop.run_in_executor(self.executor, os.getpid)
+                    for _ in range(self.workers)
+                )
+            )
+
+    async def run(self, func: Callable, *args) -> Any:
+        if self.executor is None:
+            with self.metrics.timer("process_pool.run_time"):
+                return func(*args)
+
+        loop = asyncio.get_running_loop()
+        submitted = time.monotonic()
+        self.pending += 1
+        self.metrics.set("process_pool.pending", self.pending)
+        try:
+            started, err, result = await loop.run_in_executor(
+                self.executor, timed_call, func, *args
+            )
+        finally:
+            self.pending -= 1
+            self.metrics.set("process_pool.pending", self.pending)
+
+        self.metrics.observe("process_pool.queue_time", started - submitted)
+        self.metrics.observe("process_pool.run_time", time.monotonic() - started)
+
+        if err is not None:
+            raise err
+
+        return result
+
+    async def close(self) -> None:
+        if self.executor is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.executor.shutdown)
+
+
+async def setup_pool(app: web.Application, args: Namespace):
+    """
+    Start process pool of `--validation-pool-size` workers.
+    Expects `app["metrics"]` to be set up
+    """
+
+    # Workers decode request bodies with the codec of the app
+    pool = ProcessPool(
+        args.validation_pool_size,
+        app["metrics"],
+        initializer=set_json_codec,
+        initargs=(args.json_codec,),
+    )
+    await pool.start()
+    logger.info(f"Started {args.validation_pool_size} validation pool workers")
+    app["pool"] = pool
+
+    try:
+        yield
+    finally:
+        await pool.close()
@@ -1,3 +1,7 @@
+import csv
+import io
+import json
+
 from aiohttp.typedefs import StrOrURL
 from aiohttp.web_urldispatcher import DynamicResource
 from aiohttp.test_utils import TestClient
@@ -5,23 +9,43 @@ from enum import EnumMeta
 from faker import Faker
 from http import HTTPStatus
 from random import randint, choice, shuffle
-from typing import Optional, List, Dict, Any, Mapping, Iterable, Union
+from typing import Optional, List, Dict, Any, Mapping, Iterable, Tuple, Union
 
 from analyzer.api.routes import (
     ImportsView,
+    ImportsCopyView,
+    ImportJobView,
+    DerivedImportView,
+    ImportExportView,
     CitizenView,
     CitizensView,
     CitizenPresentsView,
     AgeStatsView,
+    MetricsView,
+    UploadSessionsView,
+    UploadSessionBatchView,
+    UploadSessionCommitView,
 )
 from analyzer.api.schema import (
     ImportsResponseSchema,
+    ImportJobIdResponseSchema,
+    ImportJobResponseSchema,
     CitizensResponseSchema,
     PatchCitizenResponseSchema,
     CitizenPresentsResponseSchema,
     AgeStatsResponseSchema,
+    MetricsResponseSchema,
+    UploadSessionResponseSchema,
 )
 from analyzer.config import TestConfig
+from analyzer.utils.formats import (
+    ArrowFormat,
+    CsvFormat,
+    MsgpackFormat,
+    NdjsonFormat,
+    msgpack,
+    pyarrow,
+)
 
 CitizenType = Dict[str, Any]
 MAX_INTEGER = 2147483647
@@ -169,10 +193,11 @@ async def post_imports_data(
     client: TestClient,
     citizens: List[Mapping[str, Any]],
     expected_status: Union[int, EnumMeta] = HTTPStatus.CREATED,
+    str_or_url: StrOrURL = ImportsView.URL_PATH,
     **request_kwargs,
 ) -> Optional[int]:
     response = await client.post(
-        ImportsView.URL_PATH,
+        str_or_url,
         json={"citizens": citizens},
         **request_kwargs,
     )
@@ -186,6 +211,75 @@ async def post_imports_data(
         return data["data"]["import_id"]
 
 
+async def derive_import_data(
+    client: TestClient,
+    import_id: int,
+    citizens: List[Mapping[str, Any]] = (),
+    removed: List[int] = (),
+    expected_status: Union[int, EnumMeta] = HTTPStatus.CREATED,
+    **request_kwargs,
+) -> Optional[int]:
+    response = await client.post(
+        url_for(DerivedImportView.URL_PATH, import_id=import_id),
+        json={"citizens": list(citizens), "removed": list(removed)},
+        **request_kwargs,
+    )
+
+    assert response.status == expected_status
+
+    if response.status == HTTPStatus.CREATED:
+        data = await response.json()
+        errors = ImportsResponseSchema().validate(data)
+        assert errors == {}
+        return data["data"]["import_id"]
+
+
+async def post_imports_job(
+    client: TestClient,
+    citizens: List[Mapping[str, Any]],
+    expected_status: Union[int, EnumMeta] = HTTPStatus.ACCEPTED,
+    **request_kwargs,
+) -> Optional[int]:
+    response = await client.post(
+        ImportsView.URL_PATH,
+        json={"citizens": citizens},
+        headers={"Prefer": "respond-async"},
+        **request_kwargs,
+    )
+
+    assert response.status == expected_status
+
+    if response.status == HTTPStatus.ACCEPTED:
+        data = await response.json()
+        errors = ImportJobIdResponseSchema().validate(data)
+        assert errors == {}
+        job_id = data["data"]["job_id"]
+        assert response.headers["Location"] == url_for(
+            ImportJobView.URL_PATH, job_id=job_id
+        )
+        return job_id
+
+
+async def get_import_job_data(
+    client: TestClient,
+    job_id: int,
+    expected_status: Union[int, EnumMeta] = HTTPStatus.OK,
+    **request_kwargs,
+) -> Dict[str, Any]:
+    response = await client.get(
+        url_for(ImportJobView.URL_PATH, job_id=job_id),
+        **request_kwargs,
+    )
+
+    assert response.status == expected_status
+
+    if response.status == HTTPStatus.OK:
+        data = await response.json()
+        errors = ImportJobResponseSchema().validate(data)
+        assert errors == {}
+        return data["data"]
+
+
 async def get_citizens_data(
     client: TestClient,
     import_id: int,
@@ -201,11 +295,37 @@ async def get_citizens_data(
 
     if response.status == HTTPStatus.OK:
         data = await response.json()
-        errors = CitizensResponseSchema().validate(data)
+        # Projected citizens have only the requested fields
+        partial = "fields" in request_kwargs.get("params", {})
+        errors = CitizensResponseSchema().validate(data, partial=partial)
         assert errors == {}
         return data["data"]
 
 
+async def get_citizens_page(
+    client: TestClient,
+    import_id: int,
+    params: Mapping[str, Any],
+    expected_status: Union[int, EnumMeta] = HTTPStatus.OK,
+    **request_kwargs,
+) -> Optional[dict]:
+    response = await client.get(
+        url_for(CitizensView.URL_PATH, import_id=import_id),
+        params=params,
+        **request_kwargs,
+    )
+
+    assert response.status == expected_status
+
+    if response.status == HTTPStatus.OK:
+        data = await response.json()
+        # Fields of following pages are kept by their cursor
+        partial = "fields" in params or "cursor" in params
+        errors = CitizensResponseSchema().validate(data, partial=partial)
+        assert errors == {}
+        return data
+
+
 async def patch_citizen_data(
     client: TestClient,
     import_id: int,
@@ -268,3 +388,196 @@ async def get_age_stats_data(
         errors = AgeStatsResponseSchema().validate(data)
         assert errors == {}
         return data["data"]
+
+
+async def get_metrics_data(
+    client: TestClient,
+    expected_status: Union[int, EnumMeta] = HTTPStatus.OK,
+    **request_kwargs,
+) -> Dict[str, Any]:
+    response = await client.get(MetricsView.URL_PATH, **request_kwargs)
+
+    assert response.status == expected_status
+
+    if response.status == HTTPStatus.OK:
+        data = await response.json()
+        errors = MetricsResponseSchema().validate(data)
+        assert errors == {}
+        return data["data"]
+
+
+async def open_upload_session(
+    client: TestClient,
+    expected_status: Union[int, EnumMeta] = HTTPStatus.CREATED,
+    **request_kwargs,
+) -> Optional[int]:
+    response = await client.post(UploadSessionsView.URL_PATH, **request_kwargs)
+
+    assert response.status == expected_status
+
+    if response.status == HTTPStatus.CREATED:
+        data = await response.json()
+        errors = UploadSessionResponseSchema().validate(data)
+        assert errors == {}
+        return data["data"]["session_id"]
+
+
+async def put_upload_batch(
+    client: TestClient,
+    session_id: int,
+    batch: int,
+    citizens: List[Mapping[str, Any]],
+    expected_status: Union[int, EnumMeta] = HTTPStatus.OK,
+    **request_kwargs,
+) -> Optional[Dict[str, Any]]:
+    response = await client.put(
+        url_for(UploadSessionBatchView.URL_PATH, session_id=session_id, batch=batch),
+        json={"citizens": citizens},
+        **request_kwargs,
+    )
+
+    assert response.status == expected_status
+
+    if response.status == HTTPStatus.OK:
+        data = await response.json()
+        errors = UploadSessionResponseSchema().validate(data)
+        assert errors == {}
+        return data["data"]
+
+
+async def commit_upload_session(
+    client: TestClient,
+    session_id: int,
+    expected_status: Union[int, EnumMeta] = HTTPStatus.CREATED,
+    **request_kwargs,
+) -> Optional[int]:
+    response = await client.post(
+        url_for(UploadSessionCommitView.URL_PATH, session_id=session_id),
+        **request_kwargs,
+    )
+
+    assert response.status == expected_status
+
+    if response.status == HTTPStatus.CREATED:
+        data = await response.json()
+        errors = ImportsResponseSchema().validate(data)
+        assert errors == {}
+        return data["data"]["import_id"]
+
+
+def decode_records(content_type: str, body: bytes) -> List[Dict[str, Any]]:
+    """
+    Decode rows of a response in a record format, CSV values are strings
+    """
+
+    if content_type == NdjsonFormat.content_type:
+        return [json.loads(line) for line in body.splitlines()]
+    if content_type == CsvFormat.content_type:
+        return list(csv.DictReader(io.StringIO(body.decode())))
+    if content_type == MsgpackFormat.content_type:
+        return list(msgpack.Unpacker(io.BytesIO(body)))
+    if content_type == ArrowFormat.content_type:
+        return pyarrow.ipc.open_stream(body).read_all().to_pylist()
+
+    raise ValueError(f"Unknown content type {content_type}")
+
+
+async def get_records(
+    client: TestClient,
+    path: str,
+    content_type: str,
+    expected_status: Union[int, EnumMeta] = HTTPStatus.OK,
+    **request_kwargs,
+) -> Optional[List[Dict[str, Any]]]:
+    response = await client.get(path, headers={"Accept": content_type}, **request_kwargs)
+
+    assert response.status == expected_status
+
+    if response.status == HTTPStatus.OK:
+        assert response.content_type == content_type
+        return decode_records(content_type, await response.read())
+
+
+async def export_import_data(
+    client: TestClient,
+    import_id: int,
+    format: Optional[str] = None,
+    expected_status: Union[int, EnumMeta] = HTTPStatus.OK,
+    **request_kwargs,
+) -> Optional[Tuple[str, bytes]]:
+    """
+    Return content type (with the boundary) and body of the export
+    """
+
+    response = await client.get(
+        url_for(ImportExportView.URL_PATH, import_id=import_id),
+        params={"format": format} if format else None,
+        **request_kwargs,
+    )
+
+    assert response.status == expected_status
+
+    if response.status == HTTPStatus.OK:
+        assert response.content_type == "multipart/mixed"
+        return response.headers["Content-Type"], await response.read()
+
+
+def decode_export(
+    content_type: str, body: bytes
+) -> Dict[str, Tuple[str, bytes]]:
+    """
+    Split export into content types and data of its parts by names
+    """
+
+    boundary = content_type.split("boundary=")[1].encode()
+    parts = {}
+    for part in body.split(b"--" + boundary)[1:-1]:
+        headers, data = part[len(b"\r\n"):-len(b"\r\n")].split(b"\r\n\r\n", 1)
+        lines = headers.decode().split("\r\n")
+        headers = dict(line.split(": ", 1) for line in lines)
+        name = headers["Content-Disposition"].split('name="')[1].rstrip('"')
+        parts[name] = headers["Content-Type"], data
+
+    return parts
+
+
+def encode_export(
+    parts: Mapping[str, Tuple[str, bytes]], boundary: str = "export"
+) -> Tuple[str, bytes]:
+    """
+    Join content types and data of parts by names into an export
+    """
+
+    body = b""
+    for name, (content_type, data) in parts.items():
+        body += (
+            f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+            f'Content-Disposition: attachment; name="{name}"\r\n\r\n'
+        ).encode()
+        body += data + b"\r\n"
+
+    body += f"--{boundary}--\r\n".encode()
+    return f"multipart/mixed; boundary={boundary}", body
+
+
+async def post_imports_copy_data(
+    client: TestClient,
+    content_type: str,
+    body: bytes,
+    expected_status: Union[int, EnumMeta] = HTTPStatus.CREATED,
+    **request_kwargs,
+) -> Optional[int]:
+    response = await client.post(
+        ImportsCopyView.URL_PATH,
+        data=body,
+        headers={"Content-Type": content_type},
+        **request_kwargs,
+    )
+
+    assert response.status == expected_status
+
+    if response.status == HTTPStatus.CREATED:
+        data = await response.json()
+        errors = ImportsResponseSchema().validate(data)
+        assert errors == {}
+        return data["data"]["import_id"]
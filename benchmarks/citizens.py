@@ -0,0 +1,176 @@
+"""
+Measure time to the first citizen, total time, throughput and peak RSS
+growth of the API process answering GET /imports/{import_id}/citizens
+(or GET /imports/{import_id}/export with --export-format).
+
+The API is started in a subprocess, so its memory is not mixed up with
+memory of the benchmark. Peak RSS is reset through /proc/<pid>/clear_refs
+(Linux only) and measured for the first request: memory freed by Python
+is mostly kept by the process, so following requests reuse it.
+
+Expects a migrated database:
+
+    analyzer-db --pg-url=postgresql://... upgrade head
+    python benchmarks/citizens.py --pg-url=postgresql://... --citizens=10000
+"""
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+
+from aiohttp import ClientSession, ClientError
+from aiopg.sa import create_engine
+from yarl import URL
+
+from analyzer.api.schema import CitizenSchema
+from analyzer.config import Config
+from analyzer.db.schema import citizen_table, relation_table
+from analyzer.utils.ingest import InsertIngestEngine, single_batch
+from analyzer.utils.testing import generate_citizens
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pg-url", type=URL, default=URL(Config.DATABASE_URI))
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--citizens", type=int, default=10_000)
+    parser.add_argument("--relations", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--citizens-json-renderer", choices=("python", "postgres"), default="python"
+    )
+    parser.add_argument("--export-format", choices=("csv", "binary"))
+    parser.add_argument("--accept", default="application/json")
+    parser.add_argument("--accept-encoding", default="identity")
+    parser.add_argument("--compression-level", type=int, default=Config.COMPRESSION_LEVEL)
+    # The first request is never cached, the following ones are served
+    # from the cache unless it is disabled with 0
+    parser.add_argument(
+        "--response-cache-size", type=int, default=Config.RESPONSE_CACHE_SIZE
+    )
+    parser.add_argument(
+        "--response-cache-backend",
+        choices=("memory", "sqlite"),
+        default=Config.RESPONSE_CACHE_BACKEND,
+    )
+    parser.add_argument(
+        "--citizens-stream-chunk-size",
+        type=int,
+        default=Config.CITIZENS_STREAM_CHUNK_SIZE,
+    )
+    return parser
+
+
+def read_status_kb(pid: int, field: str) -> int:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1])
+
+    raise KeyError(field)
+
+
+def reset_peak_rss(pid: int) -> None:
+    with open(f"/proc/{pid}/clear_refs", "w") as clear_refs:
+        clear_refs.write("5")
+
+
+async def create_import(pg_url: URL, citizens_number: int, relations: int) -> int:
+    citizens = generate_citizens(citizens_number, relations_number=relations)
+    citizens = CitizenSchema(many=True).load(citizens)
+
+    pg = await create_engine(str(pg_url), minsize=1, maxsize=1)
+    try:
+        import_id = await InsertIngestEngine(pg).ingest(single_batch(citizens))
+        # Let the planner know about the new import, as autovacuum would
+        async with pg.acquire() as conn:
+            await conn.execute(f"ANALYZE {citizen_table.name}, {relation_table.name}")
+        return import_id
+    finally:
+        pg.close()
+        await pg.wait_closed()
+
+
+async def wait_for_api(session: ClientSession, url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                await response.read()
+                return
+        except ClientError:
+            await asyncio.sleep(0.1)
+
+    raise TimeoutError("API has not started")
+
+
+async def measure(session: ClientSession, url: str, pid: int) -> tuple:
+    rss = read_status_kb(pid, "VmRSS")
+    reset_peak_rss(pid)
+
+    started = time.perf_counter()
+    async with session.get(url) as response:
+        # Citizens are written by chunks, the first one holds the first citizen
+        size = len(await response.content.readany())
+        ttfb = time.perf_counter() - started
+        size += len(await response.content.read())
+    total = time.perf_counter() - started
+
+    return ttfb, total, read_status_kb(pid, "VmHWM") - rss, size
+
+
+async def main():
+    args = get_arg_parser().parse_args()
+
+    import_id = await create_import(args.pg_url, args.citizens, args.relations)
+
+    api = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "analyzer.api",
+            f"--pg-url={args.pg_url}",
+            f"--api-port={args.api_port}",
+            f"--citizens-json-renderer={args.citizens_json_renderer}",
+            f"--citizens-stream-chunk-size={args.citizens_stream_chunk_size}",
+            f"--compression-level={args.compression_level}",
+            f"--response-cache-size={args.response_cache_size}",
+            f"--response-cache-backend={args.response_cache_backend}",
+            "--validation-pool-size=0",
+            "--log-level=warning",
+        ]
+    )
+    base_url = f"http://localhost:{args.api_port}"
+
+    try:
+        # Size of the response is measured as sent by the API
+        async with ClientSession(
+            auto_decompress=False,
+            headers={"Accept": args.accept, "Accept-Encoding": args.accept_encoding},
+        ) as session:
+            await wait_for_api(session, f"{base_url}/metrics")
+            url = f"{base_url}/imports/{import_id}/citizens"
+            if args.export_format:
+                url = f"{base_url}/imports/{import_id}/export"
+                url += f"?format={args.export_format}"
+
+            _, _, peak, size = await measure(session, url, api.pid)
+            results = [await measure(session, url, api.pid) for _ in range(args.repeat)]
+    finally:
+        api.terminate()
+        api.wait()
+
+    ttfb = min(result[0] for result in results)
+    total = min(result[1] for result in results)
+    print(
+        f"{args.citizens} citizens, best of {args.repeat}: "
+        f"first citizen {ttfb * 1000:.1f}ms, total {total * 1000:.1f}ms "
+        f"({size / total / 1024 ** 2:.1f}MB/s), sent {size / 1024:.0f}KB, "
+        f"peak RSS growth {peak / 1024:.1f}MB"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
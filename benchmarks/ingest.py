@@ -0,0 +1,92 @@
+"""
+Compare rows/sec of the import engines.
+
+Expects a migrated database:
+
+    analyzer-db --pg-url=postgresql://... upgrade head
+    python benchmarks/ingest.py --pg-url=postgresql://... --citizens=10000
+"""
+
+import argparse
+import asyncio
+import time
+
+from aiopg.sa import create_engine
+from yarl import URL
+
+from analyzer.api.schema import ImportsSchema
+from analyzer.config import Config
+from analyzer.utils.ingest import (
+    CopyIngestEngine,
+    InsertIngestEngine,
+    StagingIngestEngine,
+)
+from analyzer.utils.pg import SyncPool
+from analyzer.utils.testing import generate_citizens
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pg-url", type=URL, default=URL(Config.DATABASE_URI))
+    parser.add_argument("--citizens", type=int, default=10_000)
+    parser.add_argument("--relations", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pipeline-depth", type=int, default=2)
+    return parser
+
+
+async def iter_batches(citizens, size: int):
+    for i in range(0, len(citizens), size):
+        # Give the engine a chance to write while the next batch "arrives"
+        await asyncio.sleep(0)
+        yield citizens[i:i + size]
+
+
+async def measure(engine, citizens, rows: int, repeat: int, batch_size: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await engine.ingest(iter_batches(citizens, batch_size))
+        best = min(best, time.perf_counter() - started)
+
+    return rows / best
+
+
+async def main():
+    args = get_arg_parser().parse_args()
+
+    citizens = generate_citizens(args.citizens, relations_number=args.relations)
+    citizens = ImportsSchema().load({"citizens": citizens})["citizens"]
+    rows = len(citizens) + sum(len(citizen["relatives"]) for citizen in citizens)
+
+    pg = await create_engine(str(args.pg_url), minsize=1, maxsize=1)
+    pool = SyncPool(str(args.pg_url), maxsize=1)
+
+    options = {"pipeline_depth": args.pipeline_depth}
+    engines = {
+        "insert": InsertIngestEngine(pg, **options),
+        "copy (text)": CopyIngestEngine(pool, "text", **options),
+        "copy (binary)": CopyIngestEngine(pool, "binary", **options),
+        "staging": StagingIngestEngine(pool, "binary", **options),
+        "staging (async)": StagingIngestEngine(
+            pool, "binary", synchronous_commit=False, **options
+        ),
+    }
+
+    print(
+        f"{len(citizens)} citizens, {rows} rows per import by batches of "
+        f"{args.batch_size}, pipeline depth {args.pipeline_depth}, best of {args.repeat}"
+    )
+    try:
+        for name, engine in engines.items():
+            rate = await measure(engine, citizens, rows, args.repeat, args.batch_size)
+            print(f"{name:>15}: {rate:12,.0f} rows/sec")
+    finally:
+        pool.close()
+        pg.close()
+        await pg.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+"""
+Compare latency of reading citizens of an import with relatives
+aggregated from `relation` (outer join and GROUP BY) and with relatives
+stored in `citizen.relatives`: the whole import and a single citizen.
+
+Expects a migrated database:
+
+    analyzer-db --pg-url=postgresql://... upgrade head
+    python benchmarks/relatives.py --pg-url=postgresql://... --citizens=10000
+"""
+
+import argparse
+import asyncio
+import time
+
+from aiopg.sa import create_engine
+from sqlalchemy import and_, func, select
+from sqlalchemy.sql import Select
+from yarl import URL
+
+from analyzer.api.schema import CitizenSchema
+from analyzer.config import Config
+from analyzer.db.schema import citizen_table, relation_table
+from analyzer.utils.ingest import InsertIngestEngine, single_batch
+from analyzer.utils.testing import generate_citizens
+
+CITIZEN_COLUMNS = [
+    citizen_table.c.citizen_id,
+    citizen_table.c.name,
+    citizen_table.c.birth_date,
+    citizen_table.c.gender,
+    citizen_table.c.town,
+    citizen_table.c.street,
+    citizen_table.c.building,
+    citizen_table.c.apartment,
+]
+
+# Citizens query before relatives were stored with citizens
+JOINED_QUERY = (
+    select(
+        [
+            *CITIZEN_COLUMNS,
+            func.array_remove(func.array_agg(relation_table.c.relative_id), None).label(
+                "relatives"
+            ),
+        ]
+    )
+    .select_from(
+        citizen_table.outerjoin(
+            relation_table,
+            and_(
+                citizen_table.c.import_id == relation_table.c.import_id,
+                citizen_table.c.citizen_id == relation_table.c.citizen_id,
+            ),
+        )
+    )
+    .group_by(citizen_table.c.import_id, citizen_table.c.citizen_id)
+)
+STORED_QUERY = select([*CITIZEN_COLUMNS, citizen_table.c.relatives])
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pg-url", type=URL, default=URL(Config.DATABASE_URI))
+    parser.add_argument("--citizens", type=int, default=10_000)
+    parser.add_argument("--relations", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    return parser
+
+
+async def measure(pg, query: Select, repeat: int) -> float:
+    best = float("inf")
+    async with pg.acquire() as conn:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = await conn.execute(query)
+            await result.fetchall()
+            best = min(best, time.perf_counter() - started)
+
+    return best
+
+
+async def main():
+    args = get_arg_parser().parse_args()
+
+    citizens = generate_citizens(args.citizens, relations_number=args.relations)
+    citizens = CitizenSchema(many=True).load(citizens)
+    citizen_id = next(citizen for citizen in citizens if citizen["relatives"])["citizen_id"]
+
+    pg = await create_engine(str(args.pg_url), minsize=1, maxsize=1)
+    try:
+        import_id = await InsertIngestEngine(pg).ingest(single_batch(citizens))
+        async with pg.acquire() as conn:
+            await conn.execute(f"ANALYZE {citizen_table.name}, {relation_table.name}")
+
+        for name, query in (("joined", JOINED_QUERY), ("stored", STORED_QUERY)):
+            query = query.where(citizen_table.c.import_id == import_id)
+            listing = await measure(pg, query, args.repeat)
+            single = await measure(
+                pg, query.where(citizen_table.c.citizen_id == citizen_id), args.repeat
+            )
+            print(
+                f"{name}: {args.citizens} citizens {listing * 1000:.1f}ms, "
+                f"one citizen {single * 1000:.2f}ms (best of {args.repeat})"
+            )
+    finally:
+        pg.close()
+        await pg.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+"""
+Compare time of serializing citizen rows with `isinstance` checks of every
+value and with the serializer compiled from the query column types.
+
+Rows are fetched from the database once, so both serializers get the same
+`RowProxy` objects the API gets. Expects a migrated database:
+
+    analyzer-db --pg-url=postgresql://... upgrade head
+    python benchmarks/serializers.py --pg-url=postgresql://... --citizens=10000
+"""
+
+import argparse
+import asyncio
+import timeit
+
+from aiopg.sa import create_engine
+from datetime import date
+from decimal import Decimal
+from yarl import URL
+
+from analyzer.api.routes.base import BaseCitizenView
+from analyzer.api.schema import CitizenSchema
+from analyzer.api.serializer import get_row_serializer
+from analyzer.config import Config
+from analyzer.db.schema import Gender, citizen_table
+from analyzer.utils.ingest import InsertIngestEngine, single_batch
+from analyzer.utils.testing import generate_citizens
+
+QUERY = BaseCitizenView.CITIZENS_QUERY.fget(None)
+
+
+# Serializer of rows before the compiled ones
+def serialize_row(row) -> dict:
+    row = dict(row)
+
+    for k, v in row.items():
+        if isinstance(v, date):
+            row[k] = v.strftime(Config.BIRTH_DATE_FORMAT)
+        if isinstance(v, Gender):
+            row[k] = v.value
+        if isinstance(v, Decimal):
+            row[k] = float(v)
+
+    return row
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pg-url", type=URL, default=URL(Config.DATABASE_URI))
+    parser.add_argument("--citizens", type=int, default=10_000)
+    parser.add_argument("--relations", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    return parser
+
+
+async def fetch_rows(pg_url: URL, citizens_number: int, relations: int) -> list:
+    citizens = generate_citizens(citizens_number, relations_number=relations)
+    citizens = CitizenSchema(many=True).load(citizens)
+
+    pg = await create_engine(str(pg_url), minsize=1, maxsize=1)
+    try:
+        import_id = await InsertIngestEngine(pg).ingest(single_batch(citizens))
+        async with pg.acquire() as conn:
+            result = await conn.execute(
+                QUERY.where(citizen_table.c.import_id == import_id)
+            )
+            return await result.fetchall()
+    finally:
+        pg.close()
+        await pg.wait_closed()
+
+
+def main():
+    args = get_arg_parser().parse_args()
+
+    rows = asyncio.run(fetch_rows(args.pg_url, args.citizens, args.relations))
+    serializers = {
+        "isinstance": serialize_row,
+        "compiled": get_row_serializer(QUERY, Config.BIRTH_DATE_FORMAT),
+    }
+
+    # Both serializers have to agree before being compared
+    assert [serializers["isinstance"](row) for row in rows] == [
+        serializers["compiled"](row) for row in rows
+    ]
+
+    print(f"{len(rows)} rows, best of {args.repeat}")
+    for name, serialize in serializers.items():
+        best = min(
+            timeit.repeat(
+                lambda: [serialize(row) for row in rows], number=1, repeat=args.repeat
+            )
+        )
+        print(f"{name:>12}: {best * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
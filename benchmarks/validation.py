@@ -0,0 +1,39 @@
+"""
+Compare validation time of `ImportsSchema` and its compiled counterpart.
+
+    python benchmarks/validation.py --citizens=10000
+"""
+
+import argparse
+import timeit
+
+from analyzer.api.schema import ImportsSchema
+from analyzer.api.validator import CompiledImportsSchema
+from analyzer.utils.testing import generate_citizens
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--citizens", type=int, default=10_000)
+    parser.add_argument("--relations", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser
+
+
+def main():
+    args = get_arg_parser().parse_args()
+
+    data = {"citizens": generate_citizens(args.citizens, args.relations)}
+    schemas = {
+        "marshmallow": ImportsSchema(),
+        "compiled": CompiledImportsSchema(),
+    }
+
+    print(f"{args.citizens} citizens, {args.relations} relations, best of {args.repeat}")
+    for name, schema in schemas.items():
+        best = min(timeit.repeat(lambda: schema.load(data), number=1, repeat=args.repeat))
+        print(f"{name:>12}: {best * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
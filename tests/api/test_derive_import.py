@@ -0,0 +1,147 @@
+import pytest
+
+from http import HTTPStatus
+
+from analyzer.api.routes import DerivedImportView
+from analyzer.utils.testing import (
+    compare_citizen_groups,
+    derive_import_data,
+    generate_citizen,
+    generate_citizens,
+    get_citizens_data,
+    post_imports_data,
+    url_for,
+)
+
+SOURCE = (
+    generate_citizen(citizen_id=1, relatives=[2]),
+    generate_citizen(citizen_id=2, relatives=[1, 3]),
+    generate_citizen(citizen_id=3, relatives=[2, 3]),
+    generate_citizen(citizen_id=4, relatives=[]),
+)
+
+CASES = (
+    # No changes copy the import
+    ([], []),
+    # Citizen with a new relative
+    (
+        [
+            generate_citizen(citizen_id=4, relatives=[5]),
+            generate_citizen(citizen_id=5, relatives=[4]),
+        ],
+        [],
+    ),
+    # Changed fields with the same relatives
+    ([generate_citizen(citizen_id=1, name="Ivan", relatives=[2])], []),
+    # Both sides of a relation are changed
+    (
+        [
+            generate_citizen(citizen_id=1, relatives=[]),
+            generate_citizen(citizen_id=2, relatives=[3]),
+        ],
+        [],
+    ),
+    # Removed citizens
+    ([], [4]),
+    ([generate_citizen(citizen_id=2, relatives=[3])], [1]),
+)
+
+ERROR_CASES = (
+    ([], [3], "citizen 3 does not have relation with 2"),
+    (
+        [generate_citizen(citizen_id=1, relatives=[])],
+        [],
+        "citizen 1 does not have relation with 2",
+    ),
+    (
+        [generate_citizen(citizen_id=5, relatives=[4])],
+        [],
+        "citizen 4 does not have relation with 5",
+    ),
+    (
+        [generate_citizen(citizen_id=4, relatives=[1])],
+        [],
+        "citizen 1 does not have relation with 4",
+    ),
+    (
+        [generate_citizen(citizen_id=2, relatives=[1])],
+        [],
+        "citizen 2 does not have relation with 3",
+    ),
+)
+
+
+def apply_changes(citizens, changed, removed) -> list:
+    result = {citizen["citizen_id"]: citizen for citizen in citizens}
+    for citizen_id in removed:
+        del result[citizen_id]
+    for citizen in changed:
+        result[citizen["citizen_id"]] = citizen
+
+    return list(result.values())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("changed, removed", CASES)
+async def test_derive_import(api_client, changed, removed):
+    source_id = await post_imports_data(api_client, list(SOURCE))
+
+    import_id = await derive_import_data(api_client, source_id, changed, removed)
+    assert import_id != source_id
+
+    citizens = await get_citizens_data(api_client, import_id)
+    assert compare_citizen_groups(citizens, apply_changes(SOURCE, changed, removed))
+
+    # Source import stays the same
+    citizens = await get_citizens_data(api_client, source_id)
+    assert compare_citizen_groups(citizens, SOURCE)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("changed, removed, message", ERROR_CASES)
+async def test_derive_import_checks(api_client, changed, removed, message):
+    source_id = await post_imports_data(api_client, list(SOURCE))
+
+    response = await api_client.post(
+        url_for(DerivedImportView.URL_PATH, import_id=source_id),
+        json={"citizens": changed, "removed": removed},
+    )
+    assert response.status == HTTPStatus.BAD_REQUEST
+    assert (await response.json())["error"]["fields"] == {"_schema": [message]}
+
+
+@pytest.mark.asyncio
+async def test_derive_import_validation(api_client):
+    source_id = await post_imports_data(api_client, list(SOURCE))
+
+    # Citizen can't be changed and removed at once
+    await derive_import_data(
+        api_client,
+        source_id,
+        [generate_citizen(citizen_id=4)],
+        [4],
+        expected_status=HTTPStatus.BAD_REQUEST,
+    )
+
+    await derive_import_data(
+        api_client, source_id + 1, expected_status=HTTPStatus.NOT_FOUND
+    )
+
+
+@pytest.mark.asyncio
+async def test_derive_large_import(api_client):
+    citizens = generate_citizens(
+        citizens_number=5000, relations_number=500, start_citizen_id=1
+    )
+    source_id = await post_imports_data(api_client, citizens)
+
+    # Relatives stay the same, so their counterparts are not changed
+    changed = [{**citizen, "name": "Ivan"} for citizen in citizens[:100]]
+    removed = [
+        citizen["citizen_id"] for citizen in citizens[100:] if not citizen["relatives"]
+    ][:10]
+    import_id = await derive_import_data(api_client, source_id, changed, removed)
+
+    imported_citizens = await get_citizens_data(api_client, import_id)
+    expected = apply_changes(citizens, changed, removed)
+    assert compare_citizen_groups(imported_citizens, expected)
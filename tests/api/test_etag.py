@@ -0,0 +1,80 @@
+import pytest
+
+from aiohttp import hdrs
+from http import HTTPStatus
+
+from analyzer.api.routes import AgeStatsView, CitizenPresentsView, CitizensView
+from analyzer.utils.testing import (
+    generate_citizen,
+    generate_citizens,
+    get_metrics_data,
+    patch_citizen_data,
+    post_imports_data,
+    url_for,
+)
+
+
+@pytest.mark.parametrize(
+    "path", (CitizensView.URL_PATH, CitizenPresentsView.URL_PATH, AgeStatsView.URL_PATH)
+)
+async def test_etag(api_client, path):
+    citizens = generate_citizens(citizens_number=10, relations_number=5)
+    import_id = await post_imports_data(api_client, citizens)
+    url = url_for(path, import_id=import_id)
+
+    response = await api_client.get(url)
+    assert response.status == HTTPStatus.OK
+    etag = response.headers[hdrs.ETAG]
+    body = await response.read()
+
+    # Unchanged import is not sent again
+    headers = {hdrs.IF_NONE_MATCH: etag}
+    response = await api_client.get(url, headers=headers)
+    assert response.status == HTTPStatus.NOT_MODIFIED
+    assert response.headers[hdrs.ETAG] == etag
+    assert await response.read() == b""
+
+    for if_none_match in (f'"other", {etag}', "*"):
+        response = await api_client.get(url, headers={hdrs.IF_NONE_MATCH: if_none_match})
+        assert response.status == HTTPStatus.NOT_MODIFIED
+
+    # Other representations have other ETags (the client accepts gzip by default)
+    response = await api_client.get(
+        url, headers={**headers, hdrs.ACCEPT_ENCODING: "identity"}
+    )
+    assert response.status == HTTPStatus.OK
+    assert response.headers[hdrs.ETAG] != etag
+
+    metrics = await get_metrics_data(api_client)
+    assert metrics["counters"]["etag.not_modified"] == 3
+
+    # Changed import is sent again with a new ETag
+    citizen = citizens[0]
+    await patch_citizen_data(
+        api_client, import_id, citizen["citizen_id"], {"name": "Иван"}
+    )
+    response = await api_client.get(url, headers=headers)
+    assert response.status == HTTPStatus.OK
+    assert response.headers[hdrs.ETAG] != etag
+    if path == CitizensView.URL_PATH:
+        assert await response.read() != body
+
+
+async def test_etag_params(api_client):
+    citizens = [generate_citizen(citizen_id=1, town="Москва", relatives=[])]
+    import_id = await post_imports_data(api_client, citizens)
+    url = url_for(CitizensView.URL_PATH, import_id=import_id)
+
+    etags = set()
+    for params in ({}, {"town": "Москва"}, {"town": "Керчь"}):
+        response = await api_client.get(url, params=params)
+        etags.add(response.headers[hdrs.ETAG])
+    assert len(etags) == 3
+
+    # Missing import has no ETag
+    response = await api_client.get(
+        url_for(CitizensView.URL_PATH, import_id=import_id + 1),
+        headers={hdrs.IF_NONE_MATCH: "*"},
+    )
+    assert response.status == HTTPStatus.NOT_FOUND
+    assert hdrs.ETAG not in response.headers
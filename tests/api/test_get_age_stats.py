@@ -9,12 +9,17 @@ from typing import Union, Tuple, Mapping, List
 from random import randint
 from unittest.mock import patch
 
+from analyzer.api.routes import AgeStatsView
 from analyzer.config import TestConfig
+from analyzer.utils.formats import NdjsonFormat
 from analyzer.utils.testing import (
     CitizenType,
     generate_citizen,
+    generate_citizens,
+    get_records,
     post_imports_data,
     get_age_stats_data,
+    url_for,
 )
 
 cfg = TestConfig()
@@ -138,3 +143,13 @@ async def test_get_age_stats_nonexistent(api_client):
         randint(1, 1000),
         HTTPStatus.NOT_FOUND,
     )
+
+
+@pytest.mark.asyncio
+async def test_get_age_stats_ndjson(api_client):
+    citizens = generate_citizens(citizens_number=100, relations_number=10)
+    import_id = await post_imports_data(api_client, citizens)
+
+    path = url_for(AgeStatsView.URL_PATH, import_id=import_id)
+    records = await get_records(api_client, path, NdjsonFormat.content_type)
+    assert records == await get_age_stats_data(api_client, import_id)
@@ -1,22 +1,60 @@
+import asyncio
+import gzip
+import json
 import pytest
 
+from collections import OrderedDict
+from contextlib import aclosing
 from datetime import datetime
+from sqlalchemy import ARRAY, Date, Integer, cast, func, literal, null, select
 from http import HTTPStatus
 from typing import List
 from sqlalchemy.engine import Connection
 
 
+from analyzer.api.app import init_app
+from analyzer.api.payload import AsyncGenJsonListPayload, AsyncGenRecordsPayload
+from analyzer.api.routes import CitizensView
+from analyzer.api.routes.citizens import FILTER_FIELDS
+from analyzer.api import serializer
+from analyzer.api.serializer import get_row_serializer
+from analyzer.api.validator import CITIZEN_FIELDS
 from analyzer.config import TestConfig
-from analyzer.db.schema import import_table, citizen_table, relation_table
+from analyzer.db.schema import Gender, import_table, citizen_table, relation_table
 from analyzer.utils.testing import (
     get_citizens_data,
+    get_citizens_page,
     generate_citizen,
+    generate_citizens,
     CitizenType,
     compare_citizen_groups,
+    get_records,
+    url_for,
 )
+from analyzer.utils.codec import get_json_codec
+from analyzer.utils.compression import CODINGS, brotli, negotiate, zstandard
+from analyzer.utils.formats import FORMATS, CsvFormat, NdjsonFormat
+from analyzer.utils.pg import SelectQuery, rounded
 
 cfg = TestConfig()
 
+
+@pytest.fixture
+async def json_api_client(aiohttp_client, arguments):
+    """
+    Client of the app having citizens rendered into JSON by PostgreSQL
+    """
+
+    arguments.citizens_json_renderer = "postgres"
+    app = init_app(arguments, cfg)
+
+    client = await aiohttp_client(app, server_kwargs={"port": arguments.api_port})
+
+    try:
+        yield client
+    finally:
+        await client.close()
+
 datasets = [
     # A citizen with several relatives
     # Test standard expected behaviour
@@ -71,6 +109,7 @@ def import_dataset(connection: Connection, citizens: List[CitizenType]) -> int:
                 "street": citizen["street"],
                 "building": citizen["building"],
                 "apartment": citizen["apartment"],
+                "relatives": citizen["relatives"],
             }
         )
 
@@ -106,6 +145,561 @@ async def test_get_citizens(api_client, migrated_postgres_connection, dataset):
     assert compare_citizen_groups(actual_citizens, dataset)
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "dataset", [*datasets, generate_citizens(citizens_number=1000, relations_number=100)]
+)
+async def test_get_citizens_json_renderer(
+    json_api_client, migrated_postgres_connection, dataset
+):
+    """
+    Citizens rendered into JSON by PostgreSQL are expected
+    to be the same as ones serialized by the app
+    """
+
+    import_dataset(migrated_postgres_connection, [generate_citizen()])
+
+    import_id = import_dataset(migrated_postgres_connection, dataset)
+    actual_citizens = await get_citizens_data(json_api_client, import_id)
+    assert compare_citizen_groups(actual_citizens, dataset)
+
+
+@pytest.mark.asyncio
+async def test_get_citizens_json_renderer_projection(
+    json_api_client, migrated_postgres_connection
+):
+    dataset = [
+        generate_citizen(citizen_id=1, town="Moscow", relatives=[2]),
+        generate_citizen(citizen_id=2, town="Moscow", relatives=[1]),
+        generate_citizen(citizen_id=3, town="Kazan"),
+    ]
+    import_id = import_dataset(migrated_postgres_connection, dataset)
+
+    params = {"fields": "citizen_id,birth_date,relatives", "town": "Moscow"}
+    actual_citizens = await get_citizens_data(json_api_client, import_id, params=params)
+
+    expected = [
+        {field: citizen[field] for field in ("citizen_id", "birth_date", "relatives")}
+        for citizen in dataset[:2]
+    ]
+    assert compare_citizen_groups(actual_citizens, expected)
+
+
 @pytest.mark.asyncio
 async def test_get_non_existing_import(api_client):
     await get_citizens_data(api_client, 999, HTTPStatus.NOT_FOUND)
+
+
+@pytest.mark.asyncio
+async def test_get_citizens_streamed(api_client, migrated_postgres_connection):
+    """
+    Citizens are expected to be sent while they are being fetched,
+    so the size of the response is not known beforehand
+    """
+
+    dataset = generate_citizens(citizens_number=2000, relations_number=200)
+    import_id = import_dataset(migrated_postgres_connection, dataset)
+
+    response = await api_client.get(url_for(CitizensView.URL_PATH, import_id=import_id))
+    assert response.status == HTTPStatus.OK
+    assert response.headers["Transfer-Encoding"] == "chunked"
+    assert "Content-Length" not in response.headers
+
+    data = await response.json()
+    assert compare_citizen_groups(data["data"], dataset)
+
+
+@pytest.mark.asyncio
+async def test_get_citizens_encoded_natively(
+    api_client, migrated_postgres_connection, monkeypatch
+):
+    """
+    Rows are expected to be converted into JSON types by their serializers,
+    so the codec never falls back to `default()`
+    """
+
+    def default(value):
+        raise AssertionError(f"{value!r} is not converted by the serializer")
+
+    monkeypatch.setattr(get_json_codec(), "default", default)
+    dataset = generate_citizens(citizens_number=20, relations_number=5)
+    import_id = import_dataset(migrated_postgres_connection, dataset)
+
+    for params in ({}, {"limit": 10}, {"fields": "birth_date,gender"}):
+        await get_citizens_data(api_client, import_id, params=params)
+
+    path = url_for(CitizensView.URL_PATH, import_id=import_id)
+    for content_type in FORMATS:
+        response = await api_client.get(path, headers={"Accept": content_type})
+        assert response.status == HTTPStatus.OK
+        await response.read()
+
+
+@pytest.mark.asyncio
+async def test_get_citizens_pages(api_client, migrated_postgres_connection):
+    dataset = generate_citizens(citizens_number=25, relations_number=10)
+    import_id = import_dataset(migrated_postgres_connection, dataset)
+    import_dataset(migrated_postgres_connection, [generate_citizen()])
+
+    page = await get_citizens_page(api_client, import_id, {"limit": 10})
+    citizens = page["data"]
+    while page["next"] is not None:
+        page = await get_citizens_page(api_client, import_id, {"cursor": page["next"]})
+        assert len(page["data"]) <= 10
+        citizens += page["data"]
+
+    ids = [citizen["citizen_id"] for citizen in citizens]
+    assert ids == sorted(ids)
+    assert compare_citizen_groups(citizens, dataset)
+
+    # Keyset is the last citizen_id of the previous page
+    after = sorted(citizen["citizen_id"] for citizen in dataset)[-3]
+    page = await get_citizens_page(api_client, import_id, {"after": after})
+    assert len(page["data"]) == 2
+    assert page["next"] is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "params",
+    (
+        {"limit": 0},
+        {"limit": cfg.MAX_CITIZENS_PAGE_SIZE + 1},
+        {"after": -1},
+        {"cursor": "invalid"},
+        {"cursor": "e30", "limit": 1},
+    ),
+)
+async def test_get_citizens_page_validation(
+    api_client, migrated_postgres_connection, params
+):
+    import_id = import_dataset(migrated_postgres_connection, [generate_citizen()])
+    await get_citizens_page(api_client, import_id, params, HTTPStatus.BAD_REQUEST)
+
+
+@pytest.mark.asyncio
+async def test_get_citizens_page_other_import(api_client, migrated_postgres_connection):
+    dataset = generate_citizens(citizens_number=2)
+    import_id = import_dataset(migrated_postgres_connection, dataset)
+    other_id = import_dataset(migrated_postgres_connection, dataset)
+
+    page = await get_citizens_page(api_client, import_id, {"limit": 1})
+    params = {"cursor": page["next"]}
+    await get_citizens_page(api_client, other_id, params, HTTPStatus.BAD_REQUEST)
+
+
+@pytest.mark.asyncio
+async def test_get_citizens_filtered_pages(api_client, migrated_postgres_connection):
+    """
+    Following pages are expected to keep fields and filters of the first one,
+    a cursor combined with other fields or filters is rejected
+    """
+
+    dataset = [
+        generate_citizen(citizen_id=i, town="Moscow" if i % 2 else "Kazan")
+        for i in range(10)
+    ]
+    import_id = import_dataset(migrated_postgres_connection, dataset)
+
+    params = {"fields": "citizen_id,town", "town": "Moscow", "limit": 2}
+    page = await get_citizens_page(api_client, import_id, params)
+    citizens = page["data"]
+    while page["next"] is not None:
+        params = {"cursor": page["next"]}
+        page = await get_citizens_page(api_client, import_id, params)
+        citizens += page["data"]
+
+    assert citizens == [
+        {"citizen_id": i, "town": "Moscow"} for i in range(10) if i % 2
+    ]
+
+    page = await get_citizens_page(api_client, import_id, {"town": "Moscow", "limit": 2})
+    for params in (
+        {"town": "Kazan"},
+        {"gender": "male"},
+        {"fields": "name"},
+    ):
+        params["cursor"] = page["next"]
+        await get_citizens_page(api_client, import_id, params, HTTPStatus.BAD_REQUEST)
+
+    # The same filters may be passed along with the cursor
+    params = {"cursor": page["next"], "town": "Moscow"}
+    page = await get_citizens_page(api_client, import_id, params)
+    assert [citizen["citizen_id"] for citizen in page["data"]] == [5, 7]
+
+
+def sort_projected(citizens: List[dict]) -> List[dict]:
+    citizens = [
+        {**citizen, "relatives": sorted(citizen["relatives"])}
+        if "relatives" in citizen
+        else citizen
+        for citizen in citizens
+    ]
+    return sorted(citizens, key=lambda citizen: json.dumps(citizen, sort_keys=True))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "params",
+    (
+        {"fields": "citizen_id,town,relatives"},
+        {"fields": "name,apartment"},
+        {"town": "Moscow"},
+        {"town": "Moscow", "street": "Lenina", "gender": "female"},
+        {"fields": "relatives,town", "street": "Lenina", "limit": 2},
+    ),
+)
+async def test_get_citizens_projection(api_client, migrated_postgres_connection, params):
+    dataset = [
+        generate_citizen(citizen_id=1, town="Moscow", street="Lenina", relatives=[2]),
+        generate_citizen(citizen_id=2, town="Moscow", street="Tverskaya", relatives=[1]),
+        generate_citizen(citizen_id=3, town="Moscow", street="Lenina", gender="female"),
+        generate_citizen(citizen_id=4, town="Kazan", street="Lenina", gender="male"),
+    ]
+    import_id = import_dataset(migrated_postgres_connection, dataset)
+
+    citizens = await get_citizens_data(api_client, import_id, params=params)
+
+    fields = params.get("fields", ",".join(CITIZEN_FIELDS)).split(",")
+    expected = [
+        {field: citizen[field] for field in fields}
+        for citizen in dataset
+        if all(citizen[field] == params[field] for field in params.keys() & FILTER_FIELDS)
+    ]
+    if "limit" in params:
+        expected = expected[: params["limit"]]
+    assert sort_projected(citizens) == sort_projected(expected)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "params", ({"fields": "citizen_id,unknown"}, {"fields": ""}, {"gender": "other"})
+)
+async def test_get_citizens_projection_validation(
+    api_client, migrated_postgres_connection, params
+):
+    import_id = import_dataset(migrated_postgres_connection, [generate_citizen()])
+    await get_citizens_data(api_client, import_id, HTTPStatus.BAD_REQUEST, params=params)
+
+
+@pytest.mark.asyncio
+async def test_select_query(api_client, migrated_postgres_connection):
+    """
+    Rows are expected to be fetched by batches through a server-side
+    cursor and have the same types as rows of the query itself
+    """
+
+    dataset = generate_citizens(citizens_number=1000, relations_number=100)
+    import_id = import_dataset(migrated_postgres_connection, dataset)
+
+    query = (
+        citizen_table.select()
+        .where(citizen_table.c.import_id == import_id)
+        .order_by(citizen_table.c.citizen_id)
+    )
+    rows = [row async for row in SelectQuery(query, api_client.server.app["pg"], 7)]
+
+    assert [row["citizen_id"] for row in rows] == sorted(
+        citizen["citizen_id"] for citizen in dataset
+    )
+    assert all(isinstance(row["gender"], Gender) for row in rows)
+
+
+@pytest.mark.asyncio
+async def test_row_serializer(api_client):
+    """
+    Compiled serializer is expected to convert values of every column
+    type into JSON ones, NULL values of nullable columns included
+    """
+
+    date_format = cfg.BIRTH_DATE_FORMAT
+    birth_date = datetime.strptime("26.12.1986", date_format).date()
+    query = select(
+        [
+            literal(birth_date, Date).label("birth_date"),
+            cast(literal("female"), citizen_table.c.gender.type).label("gender"),
+            rounded(literal(2.345)).label("p50"),
+            cast(literal([birth_date, None]), ARRAY(Date)).label("dates"),
+            cast(null(), Date).label("no_date"),
+            cast(null(), citizen_table.c.gender.type).label("no_gender"),
+            literal([1, 2]).label("relatives"),
+        ]
+    )
+    async with api_client.server.app["pg"].acquire() as conn:
+        result = await conn.execute(query)
+        row = await result.first()
+
+    assert get_row_serializer(query, date_format)(row) == {
+        "birth_date": "26.12.1986",
+        "gender": "female",
+        "p50": 2.35,
+        "dates": ["26.12.1986", None],
+        "no_date": None,
+        "no_gender": None,
+        "relatives": [1, 2],
+    }
+
+    serialize = get_row_serializer(query, date_format, ("relatives", "gender"))
+    assert serialize(row) == {"relatives": [1, 2], "gender": "female"}
+
+
+def test_row_serializer_cache(monkeypatch):
+    """
+    Only the latest serializers are expected to be kept, whatever
+    the order of requested fields is
+    """
+
+    monkeypatch.setattr(serializer, "CACHE_SIZE", 2)
+    monkeypatch.setattr(serializer, "_serializers", OrderedDict())
+    query = select([citizen_table.c.citizen_id, citizen_table.c.name])
+    date_format = cfg.BIRTH_DATE_FORMAT
+
+    first = get_row_serializer(query, date_format, ("citizen_id", "name"))
+    get_row_serializer(query, date_format, ("name", "citizen_id"))
+    assert get_row_serializer(query, date_format, ("citizen_id", "name")) is first
+
+    get_row_serializer(query, date_format, ("name",))
+    assert len(serializer._serializers) == 2
+    assert get_row_serializer(query, date_format, ("citizen_id", "name")) is first
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 1000, 64 * 1024])
+async def test_stream_payload_chunks(chunk_size):
+    """
+    Streamed items are expected to be written by chunks
+    of at least `chunk_size` bytes, except for the last one
+    """
+
+    citizens = [{"citizen_id": i} for i in range(10000)]
+    chunks = []
+
+    class Writer:
+        async def write(self, chunk: bytes):
+            chunks.append(chunk)
+
+    async def iter_citizens():
+        for citizen in citizens:
+            yield citizen
+
+    payload = AsyncGenJsonListPayload(iter_citizens(), chunk_size=chunk_size)
+    await payload.write(Writer())
+
+    assert json.loads(b"".join(chunks)) == {"data": citizens}
+    assert all(len(chunk) >= chunk_size for chunk in chunks[:-1])
+    if chunk_size > 1:
+        assert len(chunks) <= len(b"".join(chunks)) // chunk_size + 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "make_payload",
+    [
+        lambda rows: AsyncGenJsonListPayload(rows, chunk_size=1),
+        lambda rows: AsyncGenRecordsPayload(
+            rows, NdjsonFormat({"citizen_id": Integer()}), chunk_size=1
+        ),
+    ],
+    ids=["json", "records"],
+)
+async def test_stream_payload_disconnect(make_payload):
+    """
+    Streamed rows are expected to be closed once the client has gone away,
+    so the query releases its connection
+    """
+
+    closed = asyncio.Event()
+
+    class Writer:
+        writes = 0
+
+        async def write(self, chunk: bytes):
+            # the client goes away once the rows have been started
+            self.writes += 1
+            if self.writes > 2:
+                raise ConnectionResetError
+
+    async def iter_rows():
+        # batches of rows are JSON lists as well
+        try:
+            while True:
+                yield [{"citizen_id": 1}]
+        finally:
+            closed.set()
+
+    with pytest.raises(ConnectionResetError):
+        await make_payload(iter_rows()).write(Writer())
+    assert closed.is_set()
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, coding",
+    [
+        ("gzip, deflate", "gzip"),
+        ("GZIP;q=0.5", "gzip"),
+        ("*", next(iter(CODINGS))),
+        ("gzip;q=0, *", next(iter(CODINGS)) if len(CODINGS) > 1 else None),
+        ("gzip;q=0", None),
+        ("identity", None),
+        ("", None),
+    ],
+)
+def test_negotiate_coding(accept_encoding, coding):
+    assert negotiate(accept_encoding) == coding
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("coding", CODINGS)
+async def test_compressor(coding):
+    """
+    Body compressed by chunks, some of them outside of the event loop,
+    is expected to be decompressed as a whole
+    """
+
+    data = [json.dumps(generate_citizens(100)).encode() for _ in range(10)]
+    compressor = CODINGS[coding](level=1, executor_size=len(data[0]))
+
+    chunks = [await compressor.compress(chunk) for chunk in data]
+    body = b"".join(chunks) + compressor.flush()
+
+    if coding == "gzip":
+        assert gzip.decompress(body) == b"".join(data)
+    elif coding == "br":
+        assert brotli.decompress(body) == b"".join(data)
+    else:
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        assert decompressor.decompress(body) == b"".join(data)
+
+
+@pytest.mark.asyncio
+async def test_get_citizens_compression(api_client, migrated_postgres_connection):
+    dataset = generate_citizens(citizens_number=1000, relations_number=100)
+    import_id = import_dataset(migrated_postgres_connection, dataset)
+    url = url_for(CitizensView.URL_PATH, import_id=import_id)
+
+    # Streamed and buffered responses are decompressed by the client
+    for params in ({}, {"limit": 1000}, {"limit": 1}):
+        response = await api_client.get(
+            url, params=params, headers={"Accept-Encoding": "gzip"}
+        )
+        assert response.status == HTTPStatus.OK
+        assert response.headers["Vary"] == "Accept-Encoding"
+
+        # Page of a single citizen is smaller than the minimal size
+        compressed = params.get("limit") != 1
+        assert response.headers.get("Content-Encoding") == (
+            "gzip" if compressed else None
+        )
+        data = (await response.json())["data"]
+        assert len(data) == params.get("limit", len(dataset))
+
+    response = await api_client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert compare_citizen_groups((await response.json())["data"], dataset)
+
+
+def to_csv_value(value) -> str:
+    if isinstance(value, list):
+        return json.dumps(value, separators=(",", ":"))
+    return "" if value is None else str(value)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("content_type", FORMATS)
+async def test_get_citizens_formats(
+    api_client, migrated_postgres_connection, content_type
+):
+    """
+    Citizens in record formats are expected to be the same as JSON ones
+    """
+
+    dataset = generate_citizens(citizens_number=1000, relations_number=100)
+    import_id = import_dataset(migrated_postgres_connection, dataset)
+    path = url_for(CitizensView.URL_PATH, import_id=import_id)
+
+    projection = {"fields": "citizen_id,relatives,gender", "town": dataset[0]["town"]}
+    for params in ({}, projection):
+        expected = await get_citizens_data(api_client, import_id, params=params)
+        if content_type == CsvFormat.content_type:
+            expected = [
+                {field: to_csv_value(value) for field, value in citizen.items()}
+                for citizen in expected
+            ]
+
+        records = await get_records(api_client, path, content_type, params=params)
+        assert records == expected
+
+    # Pages are returned in JSON
+    response = await api_client.get(
+        path, params={"limit": 10}, headers={"Accept": content_type}
+    )
+    assert response.content_type == "application/json"
+
+
+@pytest.mark.asyncio
+async def test_get_citizens_not_acceptable(api_client, migrated_postgres_connection):
+    import_id = import_dataset(migrated_postgres_connection, [generate_citizen()])
+    path = url_for(CitizensView.URL_PATH, import_id=import_id)
+
+    await get_records(api_client, path, "text/html", HTTPStatus.NOT_ACCEPTABLE)
+
+    # JSON is preferred when several types are acceptable
+    response = await api_client.get(path, headers={"Accept": "text/*, */*;q=0.5"})
+    assert response.content_type == "text/csv"
+    response = await api_client.get(path, headers={"Accept": "*/*"})
+    assert response.content_type == "application/json"
+
+
+@pytest.mark.asyncio
+async def test_select_query_close(api_client, migrated_postgres_connection):
+    """
+    Connection is expected to be released once the iteration is closed,
+    not when the generators are collected
+    """
+
+    dataset = generate_citizens(citizens_number=100)
+    import_id = import_dataset(migrated_postgres_connection, dataset)
+    query = citizen_table.select().where(citizen_table.c.import_id == import_id)
+    pg = api_client.server.app["pg"]
+
+    async with aclosing(aiter(SelectQuery(query, pg, 7))) as rows:
+        async for _ in rows:
+            assert pg.freesize == pg.size - 1
+            break
+
+    assert pg.freesize == pg.size
+
+
+@pytest.mark.asyncio
+async def test_select_query_timeout(api_client):
+    query = select([func.pg_sleep(1)])
+    pg = api_client.server.app["pg"]
+
+    # aiopg raises CancelledError for canceled statements
+    with pytest.raises(asyncio.CancelledError):
+        async for _ in SelectQuery(query, pg, timeout_ms=10):
+            pass
+
+    # Timeout is local to the transaction of the query
+    async with pg.acquire() as conn:
+        assert await conn.scalar("SHOW statement_timeout") == "0"
+
+
+@pytest.mark.asyncio
+async def test_select_query_prefetch(api_client, migrated_postgres_connection):
+    import_id = import_dataset(migrated_postgres_connection, [generate_citizen()])
+    query = citizen_table.select().where(citizen_table.c.import_id == import_id)
+
+    class SmallBatchQuery(SelectQuery):
+        BATCH_BYTES = 1
+
+    select_query = SelectQuery(query, api_client.server.app["pg"])
+    rows = [row async for row in select_query]
+
+    # Grows at most twice per batch
+    assert select_query.adapt_prefetch(100, rows, 0) == 200
+    # Shrinks if fetching has taken too long
+    assert select_query.adapt_prefetch(1000, rows, 0.5) == 100
+    # Fits into `BATCH_BYTES`
+    select_query = SmallBatchQuery(query, api_client.server.app["pg"])
+    assert select_query.adapt_prefetch(1000, rows, 0) == SelectQuery.MIN_PREFETCH
@@ -1,15 +1,20 @@
 import pytest
 
 from http import HTTPStatus
+from operator import itemgetter
 from random import randint
 from typing import Tuple, Mapping, Any, List
 
+from analyzer.api.routes import CitizenPresentsView
+from analyzer.utils.formats import CsvFormat
 from analyzer.utils.testing import (
     CitizenType,
     generate_citizen,
     generate_citizens,
+    get_records,
     post_imports_data,
     get_citizen_presents_data,
+    url_for,
 )
 
 PresentsByMonthType = Mapping[str, Any]
@@ -89,3 +94,21 @@ async def test_get_citizens_presents_nonexistent(api_client):
     await get_citizen_presents_data(
         api_client, randint(1, 1000), expected_status=HTTPStatus.NOT_FOUND
     )
+
+
+@pytest.mark.asyncio
+async def test_get_citizens_presents_csv(api_client):
+    citizens = generate_citizens(citizens_number=100, relations_number=30)
+    import_id = await post_imports_data(api_client, citizens)
+    presents = await get_citizen_presents_data(api_client, import_id)
+
+    path = url_for(CitizenPresentsView.URL_PATH, import_id=import_id)
+    records = await get_records(api_client, path, CsvFormat.content_type)
+
+    # Presents are flattened into rows, CSV values are strings
+    records = [{key: int(value) for key, value in row.items()} for row in records]
+    assert sorted(records, key=itemgetter("month", "citizen_id")) == [
+        {"month": int(month), **row}
+        for month in sorted(presents, key=int)
+        for row in sorted(presents[month], key=itemgetter("citizen_id"))
+    ]
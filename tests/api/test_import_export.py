@@ -0,0 +1,159 @@
+import pytest
+
+from http import HTTPStatus
+
+from analyzer.api.app import init_app
+from analyzer.config import TestConfig
+from analyzer.utils.testing import (
+    compare_citizen_groups,
+    decode_export,
+    encode_export,
+    export_import_data,
+    generate_citizen,
+    generate_citizens,
+    get_citizens_data,
+    post_imports_copy_data,
+    post_imports_data,
+)
+
+CASES = (
+    # Empty import
+    [],
+    # Citizen without relatives
+    [generate_citizen(relatives=[])],
+    # Citizen related with himself and others
+    [
+        generate_citizen(citizen_id=1, name='Иван, "Ваня"\n', relatives=[1, 2]),
+        generate_citizen(citizen_id=2, relatives=[1]),
+    ],
+    generate_citizens(citizens_number=50, relations_number=30, start_citizen_id=1),
+)
+
+CITIZEN_HEADER = (
+    "citizen_id,name,birth_date,gender,town,street,building,apartment,relatives\n"
+)
+RELATION_HEADER = "citizen_id,relative_id\n"
+
+
+def csv_export(citizens: str, relations: str = "") -> tuple:
+    return encode_export(
+        {
+            "citizen": ("text/csv", (CITIZEN_HEADER + citizens).encode()),
+            "relation": ("text/csv", (RELATION_HEADER + relations).encode()),
+        }
+    )
+
+
+ERROR_CASES = (
+    # Relation is not bidirectional
+    csv_export(
+        "1,Ivan,2000-01-01,male,Moscow,Lenina,1,1,{2}\n"
+        "2,Petr,2000-01-01,male,Moscow,Lenina,1,1,{}\n",
+        "1,2\n",
+    ),
+    # Relatives do not match relations
+    csv_export("1,Ivan,2000-01-01,male,Moscow,Lenina,1,1,{1}\n"),
+    # Not unique citizen_id
+    csv_export(
+        "1,Ivan,2000-01-01,male,Moscow,Lenina,1,1,{}\n"
+        "1,Petr,2000-01-01,male,Moscow,Lenina,1,1,{}\n"
+    ),
+    # Empty name, negative apartment, birth date in the future
+    csv_export("1,,2000-01-01,male,Moscow,Lenina,1,1,{}\n"),
+    csv_export("1,Ivan,2000-01-01,male,Moscow,Lenina,1,-1,{}\n"),
+    csv_export("1,Ivan,3000-01-01,male,Moscow,Lenina,1,1,{}\n"),
+    # Malformed rows
+    csv_export("1,Ivan,2000-13-01,male,Moscow,Lenina,1,1,{}\n"),
+    csv_export("1,Ivan,2000-01-01,unknown,Moscow,Lenina,1,1,{}\n"),
+    csv_export("1,Ivan\n"),
+    # Unknown part and content type
+    encode_export({"citizens": ("text/csv", CITIZEN_HEADER.encode())}),
+    encode_export({"citizen": ("application/json", b"[]")}),
+)
+
+
+@pytest.mark.parametrize("format", ("csv", "binary"))
+@pytest.mark.parametrize("rows_per_copy", (1, 7, 5000))
+@pytest.mark.parametrize("citizens", CASES)
+async def test_export_import(api_client, citizens, format, rows_per_copy):
+    """
+    Export is expected to be loaded into the same import
+    """
+
+    api_client.app["export"].rows_per_copy = rows_per_copy
+    import_id = await post_imports_data(api_client, citizens)
+
+    content_type, body = await export_import_data(api_client, import_id, format)
+    copy_id = await post_imports_copy_data(api_client, content_type, body)
+
+    assert copy_id != import_id
+    copied_citizens = await get_citizens_data(api_client, copy_id)
+    assert compare_citizen_groups(citizens, copied_citizens)
+
+
+async def test_export_csv(api_client):
+    api_client.app["export"].rows_per_copy = 2
+    citizens = [
+        generate_citizen(citizen_id=3, relatives=[1]),
+        generate_citizen(citizen_id=1, relatives=[3]),
+        generate_citizen(citizen_id=2, relatives=[]),
+    ]
+    import_id = await post_imports_data(api_client, citizens)
+
+    parts = decode_export(*await export_import_data(api_client, import_id))
+
+    assert list(parts) == ["citizen", "relation"]
+    content_type, data = parts["citizen"]
+    assert content_type == "text/csv"
+    lines = data.decode().splitlines()
+    # Header is written once, citizens are ordered by `citizen_id`
+    assert lines[0] + "\n" == CITIZEN_HEADER
+    assert [line.split(",")[0] for line in lines[1:]] == ["1", "2", "3"]
+    assert parts["relation"] == ("text/csv", (RELATION_HEADER + "1,3\n3,1\n").encode())
+
+
+async def test_export_not_found(api_client):
+    await export_import_data(api_client, 1, expected_status=HTTPStatus.NOT_FOUND)
+    await export_import_data(
+        api_client, 1, format="xml", expected_status=HTTPStatus.BAD_REQUEST
+    )
+
+
+@pytest.mark.parametrize("content_type,body", ERROR_CASES)
+async def test_post_imports_copy_invalid(api_client, content_type, body):
+    await post_imports_copy_data(
+        api_client, content_type, body, expected_status=HTTPStatus.BAD_REQUEST
+    )
+
+
+async def test_post_imports_copy_not_multipart(api_client):
+    await post_imports_copy_data(
+        api_client,
+        "application/json",
+        b"{}",
+        expected_status=HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+    )
+
+
+async def test_sync_pool_shared(aiohttp_client, arguments):
+    """
+    COPY based imports and exports are expected to share a single pool
+    of synchronous connections, connected once it is used
+    """
+
+    arguments.import_engine = "copy"
+    arguments.pg_sync_pool_max_size = 1
+    client = await aiohttp_client(init_app(arguments, TestConfig()))
+    app = client.server.app
+
+    pool = app["sync_pg"]
+    assert app["ingest"].pool is pool
+    assert app["export"].pool is pool
+    assert pool._pool is None
+
+    # A single connection is enough for both engines
+    citizens = generate_citizens(citizens_number=10, relations_number=3)
+    import_id = await post_imports_data(client, citizens)
+    content_type, body = await export_import_data(client, import_id, "binary")
+    copy_id = await post_imports_copy_data(client, content_type, body)
+    assert compare_citizen_groups(await get_citizens_data(client, copy_id), citizens)
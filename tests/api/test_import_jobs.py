@@ -0,0 +1,155 @@
+import asyncio
+import pytest
+
+from aiohttp.web_exceptions import HTTPBadRequest
+from http import HTTPStatus
+from unittest.mock import ANY
+
+from analyzer.api.app import init_app
+from analyzer.api.middleware import format_http_error
+from analyzer.api.schema import CitizenSchema
+from analyzer.config import TestConfig
+from analyzer.db.schema import ImportJobPhase, import_job_table
+from analyzer.utils.jobs import describe_bad_request
+from analyzer.utils.testing import (
+    compare_citizen_groups,
+    generate_citizen,
+    generate_citizens,
+    get_citizens_data,
+    get_import_job_data,
+    post_imports_job,
+)
+
+CASES = (
+    # Job with relatives is expected to write citizens and relations rows
+    [
+        generate_citizen(citizen_id=1, relatives=[2, 3]),
+        generate_citizen(citizen_id=2, relatives=[1]),
+        generate_citizen(citizen_id=3, relatives=[1]),
+    ],
+    # Large import
+    generate_citizens(citizens_number=5000, relations_number=500),
+    # Empty import
+    [],
+)
+
+
+async def wait_for_job(api_client, job_id: int, timeout: float = 30) -> dict:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    while loop.time() < deadline:
+        job = await get_import_job_data(api_client, job_id)
+        if job["phase"] in ("done", "failed"):
+            return job
+        await asyncio.sleep(0.1)
+
+    raise TimeoutError(f"Import job {job_id} has not finished")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("citizens", CASES)
+async def test_import_job(api_client, citizens):
+    job_id = await post_imports_job(api_client, citizens)
+    job = await wait_for_job(api_client, job_id)
+
+    assert job["phase"] == "done"
+    assert job["error"] is None
+    assert job["rows_written"] == len(citizens) + sum(
+        len(citizen["relatives"]) for citizen in citizens
+    )
+
+    imported_citizens = await get_citizens_data(api_client, job["import_id"])
+    assert compare_citizen_groups(imported_citizens, citizens)
+
+
+@pytest.mark.asyncio
+async def test_import_job_validation(api_client):
+    # Data is validated before the job is created
+    citizens = [generate_citizen(citizen_id=1, relatives=[2])]
+    await post_imports_job(api_client, citizens, HTTPStatus.BAD_REQUEST)
+
+
+@pytest.mark.asyncio
+async def test_get_non_existing_import_job(api_client):
+    await get_import_job_data(api_client, 999, HTTPStatus.NOT_FOUND)
+
+
+@pytest.mark.asyncio
+async def test_import_job_failed_validation(aiohttp_client, arguments):
+    """
+    Job rejected by checks of the ingest engine is expected to keep
+    the reason, unlike jobs failed by errors of the server
+    """
+
+    arguments.import_engine = "staging"
+    client = await aiohttp_client(init_app(arguments, TestConfig()))
+
+    # Relatives are checked by the staging engine only
+    citizens = CitizenSchema(many=True).load(
+        [generate_citizen(citizen_id=1, relatives=[2])]
+    )
+    job_id = await client.server.app["jobs"].submit(citizens)
+    job = await wait_for_job(client, job_id)
+
+    assert job["phase"] == "failed"
+    assert job["error"]["message"] == "Import validation has failed"
+    assert job["error"]["fields"] == {"_schema": [ANY]}
+
+
+@pytest.mark.asyncio
+async def test_describe_bad_request(api_client):
+    # JSON bodies of errors are encoded by payloads registered by the app
+    err = format_http_error(HTTPBadRequest, "Wrong import", {"citizens": ["Empty"]})
+    assert describe_bad_request(err) == {
+        "message": "Wrong import",
+        "fields": {"citizens": ["Empty"]},
+    }
+
+    err = HTTPBadRequest(text="Wrong import")
+    assert describe_bad_request(err) == {"message": "Wrong import"}
+
+
+@pytest.mark.asyncio
+async def test_import_job_single_connection(aiohttp_client, arguments):
+    """
+    Job is expected to report its progress without waiting for
+    a second connection while the ingest holds the only one
+    """
+
+    arguments.import_engine = "insert"
+    arguments.pg_pool_min_size = arguments.pg_pool_max_size = 1
+    client = await aiohttp_client(init_app(arguments, TestConfig()))
+    client.server.app["ingest"].MAX_CITIZENS_PER_INSERT = 1
+
+    citizens = generate_citizens(citizens_number=10, relations_number=3)
+    job_id = await post_imports_job(client, citizens)
+    job = await wait_for_job(client, job_id, timeout=10)
+
+    assert job["phase"] == "done"
+    assert job["rows_written"] == len(citizens) + sum(
+        len(citizen["relatives"]) for citizen in citizens
+    )
+
+
+@pytest.mark.asyncio
+async def test_unfinished_import_jobs_failed(aiohttp_client, arguments):
+    """
+    Jobs left unfinished by the previous process are expected to be failed
+    once the queue is started, their citizens are lost
+    """
+
+    client = await aiohttp_client(init_app(arguments, TestConfig()))
+    async with client.server.app["pg"].acquire() as conn:
+        result = await conn.execute(
+            import_job_table.insert()
+            .values(phase=ImportJobPhase.citizens)
+            .returning(import_job_table.c.job_id)
+        )
+        job_id = await result.scalar()
+
+    client = await aiohttp_client(init_app(arguments, TestConfig()))
+    job = await get_import_job_data(client, job_id)
+
+    assert job["phase"] == "failed"
+    assert job["error"] == {"message": "Import has been interrupted"}
@@ -3,8 +3,11 @@ import pytest
 from datetime import date, timedelta
 from http import HTTPStatus
 from random import randint
+from aiopg.sa.result import RowProxy
+from sqlalchemy import select
 
 from analyzer.config import TestConfig
+from analyzer.db.schema import citizen_table, relation_table
 from analyzer.utils.testing import (
     compare_citizens,
     compare_citizen_groups,
@@ -106,6 +109,51 @@ async def test_patch_citizen(api_client):
     assert compare_citizen_groups(actual_citizens, side_import_data)
 
 
+@pytest.mark.asyncio
+async def test_patch_citizen_relations(api_client):
+    """
+    Relatives stored with citizens are expected to match `relation_table`
+    """
+
+    import_data = [
+        generate_citizen(citizen_id=1, relatives=[1, 2, 3]),
+        generate_citizen(citizen_id=2, relatives=[1]),
+        generate_citizen(citizen_id=3, relatives=[1]),
+        generate_citizen(citizen_id=4, relatives=[]),
+    ]
+    import_id = await post_imports_data(api_client, import_data)
+
+    for citizen_id, relatives in ((1, [3, 4]), (2, [2, 4]), (4, [])):
+        await patch_citizen_data(
+            api_client, import_id, citizen_id, {"relatives": relatives}
+        )
+
+    async with api_client.server.app["pg"].acquire() as conn:
+        result = await conn.execute(
+            select([citizen_table.c.citizen_id, citizen_table.c.relatives]).where(
+                citizen_table.c.import_id == import_id
+            )
+        )
+        stored = {
+            citizen_id: sorted(relatives)
+            for citizen_id, relatives in map(RowProxy.as_tuple, await result.fetchall())
+        }
+
+        result = await conn.execute(
+            select([relation_table.c.citizen_id, relation_table.c.relative_id]).where(
+                relation_table.c.import_id == import_id
+            )
+        )
+        relations = {}
+        for citizen_id, relative_id in map(RowProxy.as_tuple, await result.fetchall()):
+            relations.setdefault(citizen_id, []).append(relative_id)
+
+    assert stored == {1: [3], 2: [2], 3: [1], 4: []}
+    assert {
+        citizen_id: sorted(relatives) for citizen_id, relatives in relations.items()
+    } == {citizen_id: relatives for citizen_id, relatives in stored.items() if relatives}
+
+
 @pytest.mark.asyncio
 async def test_patch_citizen_self_relative(api_client):
     """
@@ -213,3 +261,33 @@ async def test_patch_citizen_nonexistent_import_or_citizen(api_client):
         data={"name": "Ivan Ivanov"},
         expected_status=HTTPStatus.NOT_FOUND,
     )
+
+
+@pytest.mark.asyncio
+async def test_patch_citizen_pool(pool_api_client):
+    """
+    Positive testcase: Test a citizen gets a large list of relatives
+    validated in the process pool
+    """
+
+    import_data = generate_citizens(citizens_number=1000, start_citizen_id=1)
+    import_id = await post_imports_data(pool_api_client, import_data)
+
+    relatives = [citizen["citizen_id"] for citizen in import_data]
+    actual = await patch_citizen_data(
+        client=pool_api_client,
+        import_id=import_id,
+        citizen_id=1,
+        data={"birth_date": "02.02.2002", "relatives": relatives},
+    )
+    assert actual["birth_date"] == "02.02.2002"
+    assert sorted(actual["relatives"]) == relatives
+
+    # Invalid data is reported by the worker process
+    await patch_citizen_data(
+        client=pool_api_client,
+        import_id=import_id,
+        citizen_id=1,
+        data={"relatives": relatives + [1]},
+        expected_status=HTTPStatus.BAD_REQUEST,
+    )
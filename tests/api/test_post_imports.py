@@ -1,12 +1,32 @@
+import json
 import pytest
 
+from itertools import groupby
+
+from aiohttp.payload import AsyncIterablePayload
 from datetime import date, timedelta
+from decimal import Decimal
 from typing import Tuple, List
 
 from http import HTTPStatus
+from marshmallow import ValidationError
+from sqlalchemy import func, select
 
 
+from analyzer.api.app import init_app
+from analyzer.api.routes import ImportsStreamView, ImportsView
+from analyzer.api.schema import ImportsSchema
+from analyzer.api.validator import CompiledImportsSchema
 from analyzer.config import TestConfig
+from analyzer.db.schema import (
+    Gender,
+    citizen_stage_table,
+    citizen_table,
+    relation_stage_table,
+)
+from analyzer.utils.codec import CODECS, get_json_codec
+from analyzer.utils.ingest import PipelineTimings, single_batch
+from analyzer.utils.json_stream import JsonStreamError, iter_json_array
 from analyzer.utils.testing import (
     MAX_INTEGER,
     CitizenType,
@@ -15,6 +35,7 @@ from analyzer.utils.testing import (
     generate_citizens,
     post_imports_data,
     get_citizens_data,
+    get_metrics_data,
 )
 
 cfg = TestConfig()
@@ -149,3 +170,424 @@ async def test_post_imports(api_client, citizens, expected_status):
     if expected_status == HTTPStatus.CREATED:
         imported_citizens = await get_citizens_data(api_client, import_id)
         assert compare_citizen_groups(imported_citizens, citizens)
+
+
+@pytest.fixture(params=("text", "binary"))
+async def copy_api_client(request, aiohttp_client, arguments):
+    arguments.import_engine = "copy"
+    arguments.import_copy_format = request.param
+    app = init_app(arguments, cfg)
+
+    client = await aiohttp_client(app, server_kwargs={"port": arguments.api_port})
+
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("citizens, expected_status", CASES)
+async def test_post_imports_copy_engine(copy_api_client, citizens, expected_status):
+    import_id = await post_imports_data(copy_api_client, citizens, expected_status)
+
+    if expected_status == HTTPStatus.CREATED:
+        imported_citizens = await get_citizens_data(copy_api_client, import_id)
+        assert compare_citizen_groups(imported_citizens, citizens)
+
+
+@pytest.fixture(params=("text", "binary"))
+async def staging_api_client(request, aiohttp_client, arguments):
+    arguments.import_engine = "staging"
+    arguments.import_copy_format = request.param
+    arguments.import_synchronous_commit = "off"
+    app = init_app(arguments, cfg)
+
+    client = await aiohttp_client(app, server_kwargs={"port": arguments.api_port})
+
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("citizens, expected_status", CASES)
+async def test_post_imports_staging_engine(staging_api_client, citizens, expected_status):
+    import_id = await post_imports_data(staging_api_client, citizens, expected_status)
+
+    if expected_status == HTTPStatus.CREATED:
+        imported_citizens = await get_citizens_data(staging_api_client, import_id)
+        assert compare_citizen_groups(imported_citizens, citizens)
+
+
+STAGING_CHECK_CASES = (
+    (
+        [generate_citizen(citizen_id=1), generate_citizen(citizen_id=1)],
+        "citizen_id 1 is not unique",
+    ),
+    (
+        [
+            generate_citizen(citizen_id=1, relatives=[2]),
+            generate_citizen(citizen_id=2, relatives=[]),
+        ],
+        "citizen 2 does not have relation with 1",
+    ),
+    (
+        [generate_citizen(citizen_id=1, relatives=[3])],
+        "citizen 3 does not have relation with 1",
+    ),
+    (
+        [
+            generate_citizen(citizen_id=1, relatives=[2, 2]),
+            generate_citizen(citizen_id=2, relatives=[1]),
+        ],
+        "relatives of citizen 1 are not unique",
+    ),
+)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("citizens, message", STAGING_CHECK_CASES)
+async def test_staging_engine_checks(staging_api_client, citizens, message):
+    """
+    Staging engine is expected to reject invalid citizens
+    even if they have not been validated by `ImportsSchema`
+    """
+
+    app = staging_api_client.server.app
+    citizens = [
+        {**citizen, "birth_date": date(2000, 1, 1)} for citizen in citizens
+    ]
+
+    with pytest.raises(ValidationError) as err:
+        await app["ingest"].ingest(single_batch(citizens))
+    assert err.value.messages == {"_schema": [message]}
+
+    async with app["pg"].acquire() as conn:
+        for table in (citizen_stage_table, relation_stage_table):
+            result = await conn.execute(select([func.count()]).select_from(table))
+            assert await result.scalar() == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("citizens, expected_status", CASES)
+async def test_post_imports_stream(api_client, citizens, expected_status):
+    import_id = await post_imports_data(
+        api_client,
+        citizens,
+        expected_status,
+        str_or_url=ImportsStreamView.URL_PATH,
+    )
+
+    if expected_status == HTTPStatus.CREATED:
+        imported_citizens = await get_citizens_data(api_client, import_id)
+        assert compare_citizen_groups(imported_citizens, citizens)
+
+
+async def iter_chunks(body: bytes, size: int):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+STREAM_CITIZENS = [
+    generate_citizen(citizen_id=1, name=LONGEST_STR, relatives=[2, 3]),
+    generate_citizen(citizen_id=2, relatives=[1]),
+    generate_citizen(citizen_id=3, apartment=12345, relatives=[1]),
+]
+STREAM_CASES = (
+    # Body split by tiny chunks, so tokens and utf-8 characters
+    # are split between reads from the stream
+    (
+        json.dumps({"citizens": STREAM_CITIZENS}, ensure_ascii=False).encode(),
+        HTTPStatus.CREATED,
+    ),
+    # Unknown keys are skipped just like `validation_middleware` does
+    (
+        b'{"meta": {"source": [1, 2]}, "citizens": [] , "tail": null}',
+        HTTPStatus.CREATED,
+    ),
+    # Missing citizens
+    (b"{}", HTTPStatus.BAD_REQUEST),
+    # Truncated body
+    (b'{"citizens": [{"citizen_id": 1', HTTPStatus.BAD_REQUEST),
+    # Extra data after the document
+    (b'{"citizens": []} []', HTTPStatus.BAD_REQUEST),
+)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "body, expected_status",
+    STREAM_CASES,
+    ids=("chunked", "unknown-keys", "missing-citizens", "truncated", "extra-data"),
+)
+async def test_post_imports_stream_chunked(api_client, body, expected_status):
+    response = await api_client.post(
+        ImportsStreamView.URL_PATH,
+        data=AsyncIterablePayload(iter_chunks(body, 7)),
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status == expected_status
+
+    if expected_status == HTTPStatus.CREATED:
+        import_id = (await response.json())["data"]["import_id"]
+        imported_citizens = await get_citizens_data(api_client, import_id)
+        assert compare_citizen_groups(
+            imported_citizens, json.loads(body).get("citizens")
+        )
+
+
+class CountingStream:
+    def __init__(self, body: bytes):
+        self.body = body
+        self.size = 0
+
+    async def read(self, size: int) -> bytes:
+        chunk = self.body[self.size:self.size + size]
+        self.size += len(chunk)
+        return chunk
+
+
+@pytest.mark.asyncio
+async def test_json_stream_fails_on_invalid_value():
+    """
+    Malformed citizen is expected to fail as soon as it is received,
+    not once the rest of the body has been read
+    """
+
+    body = b'{"citizens": [{"citizen_id": 1 "name": "x"}' + b", {}" * 100000 + b"]}"
+    stream = CountingStream(body)
+
+    with pytest.raises(JsonStreamError):
+        async for _ in iter_json_array(stream, "citizens", chunk_size=64):
+            pass
+    assert stream.size <= 128
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", range(1, 12))
+async def test_json_stream_split_numbers(chunk_size):
+    body = b'{"meta": 12.5e-3, "citizens": [1.5, -7, 10]}'
+
+    items = [
+        item
+        async for item in iter_json_array(
+            CountingStream(body), "citizens", chunk_size=chunk_size
+        )
+    ]
+    assert items == [1.5, -7, 10]
+
+
+VALIDATION_CASES = [{"citizens": citizens} for citizens, _ in CASES] + [
+    {"citizens": [generate_citizen(apartment=True)]},
+    {"citizens": [generate_citizen(apartment="1")]},
+    {"citizens": [generate_citizen(gender="other")]},
+    {"citizens": [generate_citizen(birth_date="31.02.2000")]},
+    {"citizens": [generate_citizen(birth_date="")]},
+    {"citizens": [generate_citizen(name=None)]},
+    {"citizens": [generate_citizen(relatives=[-1])]},
+    {"citizens": [generate_citizen(relatives="1")]},
+    {"citizens": [{**generate_citizen(), "unknown": 1}]},
+    {"citizens": [{"citizen_id": 1}]},
+    {"citizens": [1]},
+    {"citizens": {}},
+    {"citizens": None},
+    {},
+]
+
+
+@pytest.mark.parametrize("data", VALIDATION_CASES)
+def test_compiled_imports_schema(data):
+    """
+    Compiled validator is expected to behave exactly like `ImportsSchema`
+    """
+
+    def load(schema):
+        try:
+            return schema.load(data), True
+        except ValidationError as err:
+            return err.messages, False
+
+    expected, is_valid = load(ImportsSchema())
+    assert load(CompiledImportsSchema()) == (expected, is_valid)
+
+    # Valid data should not fall back to marshmallow
+    if is_valid:
+        assert CompiledImportsSchema().fast_load(data) == expected
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("citizens, expected_status", CASES)
+async def test_post_imports_pool(pool_api_client, citizens, expected_status):
+    import_id = await post_imports_data(pool_api_client, citizens, expected_status)
+
+    if expected_status == HTTPStatus.CREATED:
+        imported_citizens = await get_citizens_data(pool_api_client, import_id)
+        assert compare_citizen_groups(imported_citizens, citizens)
+
+    metrics = await get_metrics_data(pool_api_client)
+    assert metrics["timings"]["process_pool.queue_time"]["count"] == 1
+    assert metrics["gauges"]["process_pool.pending"] == 0
+
+
+BODY_CASES = (
+    # Unknown keys are ignored
+    (b'{"meta": 1, "citizens": []}', HTTPStatus.CREATED),
+    (b"", HTTPStatus.BAD_REQUEST),
+    (b"[]", HTTPStatus.BAD_REQUEST),
+    (b'{"citizens": [', HTTPStatus.BAD_REQUEST),
+    (b'{"citizens": "\xff"}', HTTPStatus.BAD_REQUEST),
+)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "body, expected_status",
+    BODY_CASES,
+    ids=("unknown-keys", "empty", "not-object", "truncated", "not-utf8"),
+)
+async def test_post_imports_body(api_client, body, expected_status):
+    response = await api_client.post(
+        ImportsView.URL_PATH,
+        data=body,
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status == expected_status
+
+
+class CodecConfig(TestConfig):
+    VALIDATION_POOL_MIN_BODY_SIZE = 0
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_json_codec(name):
+    codec = CODECS[name]()
+    value = {
+        1: [date(1986, 12, 26), Gender.female],
+        "p50": Decimal("2.35"),
+        "name": "Ёжик",
+    }
+    assert codec.loads(codec.dumps(value)) == {
+        "1": ["1986-12-26", "female"],
+        "p50": 2.35,
+        "name": "Ёжик",
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", CODECS)
+async def test_post_imports_json_codec(aiohttp_client, arguments, name):
+    """
+    Bodies are expected to be decoded by process pool workers
+    and encoded by the app with the same codec
+    """
+
+    arguments.json_codec = name
+    arguments.validation_pool_size = 1
+    app = init_app(arguments, CodecConfig())
+    assert get_json_codec().name == name
+
+    client = await aiohttp_client(app, server_kwargs={"port": arguments.api_port})
+    try:
+        citizens = generate_citizens(citizens_number=100, relations_number=10)
+        import_id = await post_imports_data(client, citizens)
+        imported_citizens = await get_citizens_data(client, import_id)
+        assert compare_citizen_groups(imported_citizens, citizens)
+
+        for body, _ in BODY_CASES[1:]:
+            response = await client.post(
+                ImportsView.URL_PATH,
+                data=body,
+                headers={"Content-Type": "application/json"},
+            )
+            assert response.status == HTTPStatus.BAD_REQUEST
+            assert (await response.json())["error"]["code"] == "bad_request"
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_post_imports_pipeline_metrics(api_client):
+    citizens = generate_citizens(citizens_number=100, relations_number=10)
+    await post_imports_data(api_client, citizens)
+
+    metrics = await get_metrics_data(api_client)
+    for stage in PipelineTimings.STAGES:
+        assert metrics["timings"][f"import.{stage}"]["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_ingest_pipeline_failure(api_client):
+    """
+    Error of a batch producer is expected to abort the import
+    """
+
+    app = api_client.server.app
+
+    async def batches():
+        yield [generate_citizen(citizen_id=1, birth_date=date(2000, 1, 1))]
+        raise ValidationError("Broken batch")
+
+    with pytest.raises(ValidationError):
+        await app["ingest"].ingest(batches())
+
+    async with app["pg"].acquire() as conn:
+        result = await conn.execute(select([func.count()]).select_from(citizen_table))
+        assert await result.scalar() == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("engine", ("insert", "copy", "staging"))
+async def test_ingest_engine_chunks_order(aiohttp_client, arguments, engine):
+    """
+    Chunks of relations are expected to follow chunks of citizens of
+    their batch, so no more than one batch is kept in memory
+    """
+
+    arguments.import_engine = engine
+    client = await aiohttp_client(init_app(arguments, cfg))
+    engine = client.server.app["ingest"]
+    engine.MAX_ROWS_PER_COPY = 2
+    engine.MAX_CITIZENS_PER_INSERT = engine.MAX_RELATIONS_PER_INSERT = 2
+
+    async def batches():
+        for _ in range(2):
+            yield generate_citizens(citizens_number=5, relations_number=3)
+
+    tables = [
+        chunk.table.name
+        async for chunk in engine.encode(batches(), 1, PipelineTimings())
+    ]
+    citizens, relations = tables[0], tables[-1]
+    assert [table for table, _ in groupby(tables)] == [
+        citizens,
+        relations,
+        citizens,
+        relations,
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("engine", ("insert", "copy", "staging"))
+async def test_ingest_relatives_of_following_batches(aiohttp_client, arguments, engine):
+    """
+    Relations written along with their batch may refer to citizens
+    of the following batches
+    """
+
+    arguments.import_engine = engine
+    client = await aiohttp_client(init_app(arguments, cfg))
+    citizens = [
+        generate_citizen(citizen_id=1, birth_date="01.01.2000", relatives=[2]),
+        generate_citizen(citizen_id=2, birth_date="01.01.2000", relatives=[1]),
+    ]
+
+    async def batches():
+        for citizen in citizens:
+            yield [{**citizen, "birth_date": date(2000, 1, 1)}]
+
+    import_id = await client.server.app["ingest"].ingest(batches())
+
+    imported_citizens = await get_citizens_data(client, import_id)
+    assert compare_citizen_groups(imported_citizens, citizens)
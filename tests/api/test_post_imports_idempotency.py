@@ -0,0 +1,173 @@
+import asyncio
+import pytest
+
+from http import HTTPStatus
+from sqlalchemy import func, select
+
+from analyzer.api.app import init_app
+from analyzer.api.routes import ImportsStreamView, ImportsView
+from analyzer.config import TestConfig
+from analyzer.db.schema import citizen_table, import_table
+from analyzer.utils.testing import (
+    generate_citizen,
+    generate_citizens,
+    patch_citizen_data,
+    post_imports_data,
+)
+
+
+class DedupConfig(TestConfig):
+    IMPORT_CONTENT_DEDUP = True
+
+
+@pytest.fixture
+async def dedup_api_client(aiohttp_client, arguments):
+    app = init_app(arguments, DedupConfig())
+
+    client = await aiohttp_client(app, server_kwargs={"port": arguments.api_port})
+
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+async def post_imports(client, citizens, key=None, path=ImportsView.URL_PATH, **kwargs):
+    headers = kwargs.pop("headers", {})
+    if key is not None:
+        headers["Idempotency-Key"] = key
+
+    return await client.post(
+        path, json={"citizens": citizens}, headers=headers, **kwargs
+    )
+
+
+async def count_rows(client, table) -> int:
+    async with client.server.app["pg"].acquire() as conn:
+        result = await conn.execute(select([func.count()]).select_from(table))
+        return await result.scalar()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path", (ImportsView.URL_PATH, ImportsStreamView.URL_PATH))
+async def test_idempotency_key(api_client, path):
+    """
+    Repeated request with the same key is expected to return the same import
+    without writing citizens again
+    """
+
+    citizens = generate_citizens(citizens_number=10, relations_number=2)
+
+    response = await post_imports(api_client, citizens, "key-1", path)
+    assert response.status == HTTPStatus.CREATED
+    assert "Idempotent-Replayed" not in response.headers
+    import_id = (await response.json())["data"]["import_id"]
+
+    response = await post_imports(api_client, citizens, "key-1", path)
+    assert response.status == HTTPStatus.CREATED
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert (await response.json())["data"]["import_id"] == import_id
+
+    assert await count_rows(api_client, import_table) == 1
+    assert await count_rows(api_client, citizen_table) == len(citizens)
+
+    # Another key creates another import
+    response = await post_imports(api_client, citizens, "key-2", path)
+    assert response.status == HTTPStatus.CREATED
+    assert (await response.json())["data"]["import_id"] != import_id
+
+
+@pytest.mark.asyncio
+async def test_idempotency_key_another_payload(api_client):
+    await post_imports_data(
+        api_client, [generate_citizen()], headers={"Idempotency-Key": "key"}
+    )
+
+    response = await post_imports(api_client, [generate_citizen()], "key")
+    assert response.status == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("changed", ("patched", "streamed"))
+async def test_idempotency_key_unknown_content(api_client, changed):
+    """
+    Content of a patched or streamed import is not known, so the key
+    is not expected to be replayed for a request with a body
+    """
+
+    citizens = [generate_citizen(citizen_id=1)]
+    path = ImportsStreamView.URL_PATH if changed == "streamed" else ImportsView.URL_PATH
+    response = await post_imports(api_client, citizens, "key", path)
+    assert response.status == HTTPStatus.CREATED
+    import_id = (await response.json())["data"]["import_id"]
+
+    if changed == "patched":
+        await patch_citizen_data(api_client, import_id, 1, {"name": "Ivan"})
+
+    response = await post_imports(api_client, citizens, "key")
+    assert response.status == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.asyncio
+async def test_idempotency_key_async(api_client):
+    citizens = [generate_citizen()]
+    import_id = await post_imports_data(
+        api_client, citizens, headers={"Idempotency-Key": "key"}
+    )
+
+    # Duplicate is answered right away instead of being queued
+    response = await post_imports(
+        api_client, citizens, "key", headers={"Prefer": "respond-async"}
+    )
+    assert response.status == HTTPStatus.CREATED
+    assert (await response.json())["data"]["import_id"] == import_id
+
+
+@pytest.mark.asyncio
+async def test_content_dedup(dedup_api_client):
+    citizens = [
+        generate_citizen(citizen_id=1, relatives=[2, 3]),
+        generate_citizen(citizen_id=2, relatives=[1]),
+        generate_citizen(citizen_id=3, relatives=[1]),
+    ]
+    import_id = await post_imports_data(dedup_api_client, citizens)
+
+    # Order of citizens and relatives does not matter
+    reordered = [dict(citizen) for citizen in reversed(citizens)]
+    reordered[-1]["relatives"] = [3, 2]
+    response = await post_imports(dedup_api_client, reordered)
+    assert response.status == HTTPStatus.CREATED
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert (await response.json())["data"]["import_id"] == import_id
+
+    # Changed import is not a duplicate anymore
+    await patch_citizen_data(dedup_api_client, import_id, 1, {"name": "Ivan"})
+    new_import_id = await post_imports_data(dedup_api_client, citizens)
+    assert new_import_id != import_id
+
+
+@pytest.mark.asyncio
+async def test_content_dedup_disabled(api_client):
+    citizens = [generate_citizen()]
+    import_id = await post_imports_data(api_client, citizens)
+    assert await post_imports_data(api_client, citizens) != import_id
+
+
+@pytest.mark.asyncio
+async def test_idempotency_key_concurrent(api_client):
+    """
+    Concurrent requests with the same key are expected to create one import
+    """
+
+    citizens = generate_citizens(citizens_number=1000, relations_number=2)
+    responses = await asyncio.gather(
+        *(post_imports(api_client, citizens, "key") for _ in range(3))
+    )
+
+    import_ids = set()
+    for response in responses:
+        assert response.status == HTTPStatus.CREATED
+        import_ids.add((await response.json())["data"]["import_id"])
+
+    assert len(import_ids) == 1
+    assert await count_rows(api_client, import_table) == 1
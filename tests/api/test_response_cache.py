@@ -0,0 +1,224 @@
+import asyncio
+import pytest
+
+from analyzer.api.app import init_app
+from analyzer.config import TestConfig
+from analyzer.utils.cache import (
+    INVALIDATION_CHANNEL,
+    MemoryResponseCache,
+    ResponseCache,
+    SqliteResponseCache,
+)
+from analyzer.utils.testing import (
+    compare_citizen_groups,
+    generate_citizen,
+    generate_citizens,
+    get_age_stats_data,
+    get_citizen_presents_data,
+    get_citizens_data,
+    get_metrics_data,
+    patch_citizen_data,
+    post_imports_data,
+)
+
+cfg = TestConfig()
+
+
+@pytest.fixture(params=("memory", "sqlite"))
+def make_cache(request, tmp_path):
+    def make_cache(**kwargs) -> ResponseCache:
+        if request.param == "sqlite":
+            return SqliteResponseCache(str(tmp_path / "cache.sqlite"), **kwargs)
+        return MemoryResponseCache(**kwargs)
+
+    return make_cache
+
+
+async def test_response_cache(make_cache):
+    cache = make_cache(max_size=40, ttl=60)
+    generation = await cache.generation(1)
+
+    assert await cache.get("a") is None
+    assert await cache.set("a", 1, generation, b"a" * 10, "text/plain")
+    assert await cache.set("b", 2, generation, b"b" * 10, "text/plain")
+    # Bodies larger than a quarter of the cache are not stored
+    assert not await cache.set("c", 2, generation, b"c" * 11, "text/plain")
+    assert (await cache.get("a")).body == b"a" * 10
+
+    # Least recently used body is evicted
+    for key in ("c", "d", "e"):
+        await cache.set(key, 3, generation, key.encode() * 10, "text/plain")
+    assert await cache.get("b") is None
+    assert await cache.get("a") is not None
+    assert cache.metrics.gauges == {"cache.size": 40, "cache.entries": 4}
+
+    # Only bodies of the changed import are dropped, bodies computed
+    # before the change are not stored
+    await cache.invalidate(3)
+    assert await cache.get("a") is not None
+    assert not await cache.set("c", 3, generation, b"c", "text/plain")
+    assert await cache.set("c", 3, await cache.generation(3), b"c", "text/plain")
+
+    counters = cache.metrics.counters
+    assert counters["cache.hits"] == 3
+    assert counters["cache.misses"] == 2
+    assert counters["cache.evictions"] == 1
+    assert counters["cache.invalidations"] == 1
+    assert cache.metrics.gauges == {"cache.size": 11, "cache.entries": 2}
+
+    # Nothing computed before clearing is stored
+    generation = await cache.generation(1)
+    await cache.clear()
+    assert await cache.get("a") is None
+    assert not await cache.set("a", 1, generation, b"a", "text/plain")
+    await cache.close()
+
+
+async def test_response_cache_ttl(make_cache):
+    cache = make_cache(max_size=40, ttl=0)
+    await cache.set("a", 1, await cache.generation(1), b"a", "text/plain")
+
+    assert await cache.get("a") is None
+    assert cache.metrics.counters["cache.expirations"] == 1
+    assert cache.metrics.gauges["cache.entries"] == 0
+    await cache.close()
+
+
+async def test_sqlite_response_cache_hits(tmp_path):
+    """
+    Hits are expected to be plain reads, times of access are written
+    by the next store. Size of the cache is expected to be kept
+    when an entry is replaced
+    """
+
+    cache = SqliteResponseCache(str(tmp_path / "cache.sqlite"), max_size=40)
+    generation = await cache.generation(1)
+    await cache.set("a", 1, generation, b"a" * 10, "text/plain")
+    await cache.set("a", 1, generation, b"a" * 10, "text/plain")
+    await cache.set("b", 1, generation, b"b" * 10, "text/plain")
+
+    changes = cache.conn.total_changes
+    for _ in range(10):
+        assert await cache.get("a") is not None
+    assert cache.conn.total_changes == changes
+
+    # "a" has been used after "b", so "b" is evicted
+    for key in ("c", "d", "e"):
+        await cache.set(key, 1, generation, key.encode() * 10, "text/plain")
+    assert await cache.get("b") is None
+    assert await cache.get("a") is not None
+    assert cache.metrics.gauges == {"cache.size": 40, "cache.entries": 4}
+    await cache.close()
+
+    # Usage is shared with caches of other processes
+    cache = SqliteResponseCache(str(tmp_path / "cache.sqlite"), max_size=40)
+    assert await cache.run(cache.get_usage) == (40, 4)
+    await cache.close()
+
+
+@pytest.mark.parametrize("headers", ({}, {"Accept-Encoding": "gzip"}))
+async def test_response_cache_views(api_client, headers):
+    citizens = generate_citizens(citizens_number=20, relations_number=10)
+    import_id = await post_imports_data(api_client, citizens)
+    other_citizens = [generate_citizen(citizen_id=1, relatives=[])]
+    other_id = await post_imports_data(api_client, other_citizens)
+
+    for get_data in (get_citizens_data, get_citizen_presents_data, get_age_stats_data):
+        for _ in range(2):
+            await get_data(api_client, import_id, headers=headers)
+
+    cached = await get_citizens_data(api_client, import_id, headers=headers)
+    assert compare_citizen_groups(citizens, cached)
+    assert await get_citizens_data(api_client, other_id) == other_citizens
+
+    metrics = await get_metrics_data(api_client)
+    assert metrics["counters"]["cache.hits"] == 4
+    assert metrics["counters"]["cache.misses"] == 4
+    assert metrics["gauges"]["cache.entries"] == 4
+
+    # Changed import is computed once again, other imports stay cached
+    citizen = citizens[0]
+    citizen["name"] = "Иван"
+    await patch_citizen_data(
+        api_client, import_id, citizen["citizen_id"], {"name": "Иван"}
+    )
+
+    changed = await get_citizens_data(api_client, import_id, headers=headers)
+    assert compare_citizen_groups(citizens, changed)
+    assert await get_citizens_data(api_client, other_id) == other_citizens
+
+    metrics = await get_metrics_data(api_client)
+    assert metrics["counters"]["cache.hits"] == 5
+    assert metrics["counters"]["cache.misses"] == 5
+    assert metrics["counters"]["cache.invalidations"] == 1
+
+
+async def test_response_cache_disabled(aiohttp_client, arguments):
+    arguments.response_cache_size = 0
+    client = await aiohttp_client(init_app(arguments, cfg))
+
+    citizens = [generate_citizen(citizen_id=1, relatives=[])]
+    import_id = await post_imports_data(client, citizens)
+    for _ in range(2):
+        assert await get_citizens_data(client, import_id) == citizens
+
+    metrics = await get_metrics_data(client)
+    assert "cache.misses" not in metrics["counters"]
+
+
+async def test_response_cache_shared(aiohttp_client, arguments, tmp_path):
+    arguments.response_cache_backend = "sqlite"
+    arguments.response_cache_path = str(tmp_path / "cache.sqlite")
+    client = await aiohttp_client(init_app(arguments, cfg))
+    other_client = await aiohttp_client(init_app(arguments, cfg))
+
+    citizens = generate_citizens(citizens_number=5, relations_number=2)
+    import_id = await post_imports_data(client, citizens)
+
+    # Response computed by one process is served by the other one
+    await get_citizens_data(client, import_id)
+    cached = await get_citizens_data(other_client, import_id)
+    assert compare_citizen_groups(citizens, cached)
+    metrics = await get_metrics_data(other_client)
+    assert metrics["counters"]["cache.hits"] == 1
+    assert "cache.misses" not in metrics["counters"]
+
+    citizen = citizens[0]
+    citizen["name"] = "Иван"
+    await patch_citizen_data(
+        other_client, import_id, citizen["citizen_id"], {"name": "Иван"}
+    )
+    changed = await get_citizens_data(client, import_id)
+    assert compare_citizen_groups(citizens, changed)
+
+
+@pytest.mark.parametrize("malformed", ((), ("", "1", "one source", "1 2 3")))
+async def test_response_cache_notifications(aiohttp_client, arguments, malformed):
+    client = await aiohttp_client(init_app(arguments, cfg))
+    other_client = await aiohttp_client(init_app(arguments, cfg))
+
+    citizens = [generate_citizen(citizen_id=1, relatives=[])]
+    import_id = await post_imports_data(client, citizens)
+    for api_client in (client, other_client):
+        assert await get_citizens_data(api_client, import_id) == citizens
+
+    # Notifications sent to the channel by anyone else are skipped
+    async with client.server.app["pg"].acquire() as conn:
+        for payload in malformed:
+            await conn.execute(
+                "SELECT pg_notify(%s, %s)", (INVALIDATION_CHANNEL, payload)
+            )
+
+    # Change made by one process is broadcast to the other one
+    await patch_citizen_data(client, import_id, 1, {"name": "Иван"})
+    citizens[0]["name"] = "Иван"
+
+    for _ in range(100):
+        metrics = await get_metrics_data(other_client)
+        if metrics["counters"].get("cache.invalidations"):
+            break
+        await asyncio.sleep(0.01)
+
+    assert await get_citizens_data(other_client, import_id) == citizens
+    metrics = await get_metrics_data(client)
+    assert metrics["counters"]["cache.invalidations"] == 1
@@ -0,0 +1,220 @@
+import pytest
+
+from http import HTTPStatus
+from sqlalchemy import func, select
+
+from analyzer.api.app import init_app
+from analyzer.api.routes import (
+    UploadSessionBatchView,
+    UploadSessionCommitView,
+    UploadSessionView,
+)
+from analyzer.config import TestConfig
+from analyzer.db.schema import citizen_stage_table, relation_stage_table
+from analyzer.utils.testing import (
+    commit_upload_session,
+    compare_citizen_groups,
+    generate_citizen,
+    generate_citizens,
+    get_citizens_data,
+    open_upload_session,
+    put_upload_batch,
+    url_for,
+)
+
+
+class SessionConfig(TestConfig):
+    UPLOAD_SESSION_MAX_CITIZENS = 2
+    UPLOAD_SESSION_TTL = 0
+
+
+@pytest.fixture
+async def session_api_client(aiohttp_client, arguments):
+    app = init_app(arguments, SessionConfig())
+
+    client = await aiohttp_client(app, server_kwargs={"port": arguments.api_port})
+
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+async def count_staged(client) -> int:
+    rows = 0
+    async with client.server.app["pg"].acquire() as conn:
+        for table in (citizen_stage_table, relation_stage_table):
+            result = await conn.execute(select([func.count()]).select_from(table))
+            rows += await result.scalar()
+
+    return rows
+
+
+async def get_session(client, session_id: int, expected_status=HTTPStatus.OK):
+    response = await client.get(
+        url_for(UploadSessionView.URL_PATH, session_id=session_id)
+    )
+    assert response.status == expected_status
+
+    if response.status == HTTPStatus.OK:
+        return (await response.json())["data"]
+
+
+@pytest.mark.asyncio
+async def test_upload_session(api_client):
+    """
+    Citizens are expected to be related across batches
+    """
+
+    citizens = generate_citizens(citizens_number=3000, relations_number=300)
+    session_id = await open_upload_session(api_client)
+
+    for batch, i in enumerate(range(0, len(citizens), 1000), start=1):
+        session = await put_upload_batch(
+            api_client, session_id, batch, citizens[i:i + 1000]
+        )
+        assert session["batches"] == batch
+        assert session["citizens"] == i + 1000
+
+    import_id = await commit_upload_session(api_client, session_id)
+
+    imported_citizens = await get_citizens_data(api_client, import_id)
+    assert compare_citizen_groups(imported_citizens, citizens)
+
+    session = await get_session(api_client, session_id)
+    assert session["state"] == "committed"
+    assert session["import_id"] == import_id
+    assert await count_staged(api_client) == 0
+
+
+@pytest.mark.asyncio
+async def test_upload_session_resume(api_client):
+    citizens = [
+        generate_citizen(citizen_id=1, relatives=[2]),
+        generate_citizen(citizen_id=2, relatives=[1]),
+    ]
+    session_id = await open_upload_session(api_client)
+
+    await put_upload_batch(api_client, session_id, 1, citizens[:1])
+
+    # Repeated batch is not written again
+    response = await api_client.put(
+        url_for(UploadSessionBatchView.URL_PATH, session_id=session_id, batch=1),
+        json={"citizens": citizens[:1]},
+    )
+    assert response.status == HTTPStatus.OK
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert (await response.json())["data"]["citizens"] == 1
+
+    # Batches can't be skipped
+    await put_upload_batch(api_client, session_id, 3, citizens[1:], HTTPStatus.CONFLICT)
+
+    await put_upload_batch(api_client, session_id, 2, citizens[1:])
+
+    import_id = await commit_upload_session(api_client, session_id)
+    assert await commit_upload_session(api_client, session_id) == import_id
+
+    # Committed session does not accept batches anymore
+    await put_upload_batch(api_client, session_id, 3, citizens, HTTPStatus.CONFLICT)
+
+    imported_citizens = await get_citizens_data(api_client, import_id)
+    assert compare_citizen_groups(imported_citizens, citizens)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "batches, message",
+    (
+        (
+            [
+                [generate_citizen(citizen_id=1)],
+                [generate_citizen(citizen_id=1)],
+            ],
+            "citizen_id 1 is not unique",
+        ),
+        (
+            [
+                [generate_citizen(citizen_id=1, relatives=[2])],
+                [generate_citizen(citizen_id=2)],
+            ],
+            "citizen 2 does not have relation with 1",
+        ),
+        (
+            [[generate_citizen(citizen_id=1, relatives=[2])]],
+            "citizen 2 does not have relation with 1",
+        ),
+    ),
+)
+async def test_upload_session_checks(api_client, batches, message):
+    """
+    Citizens of all the batches are expected to be checked on commit
+    """
+
+    session_id = await open_upload_session(api_client)
+    for batch, citizens in enumerate(batches, start=1):
+        await put_upload_batch(api_client, session_id, batch, citizens)
+
+    response = await api_client.post(
+        url_for(UploadSessionCommitView.URL_PATH, session_id=session_id)
+    )
+    assert response.status == HTTPStatus.BAD_REQUEST
+    assert (await response.json())["error"]["fields"] == {"_schema": [message]}
+
+    session = await get_session(api_client, session_id)
+    assert session["state"] == "open"
+    assert session["import_id"] is None
+
+
+@pytest.mark.asyncio
+async def test_upload_session_invalid_batch(api_client):
+    session_id = await open_upload_session(api_client)
+
+    await put_upload_batch(
+        api_client,
+        session_id,
+        1,
+        [generate_citizen(apartment=-1)],
+        HTTPStatus.BAD_REQUEST,
+    )
+    await put_upload_batch(api_client, session_id, 1, [], HTTPStatus.BAD_REQUEST)
+
+    session = await get_session(api_client, session_id)
+    assert session["batches"] == 0
+    assert await count_staged(api_client) == 0
+
+
+@pytest.mark.asyncio
+async def test_upload_session_delete(api_client):
+    session_id = await open_upload_session(api_client)
+    await put_upload_batch(
+        api_client, session_id, 1, [generate_citizen(citizen_id=1, relatives=[1])]
+    )
+
+    path = url_for(UploadSessionView.URL_PATH, session_id=session_id)
+    response = await api_client.delete(path)
+    assert response.status == HTTPStatus.NO_CONTENT
+    assert await count_staged(api_client) == 0
+
+    await get_session(api_client, session_id, HTTPStatus.NOT_FOUND)
+    await commit_upload_session(api_client, session_id, HTTPStatus.NOT_FOUND)
+
+
+@pytest.mark.asyncio
+async def test_upload_session_limits(session_api_client):
+    session_id = await open_upload_session(session_api_client)
+
+    await put_upload_batch(
+        session_api_client, session_id, 1, generate_citizens(citizens_number=2)
+    )
+    await put_upload_batch(
+        session_api_client,
+        session_id,
+        2,
+        [generate_citizen(citizen_id=3)],
+        HTTPStatus.BAD_REQUEST,
+    )
+
+    # Unused session has expired once another one is opened
+    await open_upload_session(session_api_client)
+    await get_session(session_api_client, session_id, HTTPStatus.NOT_FOUND)
+    assert await count_staged(session_api_client) == 0
@@ -99,6 +99,27 @@ async def api_client(aiohttp_client, arguments):
         await client.close()
 
 
+class PoolConfig(TestConfig):
+    VALIDATION_POOL_MIN_BODY_SIZE = 0
+
+
+@pytest.fixture
+async def pool_api_client(aiohttp_client, arguments):
+    """
+    Client of the app validating all request bodies in the process pool
+    """
+
+    arguments.validation_pool_size = 1
+    app = init_app(arguments, PoolConfig())
+
+    client = await aiohttp_client(app, server_kwargs={"port": arguments.api_port})
+
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
 @pytest.fixture
 def migrated_postgres_connection(migrated_postgres):
     """